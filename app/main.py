@@ -1,17 +1,34 @@
 import os
+import json
+import hashlib
+from collections import OrderedDict
 import streamlit as st
 from dotenv import load_dotenv
 
-from rag.ingest import ingest_path
-from rag.retrieve import retrieve_with_rerank
-from rag.store import get_store  # kept for future use (ensures DB path exists)
+from rag.retrieve import retrieve_with_rerank, warmup as warm_index
+from rag.catalog import get_catalog
+from rag.jobs import IngestJobs
+from rag import rerank as reranker
+from rag import trace
 
 load_dotenv()
 LLM_PROVIDER = os.getenv("ACADEMYRAG_LLM_PROVIDER", "openai").lower()
+# With a running `python -m rag.server`, query it instead of loading the models here.
+SERVER_URL = os.getenv("ACADEMYRAG_SERVER_URL")
 
+# Per-request timing breakdowns ("Performance" below each result); set
+# ACADEMYRAG_TRACE=0 to turn tracing off.
+if os.getenv("ACADEMYRAG_TRACE", "1") != "0":
+    trace.enable()
+
+if SERVER_URL:
+    from rag.client import Client
+    client = Client(SERVER_URL)
+    retrieve_with_rerank = client.retrieve_with_rerank
+    stream_answer, stream_summary, generate_quiz = client.stream_answer, client.stream_summary, client.generate_quiz
 # Import generation utils only if we actually have an LLM provider
-if LLM_PROVIDER != "none":
-    from rag.generate import generate_answer, generate_summary, generate_quiz
+elif LLM_PROVIDER != "none":
+    from rag.generate import stream_answer, stream_summary, generate_quiz
 
 st.set_page_config(page_title="AcademyRAG", layout="wide")
 st.title("AcademyRAG - Learning Assistant")
@@ -28,6 +45,30 @@ if LLM_PROVIDER == "none":
 db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
 chunk_size = int(os.getenv("ACADEMYRAG_CHUNK_SIZE", "900"))
 chunk_overlap = int(os.getenv("ACADEMYRAG_CHUNK_OVERLAP", "120"))
+raw_dir = "data/raw"
+
+# Shared by every session of this process: models, store handle, BM25 index,
+# catalog and the ingest queue are loaded once, not on each rerun.
+@st.cache_resource(show_spinner="Loading models and index...")
+def load_index():
+    return warm_index()
+
+@st.cache_resource
+def ingest_jobs():
+    if SERVER_URL:
+        # The server reads the files itself, so it must share this filesystem.
+        def runner(path, files, progress):
+            return client.ingest(os.path.abspath(path), chunk_size, chunk_overlap,
+                                 files=[os.path.abspath(f) for f in files] if files is not None else None)
+        return IngestJobs(chunk_size, chunk_overlap, runner=runner)
+    return IngestJobs(chunk_size, chunk_overlap)
+
+if not SERVER_URL:
+    load_index()
+jobs = ingest_jobs()
+
+def _digest(data) -> str:
+    return hashlib.sha256(data).hexdigest()
 
 st.sidebar.header("Indexer")
 uploaded = st.sidebar.file_uploader(
@@ -35,17 +76,88 @@ uploaded = st.sidebar.file_uploader(
     type=["pdf", "pptx", "md", "txt"],
     accept_multiple_files=True
 )
+pending = st.session_state.setdefault("to_ingest", {})
 if uploaded:
-    raw_dir = "data/raw"
     os.makedirs(raw_dir, exist_ok=True)
+    saved = 0
     for f in uploaded:
-        with open(os.path.join(raw_dir, f.name), "wb") as out:
-            out.write(f.getbuffer())
-    st.sidebar.success(f"Saved {len(uploaded)} files to {raw_dir}.")
-    if st.sidebar.button("Ingest uploaded docs"):
-        with st.spinner("Ingesting..."):
-            ingest_path(raw_dir, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        st.sidebar.success("Ingestion complete.")
+        # Reruns hand back the same uploads; only write files that are new or changed.
+        dest = os.path.join(raw_dir, f.name)
+        data = f.getbuffer()
+        digest = _digest(data)
+        if os.path.isfile(dest):
+            with open(dest, "rb") as fh:
+                if _digest(fh.read()) == digest:
+                    continue
+        with open(dest, "wb") as out:
+            out.write(data)
+        pending[dest] = digest
+        saved += 1
+    if saved:
+        st.sidebar.success(f"Saved {saved} new files to {raw_dir}.")
+if pending and st.sidebar.button(f"Ingest {len(pending)} new files"):
+    st.session_state.setdefault("watch_jobs", []).append(jobs.submit(raw_dir, files=sorted(pending)).id)
+    pending.clear()
+
+@st.fragment(run_every=1.0 if jobs.active() else None)
+def render_jobs():
+    watched = set(st.session_state.get("watch_jobs", []))
+    for job in jobs.jobs()[:5]:
+        if job.active:
+            st.progress(job.fraction(), text=f"Ingest #{job.id}: {job.describe()}")
+        elif job.id in watched:
+            (st.error if job.status == "failed" else st.success)(f"Ingest #{job.id} {job.describe()}")
+    if any(j.id in watched and not j.active for j in jobs.jobs()):
+        if st.session_state.get("jobs_seen") != jobs.generation:
+            st.session_state["jobs_seen"] = jobs.generation
+            st.rerun()  # pick up the new documents in the filter pickers
+
+with st.sidebar:
+    render_jobs()
+
+st.sidebar.header("Filter")
+if SERVER_URL:
+    opts = client.catalog()
+    doc_titles, file_types = opts["titles"], opts["file_types"]
+else:
+    catalog = get_catalog()
+    doc_titles, file_types = catalog.titles(), catalog.file_types()
+sel_titles = st.sidebar.multiselect("Documents", doc_titles, placeholder="All documents")
+sel_types = st.sidebar.multiselect("File types", file_types, placeholder="All types")
+sel_prefix = st.sidebar.text_input("Path prefix", placeholder="e.g. data/raw/strategy/")
+page_from = st.sidebar.number_input("From page", min_value=0, value=0, help="0 = no lower bound")
+page_to = st.sidebar.number_input("To page", min_value=0, value=0, help="0 = no upper bound")
+filters = {
+    "doc_title": sel_titles or None,
+    "file_type": sel_types or None,
+    "path_prefix": sel_prefix.strip() or None,
+    "page_min": int(page_from) or None,
+    "page_max": int(page_to) or None,
+}
+filters = {key: val for key, val in filters.items() if val is not None} or None
+
+MEMO_SIZE = 32
+
+def retrieve(query, top_k):
+    """
+    retrieve_with_rerank() memoized per session. With the reranker on, the
+    cross-encoder scores every candidate anyway, so all of them are kept and
+    any Top-K up to the candidate count is a prefix of the cached ranking.
+    Entries go stale when an ingest job finishes.
+    """
+    memo = st.session_state.setdefault("retrieval_memo", OrderedDict())
+    key = (query, json.dumps(filters, sort_keys=True), jobs.generation)
+    hit = memo.get(key)
+    if hit is not None and (hit[0] == top_k or (hit[2] and top_k <= hit[0])):
+        memo.move_to_end(key)
+        return hit[1][:top_k]
+    prefix = not SERVER_URL and reranker.enabled() and top_k <= reranker.default_candidates()
+    k = reranker.default_candidates() if prefix else top_k
+    docs = retrieve_with_rerank(query, top_k=k, filters=filters)
+    memo[key] = (k, docs, prefix)
+    while len(memo) > MEMO_SIZE:
+        memo.popitem(last=False)
+    return docs[:top_k]
 
 # Helper to render retrieved snippets (used in no-LLM mode)
 def render_retrieved_snippets(docs, max_chars=800):
@@ -59,11 +171,34 @@ def render_retrieved_snippets(docs, max_chars=800):
         if slide:
             loc = f"{loc} — {slide}" if loc else slide
         st.markdown(f"**[{i}] {title}** {loc}")
+        render_aliases([a["metadata"] for a in d.get("aliases", [])])
         txt = d.get("text", "")
         if len(txt) > max_chars:
             txt = txt[:max_chars] + "…"
         st.write(txt)
 
+def render_aliases(metas):
+    """The other places a near-duplicate passage appears (rag/dedup.py)."""
+    if not metas:
+        return
+    locs = []
+    for m in metas:
+        page = m.get("page")
+        locs.append(f"{m.get('doc_title', 'Document')} p.{page}" if page is not None else m.get("doc_title", "Document"))
+    st.caption("Also in: " + "; ".join(locs))
+
+def render_performance(root):
+    rows = root.breakdown()
+    if not rows:
+        return
+    with st.expander("Performance"):
+        for r in rows:
+            attrs = ", ".join(f"{k}={v}" for k, v in r["attrs"].items())
+            indent = "  " * r["depth"]
+            st.text(f"{indent}{r['name']:<18} {r['dur_ms']:9.1f} ms  {attrs}")
+        st.caption("Spans of this request in start order, nested by caller. "
+                   "Run `python -m rag.trace --summary` for percentiles across requests.")
+
 # Tabs
 tab1, tab2, tab3 = st.tabs(["Ask", "Teach Me", "Quiz Me"])
 
@@ -72,70 +207,78 @@ with tab1:
     q = st.text_input("Your question", placeholder="e.g., What are common cost drivers in a value chain?")
     k = st.slider("Top-K retrieval", 2, 12, 6)
     if st.button("Get Answer", type="primary"):
-        docs = retrieve_with_rerank(q, top_k=k)
-        if not docs:
-            st.warning("No relevant context found. Try ingesting more documents.")
-        else:
-            if LLM_PROVIDER == "none":
-                render_retrieved_snippets(docs)
+        with trace.span("request", tab="ask", top_k=k) as root:
+            docs = retrieve(q, k)
+            if not docs:
+                st.warning("No relevant context found. Try ingesting more documents.")
             else:
-                ans = generate_answer(q, docs)
-                st.markdown("### Answer")
-                st.write(ans["text"])
-                with st.expander("Citations"):
-                    for i, c in enumerate(ans["citations"], 1):
-                        title = c.get("doc_title", "Document")
-                        page = c.get("page")
-                        slide = c.get("slide_title")
-                        loc = f"p.{page}" if page is not None else ""
-                        if slide:
-                            loc = f"{loc} — {slide}" if loc else slide
-                        st.markdown(f"**[{i}] {title}** {loc}")
+                if LLM_PROVIDER == "none":
+                    render_retrieved_snippets(docs)
+                else:
+                    ans = stream_answer(q, docs)
+                    st.markdown("### Answer")
+                    st.write_stream(ans["stream"])
+                    with st.expander("Citations"):
+                        for i, c in enumerate(ans["citations"], 1):
+                            title = c.get("doc_title", "Document")
+                            page = c.get("page")
+                            slide = c.get("slide_title")
+                            loc = f"p.{page}" if page is not None else ""
+                            if slide:
+                                loc = f"{loc} — {slide}" if loc else slide
+                            st.markdown(f"**[{i}] {title}** {loc}")
+                            render_aliases(c.get("aliases"))
+        render_performance(root)
 
 with tab2:
     st.subheader("Teach me a topic")
     topic = st.text_input("Topic", placeholder="e.g., Market entry basics")
     k2 = st.slider("Top-K retrieval (Teach)", 3, 15, 8)
     if st.button("Generate Summary"):
-        docs = retrieve_with_rerank(topic, top_k=k2)
-        if not docs:
-            st.warning("No relevant context found.")
-        else:
-            if LLM_PROVIDER == "none":
-                render_retrieved_snippets(docs)
+        with trace.span("request", tab="teach", top_k=k2) as root:
+            docs = retrieve(topic, k2)
+            if not docs:
+                st.warning("No relevant context found.")
             else:
-                res = generate_summary(topic, docs)
-                st.markdown("### Guided Summary")
-                st.write(res["text"])
-                with st.expander("Citations"):
-                    for i, c in enumerate(res["citations"], 1):
-                        title = c.get("doc_title", "Document")
-                        page = c.get("page")
-                        slide = c.get("slide_title")
-                        loc = f"p.{page}" if page is not None else ""
-                        if slide:
-                            loc = f"{loc} — {slide}" if loc else slide
-                        st.markdown(f"**[{i}] {title}** {loc}")
+                if LLM_PROVIDER == "none":
+                    render_retrieved_snippets(docs)
+                else:
+                    res = stream_summary(topic, docs)
+                    st.markdown("### Guided Summary")
+                    st.write_stream(res["stream"])
+                    with st.expander("Citations"):
+                        for i, c in enumerate(res["citations"], 1):
+                            title = c.get("doc_title", "Document")
+                            page = c.get("page")
+                            slide = c.get("slide_title")
+                            loc = f"p.{page}" if page is not None else ""
+                            if slide:
+                                loc = f"{loc} — {slide}" if loc else slide
+                            st.markdown(f"**[{i}] {title}** {loc}")
+                            render_aliases(c.get("aliases"))
+        render_performance(root)
 
 with tab3:
     st.subheader("Quiz me")
     topic_q = st.text_input("Topic for quiz", placeholder="e.g., Cost drivers")
     k3 = st.slider("Top-K retrieval (Quiz)", 3, 15, 8)
     if st.button("Make Quiz"):
-        docs = retrieve_with_rerank(topic_q, top_k=k3)
-        if not docs:
-            st.warning("No relevant context found.")
-        else:
-            if LLM_PROVIDER == "none":
-                st.info("Quizzes require an LLM. Showing top matches instead:")
-                render_retrieved_snippets(docs)
+        with trace.span("request", tab="quiz", top_k=k3) as root:
+            docs = retrieve(topic_q, k3)
+            if not docs:
+                st.warning("No relevant context found.")
             else:
-                quiz = generate_quiz(topic_q, docs)
-                st.markdown("### 5 Questions")
-                for i, q_ in enumerate(quiz.get("questions", []), 1):
-                    st.markdown(f"**{i}. {q_['question']}**")
-                    for opt in q_["options"]:
-                        st.markdown(f"- {opt}")
-                    with st.expander("Answer & rationale"):
-                        st.markdown(f"**Answer:** {q_['answer']}")
-                        st.write(q_["rationale"])
+                if LLM_PROVIDER == "none":
+                    st.info("Quizzes require an LLM. Showing top matches instead:")
+                    render_retrieved_snippets(docs)
+                else:
+                    quiz = generate_quiz(topic_q, docs)
+                    st.markdown("### 5 Questions")
+                    for i, q_ in enumerate(quiz.get("questions", []), 1):
+                        st.markdown(f"**{i}. {q_['question']}**")
+                        for opt in q_["options"]:
+                            st.markdown(f"- {opt}")
+                        with st.expander("Answer & rationale"):
+                            st.markdown(f"**Answer:** {q_['answer']}")
+                            st.write(q_["rationale"])
+        render_performance(root)
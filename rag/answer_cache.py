@@ -0,0 +1,246 @@
+"""
+Persistent semantic cache for generated answers, summaries and quizzes.
+
+An entry is keyed by the prompt kind (which includes the LLM model), the set
+of chunk ids the answer was generated from, and the question/topic. A lookup
+hits when the context is the same and either the normalized text matches
+exactly or the query embedding's cosine similarity to a cached query is at
+least the threshold. Hits return the cached citations too, so [n] markers in
+the text keep pointing at the right sources even if the chunks came back in
+a different order.
+
+Entries that reference a chunk are dropped when ingest deletes or rewrites
+that chunk. Everything lives in one SQLite file next to the index:
+
+- answer_cache.sqlite  entries, entry -> chunk id links, hit/miss counters
+
+Env:
+  ACADEMYRAG_ANSWER_CACHE              0 disables it (default 1)
+  ACADEMYRAG_ANSWER_CACHE_THRESHOLD    cosine for a semantic hit, default 0.95
+  ACADEMYRAG_ANSWER_CACHE_TTL          seconds, default 604800 (7 days)
+  ACADEMYRAG_ANSWER_CACHE_MAX_ENTRIES  default 5000, least-recently-used evicted
+
+CLI:
+  python -m rag.answer_cache --stats   # entries, hit rate, latency saved
+  python -m rag.answer_cache --clear
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from . import trace
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    context TEXT NOT NULL,
+    query TEXT NOT NULL,
+    vec BLOB,
+    response TEXT NOT NULL,
+    generate_ms REAL NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_chunks (
+    entry INTEGER NOT NULL,
+    chunk TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_context ON entries(kind, context);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used);
+CREATE INDEX IF NOT EXISTS entry_chunks_chunk ON entry_chunks(chunk);
+CREATE INDEX IF NOT EXISTS entry_chunks_entry ON entry_chunks(entry);
+"""
+
+_SPACE_RE = re.compile(r"\s+")
+_COUNTERS = ("exact_hits", "semantic_hits", "misses", "saved_ms")
+
+def normalize_query(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip().lower().rstrip("?.! ")
+
+def context_key(chunk_ids: Sequence[str]) -> str:
+    h = hashlib.sha256()
+    for cid in sorted(set(chunk_ids)):
+        h.update(cid.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _unit(vec) -> Optional[np.ndarray]:
+    if vec is None:
+        return None
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else None
+
+class AnswerCache:
+    def __init__(self, path: str, threshold: float = 0.95, ttl: float = 7 * 86400,
+                 max_entries: int = 5000):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def _bump(self, **deltas: float):
+        self._db.executemany(
+            "INSERT INTO counters(name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(deltas.items()))
+
+    def _drop(self, entry_ids: Sequence[int]) -> int:
+        rows = [(e,) for e in entry_ids]
+        self._db.executemany("DELETE FROM entries WHERE id=?", rows)
+        self._db.executemany("DELETE FROM entry_chunks WHERE entry=?", rows)
+        return len(rows)
+
+    def lookup(self, kind: str, query: str, chunk_ids: Sequence[str], vec=None) -> Optional[Dict[str, Any]]:
+        """The cached response for this kind, context and query, or None."""
+        ctx = context_key(chunk_ids)
+        norm = normalize_query(query)
+        q = _unit(vec)
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, query, vec, response, generate_ms, created FROM entries WHERE kind=? AND context=?",
+                (kind, ctx)).fetchall()
+            expired = [r[0] for r in rows if now - r[5] > self.ttl]
+            live = [r for r in rows if now - r[5] <= self.ttl]
+            best, how = None, None
+            for r in live:
+                if r[1] == norm:
+                    best, how = r, "exact_hits"
+                    break
+            if best is None and q is not None:
+                cands = [r for r in live if r[2] is not None and len(r[2]) == q.nbytes]
+                if cands:
+                    sims = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in cands]) @ q
+                    i = int(sims.argmax())
+                    if sims[i] >= self.threshold:
+                        best, how = cands[i], "semantic_hits"
+            if expired:
+                self._drop(expired)
+            trace.count("answer_cache_lookups_total", result=how or "miss")
+            if best is None:
+                self._bump(misses=1)
+            else:
+                self._db.execute("UPDATE entries SET last_used=? WHERE id=?", (now, best[0]))
+                self._bump(**{how: 1, "saved_ms": best[4]})
+            self._db.commit()
+        return None if best is None else json.loads(best[3])
+
+    def put(self, kind: str, query: str, chunk_ids: Sequence[str], vec, response: Dict[str, Any],
+            generate_ms: float):
+        q = _unit(vec)
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO entries(kind, context, query, vec, response, generate_ms, created, last_used) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (kind, context_key(chunk_ids), normalize_query(query), None if q is None else q.tobytes(),
+                 json.dumps(response, ensure_ascii=False), generate_ms, now, now))
+            self._db.executemany("INSERT INTO entry_chunks(entry, chunk) VALUES (?,?)",
+                                 [(cur.lastrowid, cid) for cid in set(chunk_ids)])
+            over = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if over > 0:
+                self._drop([r[0] for r in self._db.execute(
+                    "SELECT id FROM entries ORDER BY last_used LIMIT ?", (over,))])
+            self._db.commit()
+
+    def invalidate(self, chunk_ids: Sequence[str]) -> int:
+        """Drop every entry generated from any of these chunks."""
+        ids = list(set(chunk_ids))
+        if not ids:
+            return 0
+        with self._lock:
+            hit = set()
+            for s in range(0, len(ids), 500):
+                part = ids[s:s + 500]
+                hit.update(r[0] for r in self._db.execute(
+                    f"SELECT DISTINCT entry FROM entry_chunks WHERE chunk IN ({','.join('?' * len(part))})", part))
+            n = self._drop(sorted(hit))
+            self._db.commit()
+        return n
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            n = self._drop([r[0] for r in self._db.execute(
+                "SELECT id FROM entries WHERE created < ?", (time.time() - self.ttl,))])
+            self._db.commit()
+        return n
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM entry_chunks")
+            self._db.execute("DELETE FROM counters")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            c = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        out = {"entries": entries, "max_entries": self.max_entries, "threshold": self.threshold}
+        out.update({k: c.get(k, 0) for k in _COUNTERS})
+        hits = out["exact_hits"] + out["semantic_hits"]
+        lookups = hits + out["misses"]
+        out["hit_rate"] = hits / lookups if lookups else 0.0
+        return out
+
+_cache = None
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    global _cache
+    if os.getenv("ACADEMYRAG_ANSWER_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+        _cache = AnswerCache(
+            os.path.join(db_dir, "answer_cache.sqlite"),
+            threshold=float(os.getenv("ACADEMYRAG_ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("ACADEMYRAG_ANSWER_CACHE_TTL", str(7 * 86400))),
+            max_entries=int(os.getenv("ACADEMYRAG_ANSWER_CACHE_MAX_ENTRIES", "5000")),
+        )
+    return _cache
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Inspect and maintain the answer cache.")
+    ap.add_argument("--stats", action="store_true", help="Print entries, hit rate and latency saved")
+    ap.add_argument("--purge", action="store_true", help="Drop expired entries")
+    ap.add_argument("--clear", action="store_true", help="Drop every entry and reset the counters")
+    args = ap.parse_args()
+
+    cache = get_answer_cache()
+    if cache is None:
+        print("[INFO] Answer cache disabled (ACADEMYRAG_ANSWER_CACHE=0).")
+    else:
+        if args.clear:
+            cache.clear()
+            print("[OK] Cleared the answer cache.")
+        if args.purge:
+            print(f"[OK] Purged {cache.purge_expired()} expired entries.")
+        if args.stats or not (args.clear or args.purge):
+            s = cache.stats()
+            print(f"[STATS] entries={s['entries']}/{s['max_entries']} threshold={s['threshold']} "
+                  f"hit_rate={s['hit_rate']:.1%} (exact={s['exact_hits']:.0f}, semantic={s['semantic_hits']:.0f}, "
+                  f"misses={s['misses']:.0f}) saved={s['saved_ms'] / 1000.0:.1f}s")
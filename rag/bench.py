@@ -0,0 +1,406 @@
+"""
+Offline performance benchmarks for AcademyRAG.
+
+Builds a synthetic corpus (MD/TXT files plus generated PDFs) in a scratch
+directory, embeds it with the deterministic "stub" provider (no network or
+model download), and times each scenario in its own process so peak RSS is
+per scenario:
+
+- chunk     chunk_text (and chunk_spans when the tokenizer is available)
+- ingest    ingest_path on a fresh index, then an unchanged re-run
+- retrieve  retrieve_with_rerank per query, and retrieve_many in batches
+- eval      evaluate_dataset over a generated JSONL (no answer generation)
+- startup   wall time of `academyrag --help` and of importing the main
+            modules, each in a fresh interpreter (best of 3)
+- embed     only on request (needs ACADEMYRAG_ST_MODEL): texts/s of the
+            onnx and torch providers (rag/cpu_embed.py) on corpus
+            paragraphs, with speedup, cosine similarity and neighbour
+            recall@10 against the fp32 sentence-transformers model
+
+Results are written as JSON. --compare checks them against a stored
+baseline and exits non-zero if a throughput/latency/memory figure regressed
+by more than --threshold.
+
+CLI:
+  python -m rag.bench --out bench.json
+  python -m rag.bench --docs 400 --pages 8 --compare bench.json
+  python -m rag.bench --scenarios embed --embed_texts 2000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+SCENARIOS = ("chunk", "ingest", "retrieve", "eval", "startup")
+# Not run by default: they need a real model.
+OPTIONAL_SCENARIOS = ("embed",)
+
+# ---- synthetic corpus ---------------------------------------------------------
+
+_TOPICS = [
+    "cost drivers", "value chain", "market entry", "scale economies", "learning curve",
+    "capacity utilization", "pricing strategy", "supplier power", "buyer power", "switching costs",
+    "network effects", "vertical integration", "diversification", "core competence", "differentiation",
+    "cost leadership", "five forces", "strategic groups", "first mover advantage", "platform strategy",
+]
+
+def _vocabulary(rng: random.Random, size: int = 3000) -> List[str]:
+    syll = ["ka", "lo", "mi", "ten", "ra", "vis", "do", "mer", "sul", "pa", "che", "ro", "nat", "ig", "bel", "os"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syll) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def _paragraph(rng: random.Random, vocab: List[str], topic: str, code: str) -> str:
+    sents = []
+    for _ in range(rng.randint(3, 6)):
+        words = [rng.choice(vocab) for _ in range(rng.randint(8, 18))]
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words)), topic)
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), code)
+        sents.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+    return " ".join(sents)
+
+def _page(rng: random.Random, vocab: List[str], topic: str, code: str, chars: int) -> str:
+    parts = [f"## {topic.title()} {code}"]
+    size = 0
+    while size < chars:
+        para = _paragraph(rng, vocab, topic, code)
+        parts.append(para)
+        size += len(para)
+    return "\n\n".join(parts)
+
+def _write_pdf(path: str, pages: List[str]):
+    import fitz  # pymupdf
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=7)
+    doc.save(path)
+    doc.close()
+
+def make_corpus(root: str, docs: int = 120, pages: int = 4, page_chars: int = 2500,
+                pdf_ratio: float = 0.25, queries: int = 200, seed: int = 13) -> Dict[str, Any]:
+    """
+    Write `docs` files under root/corpus (MD, TXT and - for pdf_ratio of them -
+    PDFs with `pages` pages) and a matching eval set at root/eval.jsonl.
+    Each document carries a unique code word so every query has one gold doc.
+    """
+    rng = random.Random(seed)
+    vocab = _vocabulary(rng)
+    corpus = os.path.join(root, "corpus")
+    os.makedirs(corpus, exist_ok=True)
+    meta = []
+    total_bytes = 0
+    for d in range(docs):
+        topic = _TOPICS[d % len(_TOPICS)]
+        code = f"zx{d:05d}"
+        texts = [_page(rng, vocab, topic, code, page_chars) for _ in range(pages)]
+        kind = "pdf" if rng.random() < pdf_ratio else rng.choice(["md", "txt"])
+        name = f"{topic.replace(' ', '_')}_{d:05d}.{kind}"
+        path = os.path.join(corpus, name)
+        if kind == "pdf":
+            _write_pdf(path, texts)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(texts))
+        total_bytes += os.path.getsize(path)
+        meta.append((name, topic, code))
+
+    eval_path = os.path.join(root, "eval.jsonl")
+    with open(eval_path, "w", encoding="utf-8") as f:
+        for q in range(queries):
+            name, topic, code = meta[rng.randrange(len(meta))]
+            f.write(json.dumps({"query": f"{topic} {code}",
+                                "gold": [{"doc_title": name, "page": None}]}) + "\n")
+    return {"corpus": corpus, "eval": eval_path, "docs": docs, "bytes": total_bytes}
+
+# ---- scenarios ----------------------------------------------------------------
+
+def _pcts(ms: List[float]) -> Dict[str, float]:
+    a = np.asarray(ms, dtype=np.float64)
+    return {"p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99))}
+
+def _queries(eval_path: str) -> List[str]:
+    with open(eval_path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+def _corpus_texts(corpus: str) -> List[str]:
+    from .ingest import _iter_records
+    texts = []
+    for name in sorted(os.listdir(corpus)):
+        texts.extend(rec["text"] for rec in _iter_records(os.path.join(corpus, name)))
+    return texts
+
+def bench_chunk(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from .chunk import chunk_text, chunk_spans, _backend, _tokenizer_name
+    texts = _corpus_texts(ctx["corpus"])
+    mb = sum(len(t) for t in texts) / 1e6
+    out = {"pages": len(texts), "mb": mb}
+    fns = [("chunk_text", chunk_text)]
+    if args.chunker == "tokens":
+        _backend(_tokenizer_name())  # exclude tokenizer load
+        fns.append(("chunk_spans", chunk_spans))
+    for name, fn in fns:
+        t0 = time.perf_counter()
+        n = sum(len(fn(t, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)) for t in texts)
+        secs = time.perf_counter() - t0
+        out[name] = {"chunks": n, "secs": secs, "chunks_per_s": n / secs, "mb_per_s": mb / secs}
+    return out
+
+def bench_ingest(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from .ingest import ingest_path
+    t0 = time.perf_counter()
+    chunks = ingest_path(ctx["corpus"], chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                         workers=args.workers, chunker=args.chunker)
+    secs = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ingest_path(ctx["corpus"], chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                workers=args.workers, chunker=args.chunker)
+    noop = time.perf_counter() - t0
+    return {"docs": ctx["docs"], "chunks": chunks, "secs": secs,
+            "docs_per_s": ctx["docs"] / secs, "chunks_per_s": chunks / secs,
+            "mb_per_s": ctx["bytes"] / 1e6 / secs, "reingest_noop_s": noop}
+
+def bench_retrieve(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from .retrieve import retrieve_with_rerank, retrieve_many
+    from .embed import clear_query_cache
+    queries = _queries(ctx["eval"])
+    retrieve_with_rerank("warmup", top_k=args.k)
+    clear_query_cache()
+    lat = []
+    t0 = time.perf_counter()
+    for q in queries:
+        t1 = time.perf_counter()
+        retrieve_with_rerank(q, top_k=args.k)
+        lat.append((time.perf_counter() - t1) * 1000.0)
+    secs = time.perf_counter() - t0
+    clear_query_cache()
+    t0 = time.perf_counter()
+    for start in range(0, len(queries), args.batch_size):
+        retrieve_many(queries[start:start + args.batch_size], top_k=args.k)
+    batch_secs = time.perf_counter() - t0
+    return {"queries": len(queries), "qps": len(queries) / secs, **_pcts(lat),
+            "batched_qps": len(queries) / batch_secs}
+
+def bench_eval(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from .eval import evaluate_dataset
+    from .embed import clear_query_cache
+    clear_query_cache()
+    t0 = time.perf_counter()
+    report = evaluate_dataset(ctx["eval"], default_k=args.k, judge_answer=False, batch_size=args.batch_size)
+    secs = time.perf_counter() - t0
+    n = report["n"]
+    macro = report["macro"]
+    return {"queries": n, "secs": secs, "queries_per_s": n / secs,
+            "retrieve_p50_ms": report["latency"]["retrieve_ms"]["p50"],
+            "retrieve_p99_ms": report["latency"]["retrieve_ms"]["p99"],
+            "MRR": macro.get("MRR", 0.0), "nDCG@k": macro.get("nDCG@k", 0.0)}
+
+# name -> interpreter arguments; each is timed in a fresh process.
+_STARTUP = (
+    ("python", ["-c", "pass"]),
+    ("cli_help", ["-m", "rag.cli", "--help"]),
+    ("import_ingest", ["-c", "import rag.ingest"]),
+    ("import_retrieve", ["-c", "import rag.retrieve"]),
+    ("import_generate", ["-c", "import rag.generate"]),
+    ("import_eval", ["-c", "import rag.eval"]),
+    ("import_server", ["-c", "import rag.server"]),
+)
+# Backends that must only load on first use.
+_HEAVY = ("torch", "sentence_transformers", "openai", "chromadb", "tiktoken", "fitz", "pptx")
+
+def bench_startup(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.getenv("PYTHONPATH")])))
+
+    def wall_ms(argv: List[str]) -> float:
+        best = float("inf")
+        for _ in range(3):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, *argv], env=env, cwd=root, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            best = min(best, (time.perf_counter() - t0) * 1000.0)
+        return best
+
+    out: Dict[str, Any] = {f"{name}_ms": wall_ms(argv) for name, argv in _STARTUP}
+    probe = "import sys, rag.eval, rag.ingest, rag.server; print(','.join(m for m in %r if m in sys.modules))" % (_HEAVY,)
+    loaded = subprocess.run([sys.executable, "-c", probe], env=env, cwd=root, check=True,
+                            capture_output=True, text=True).stdout.strip()
+    out["eager_backends"] = loaded.split(",") if loaded else []
+    if out["eager_backends"]:
+        print(f"[WARN] Imported at startup: {loaded}")
+    return out
+
+def bench_embed(ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    from .cpu_embed import check, precision
+    paras = [p for t in _corpus_texts(ctx["corpus"]) for p in t.split("\n\n") if p.strip()]
+    texts = paras[:args.embed_texts]
+    model = os.getenv("ACADEMYRAG_ST_MODEL", "all-MiniLM-L6-v2")
+    out = check(texts, model, ["onnx", "torch"])
+    out["precision"] = precision()
+    return out
+
+_RUNNERS = {"chunk": bench_chunk, "ingest": bench_ingest, "retrieve": bench_retrieve, "eval": bench_eval,
+            "startup": bench_startup, "embed": bench_embed}
+
+def _child(name: str, ctx: Dict[str, Any], args, conn):
+    try:
+        res = _RUNNERS[name](ctx, args)
+        res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        res["workers_peak_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        conn.send(("ok", res))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+def run_scenario(name: str, ctx: Dict[str, Any], args) -> Dict[str, Any]:
+    """Run one scenario in a forked process so its peak RSS is its own."""
+    mp = multiprocessing.get_context("fork")
+    recv, send = mp.Pipe(duplex=False)
+    proc = mp.Process(target=_child, args=(name, ctx, args, send))
+    proc.start()
+    send.close()
+    try:
+        status, res = recv.recv()
+    except EOFError:
+        status, res = "error", None
+    proc.join()
+    if res is None:
+        res = f"scenario process exited with code {proc.exitcode}"
+    if status != "ok":
+        raise RuntimeError(f"{name}: {res}")
+    return res
+
+# ---- baseline comparison ------------------------------------------------------
+
+def _direction(key: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if not compared."""
+    if key.endswith("_per_s") or key.endswith("qps"):
+        return 1
+    if key.endswith("_ms") or key.endswith("_s") or key.endswith("_mb") or key == "secs":
+        return -1
+    return 0
+
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, val in d.items():
+        if isinstance(val, dict):
+            out.update(_flatten(val, f"{prefix}{key}."))
+        elif isinstance(val, (int, float)) and not isinstance(val, bool):
+            out[prefix + key] = float(val)
+    return out
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.10) -> List[Tuple[str, float, float, float]]:
+    """Return (metric, baseline, current, relative change) for each regression beyond threshold."""
+    cur, base = _flatten(current["scenarios"]), _flatten(baseline["scenarios"])
+    regressions = []
+    for key in sorted(set(cur) & set(base)):
+        sign = _direction(key.rsplit(".", 1)[-1])
+        if sign == 0 or base[key] == 0:
+            continue
+        change = (cur[key] - base[key]) / abs(base[key])
+        if sign * change < -threshold:
+            regressions.append((key, base[key], cur[key], change))
+    return regressions
+
+def run(args) -> Dict[str, Any]:
+    work = args.workdir or tempfile.mkdtemp(prefix="academyrag-bench-")
+    os.makedirs(work, exist_ok=True)
+    # Scenario processes inherit these; nothing touches ./data.
+    os.environ["ACADEMYRAG_DB_DIR"] = os.path.join(work, "index")
+    os.environ["ACADEMYRAG_EMBED_CACHE_DIR"] = os.path.join(work, "embed_cache")
+    os.environ["ACADEMYRAG_EMBED_PROVIDER"] = args.provider
+    os.environ["ACADEMYRAG_STORE"] = args.store
+    if not args.rerank:
+        os.environ["ACADEMYRAG_RERANK"] = "0"
+    shutil.rmtree(os.environ["ACADEMYRAG_DB_DIR"], ignore_errors=True)
+    shutil.rmtree(os.environ["ACADEMYRAG_EMBED_CACHE_DIR"], ignore_errors=True)
+
+    t0 = time.perf_counter()
+    ctx = make_corpus(work, docs=args.docs, pages=args.pages, page_chars=args.page_chars,
+                      queries=args.queries, seed=args.seed)
+    print(f"[INFO] Corpus: {ctx['docs']} docs, {ctx['bytes'] / 1e6:0.1f} MB in {time.perf_counter() - t0:0.1f}s → {work}")
+
+    names = [s for s in args.scenarios.split(",") if s]
+    if ("retrieve" in names or "eval" in names) and "ingest" not in names:
+        names.insert(0, "ingest")  # they need an index
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_scenario(name, ctx, args)
+            print(f"[OK] {name}: " + json.dumps(results[name]))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {k: getattr(args, k) for k in ("docs", "pages", "page_chars", "queries", "seed",
+                                                     "chunk_size", "chunk_overlap", "chunker", "workers",
+                                                     "batch_size", "k", "provider", "store", "rerank")},
+        },
+        "scenarios": results,
+    }
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Offline ingest/query benchmarks.")
+    ap.add_argument("--scenarios", type=str, default=",".join(SCENARIOS),
+                    help="Comma list of " + ",".join(SCENARIOS + OPTIONAL_SCENARIOS))
+    ap.add_argument("--docs", type=int, default=120)
+    ap.add_argument("--pages", type=int, default=4, help="Pages per document")
+    ap.add_argument("--page_chars", type=int, default=2500)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=13)
+    ap.add_argument("--chunk_size", type=int, default=900)
+    ap.add_argument("--chunk_overlap", type=int, default=120)
+    ap.add_argument("--chunker", choices=["tokens", "words"], default="tokens")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--embed_texts", type=int, default=2000, help="Paragraphs embedded by the embed scenario")
+    ap.add_argument("--provider", type=str, default="stub", help="Embedding provider (default: offline stub)")
+    ap.add_argument("--store", choices=["chroma", "flat"], default=os.getenv("ACADEMYRAG_STORE", "chroma"))
+    ap.add_argument("--rerank", action="store_true", help="Include the cross-encoder (needs the model)")
+    ap.add_argument("--workdir", type=str, default=None, help="Keep corpus and index here instead of a temp dir")
+    ap.add_argument("--out", type=str, default=None, help="Write results JSON here")
+    ap.add_argument("--compare", type=str, default=None, help="Baseline JSON to check for regressions")
+    ap.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression (default 10%%)")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[OK] Wrote {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for key, old, new, change in regressions:
+            print(f"[REGRESSION] {key}: {old:0.3f} -> {new:0.3f} ({change:+0.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"[OK] No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+if __name__ == "__main__":
+    main()
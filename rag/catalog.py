@@ -0,0 +1,291 @@
+"""
+Document catalog: one entry per ingested file, so retrieval filters resolve
+to a slice of the corpus without scanning chunk metadata.
+
+Stored as JSON next to the index ({ACADEMYRAG_DB_DIR}/catalog.json) and
+maintained by ingest:
+{
+  "docs": {
+    "data/raw/strategy_deck.pdf": {
+      "doc_title": "strategy_deck.pdf", "file_type": "pdf", "pages": 24, "chunks": 61,
+      "ingested_at": 1718000000.0,
+      "by_page": {"1": ["strategy_deck.pdf_3f2a..."], ...}   # "" for files without pages
+    }
+  }
+}
+
+Filters (all optional, combined with AND):
+  doc_title            a title or list of titles
+  path_prefix          source path prefix, e.g. "data/raw/strategy/"
+  file_type            an extension or list of them, e.g. "pdf" or ["pdf", "pptx"]
+  page_min / page_max  inclusive page range; files without pages never match one
+
+A filter resolves to a Selection: the matching chunk ids (what the flat store
+and BM25 search) and the equivalent Chroma `where` clause.
+
+CLI:
+  python -m rag.catalog             # list documents
+  python -m rag.catalog --rebuild   # rebuild from the vector store
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from typing import List, Dict, Any, Optional, Iterable
+
+class Selection:
+    """The chunks a filter selects."""
+
+    def __init__(self, ids: List[str], paths: List[str], page_min: Optional[int] = None,
+                 page_max: Optional[int] = None):
+        self.ids = ids
+        self.paths = paths
+        self.page_min = page_min
+        self.page_max = page_max
+        # canonical chunk id -> selected aliases of it, for chunks selected only through an alias
+        self.added: Dict[str, set] = {}
+        self._extra_paths: List[str] = []
+
+    @property
+    def empty(self) -> bool:
+        return not self.ids
+
+    @property
+    def exact(self) -> bool:
+        """False when where() also admits chunks outside ids, which callers must drop."""
+        return not self._extra_paths
+
+    @property
+    def source_paths(self) -> List[str]:
+        """Every file where() admits (a sharded store queries only their shards)."""
+        return list(self.paths) + self._extra_paths
+
+    def where(self) -> Dict[str, Any]:
+        """The same slice as a Chroma metadata filter."""
+        clauses: List[Dict[str, Any]] = [{"source_path": {"$in": list(self.paths)}}]
+        if self.page_min is not None:
+            clauses.append({"page": {"$gte": int(self.page_min)}})
+        if self.page_max is not None:
+            clauses.append({"page": {"$lte": int(self.page_max)}})
+        clause = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+        if self._extra_paths:
+            clause = {"$or": [clause, {"source_path": {"$in": self._extra_paths}}]}
+        return clause
+
+    def add_canonicals(self, canonicals: Dict[str, Any]):
+        """
+        Also select the canonical chunks that selected near-duplicate aliases
+        point at (alias id -> (canonical id, source path), see rag/dedup.py).
+        """
+        have = set(self.ids)
+        paths = set(self.paths)
+        for alias, (canonical, path) in canonicals.items():
+            if canonical in have and canonical not in self.added:
+                continue
+            if canonical not in self.added:
+                self.ids.append(canonical)
+                have.add(canonical)
+            self.added.setdefault(canonical, set()).add(alias)
+            if path not in paths:
+                paths.add(path)
+                self._extra_paths.append(path)
+
+def _as_set(value) -> Optional[set]:
+    if value is None or value == "" or value == []:
+        return None
+    return {value} if isinstance(value, str) else set(value)
+
+def _file_type(path: str) -> str:
+    return os.path.splitext(path)[1].lower().lstrip(".")
+
+class Catalog:
+    def __init__(self, path: str):
+        self.path = path
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        # chunk id -> page for chunks written this run whose file hasn't finished yet
+        self._pending: Dict[str, Any] = {}
+        self._load()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _load(self):
+        if self.exists:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.docs = json.load(f).get("docs", {})
+
+    def _refresh(self):
+        # Pick up a catalog saved by an ingest in another process (or instance).
+        mtime = os.stat(self.path).st_mtime_ns if self.exists else None
+        if mtime != self._mtime:
+            self._load()
+
+    # ---- maintenance (ingest) ---------------------------------------------
+
+    def note_chunks(self, chunks: Iterable[Any]):
+        """Remember the page of each (chunk id, text, metadata) just written."""
+        for cid, _, meta in chunks:
+            self._pending[cid] = meta.get("page")
+
+    def set_file(self, fpath: str, chunk_ids: List[str], store=None):
+        """Record fpath's final chunk list; pages come from this run, the old entry, or the store."""
+        if not chunk_ids:
+            self.docs.pop(fpath, None)  # unsupported or empty files have nothing to filter
+            return
+        known: Dict[str, Any] = {}
+        old = self.docs.get(fpath)
+        if old:
+            for page, ids in old["by_page"].items():
+                for cid in ids:
+                    known[cid] = int(page) if page else None
+        missing = []
+        for cid in chunk_ids:
+            if cid in self._pending:
+                known[cid] = self._pending.pop(cid)
+            elif cid not in known:
+                missing.append(cid)
+        if missing and store is not None:
+            # e.g. chunks committed by an interrupted run before it was resumed
+            got = store.get(ids=missing, include=["metadatas"])
+            for cid, meta in zip(got["ids"], got["metadatas"]):
+                known[cid] = (meta or {}).get("page")
+        by_page: Dict[str, List[str]] = {}
+        for cid in chunk_ids:
+            page = known.get(cid)
+            by_page.setdefault("" if page is None else str(page), []).append(cid)
+        self.docs[fpath] = {
+            "doc_title": os.path.basename(fpath),
+            "file_type": _file_type(fpath),
+            "pages": sum(1 for p in by_page if p),
+            "chunks": len(chunk_ids),
+            "ingested_at": time.time(),
+            "by_page": by_page,
+        }
+
+    def remove(self, fpath: str):
+        self.docs.pop(fpath, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"docs": self.docs}, f)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._pending.clear()
+
+    def rebuild(self, store, page: int = 1000) -> int:
+        """Rebuild every entry from chunk metadata in the store (for indexes built before the catalog)."""
+        pages: Dict[str, Dict[str, Any]] = {}
+        offset = 0
+        while True:
+            res = store.get(include=["metadatas"], limit=page, offset=offset)
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            for cid, meta in zip(ids, res["metadatas"]):
+                meta = meta or {}
+                pages.setdefault(meta.get("source_path", ""), {})[cid] = meta.get("page")
+            offset += len(ids)
+        self.docs = {}
+        for fpath, known in pages.items():
+            self._pending.update(known)
+            self.set_file(fpath, list(known))
+        self.save()
+        return len(self.docs)
+
+    # ---- queries ----------------------------------------------------------
+
+    def titles(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return sorted({d["doc_title"] for d in self.docs.values()})
+
+    def file_types(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return sorted({d["file_type"] for d in self.docs.values()})
+
+    def resolve(self, filters: Optional[Dict[str, Any]]) -> Optional[Selection]:
+        """The Selection for filters, or None when they don't restrict anything."""
+        if not filters:
+            return None
+        titles = _as_set(filters.get("doc_title"))
+        types = _as_set(filters.get("file_type"))
+        if types is not None:
+            types = {t.lower().lstrip(".") for t in types}
+        prefix = filters.get("path_prefix") or None
+        page_min, page_max = filters.get("page_min"), filters.get("page_max")
+        if titles is None and types is None and prefix is None and page_min is None and page_max is None:
+            return None
+        lo = float("-inf") if page_min is None else page_min
+        hi = float("inf") if page_max is None else page_max
+        paged = page_min is not None or page_max is not None
+        ids: List[str] = []
+        paths: List[str] = []
+        with self._lock:
+            self._refresh()
+            for fpath, doc in self.docs.items():
+                if titles is not None and doc["doc_title"] not in titles:
+                    continue
+                if types is not None and doc["file_type"] not in types:
+                    continue
+                if prefix is not None and not fpath.startswith(prefix):
+                    continue
+                paths.append(fpath)
+                for page, chunk_ids in doc["by_page"].items():
+                    if paged and not (page and lo <= int(page) <= hi):
+                        continue
+                    ids.extend(chunk_ids)
+        return Selection(ids, paths, page_min, page_max)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            return {"docs": len(self.docs), "chunks": sum(d["chunks"] for d in self.docs.values()),
+                    "pages": sum(d["pages"] for d in self.docs.values())}
+
+def load_catalog() -> Catalog:
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    return Catalog(os.path.join(db_dir, "catalog.json"))
+
+_catalog = None
+
+def get_catalog() -> Catalog:
+    """Process-wide catalog for retrieval; rebuilt from the store on first use if missing."""
+    global _catalog
+    if _catalog is None:
+        cat = load_catalog()
+        if not cat.exists:
+            from .store import get_store
+            store = get_store()
+            if store.count():
+                n = cat.rebuild(store)
+                print(f"[INFO] Built document catalog for {n} existing documents.")
+        _catalog = cat
+    return _catalog
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Inspect or rebuild the document catalog.")
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild from chunk metadata in the vector store")
+    args = ap.parse_args()
+
+    if args.rebuild:
+        from .store import get_store
+        cat = load_catalog()
+        print(f"[OK] Catalog rebuilt: {cat.rebuild(get_store())} documents.")
+    else:
+        cat = get_catalog()
+    for fpath, doc in sorted(cat.docs.items()):
+        print(f"{fpath}  [{doc['file_type']}] {doc['pages']} pages, {doc['chunks']} chunks")
+    s = cat.stats()
+    print(f"[STATS] {s['docs']} documents, {s['pages']} pages, {s['chunks']} chunks")
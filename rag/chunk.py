@@ -1,4 +1,12 @@
-from typing import List
+import os
+import re
+import time
+import bisect
+import argparse
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
 
 def chunk_text(text: str, chunk_size: int = 900, chunk_overlap: int = 120) -> List[str]:
     # Simple whitespace chunking
@@ -16,3 +24,184 @@ def chunk_text(text: str, chunk_size: int = 900, chunk_overlap: int = 120) -> Li
         if start < 0:
             start = 0
     return chunks
+
+# ---- token-aware chunking ---------------------------------------------------
+#
+# The text is tokenized once; segment boundaries (paragraphs, sentence ends,
+# headings, and - as a weaker fallback - line breaks) are located in the UTF-8
+# bytes and mapped onto cumulative token offsets, so sizing a chunk is a
+# prefix-sum lookup rather than a re-encode.
+
+_SEGMENT_RE = re.compile(rb"\n[ \t]*\n\s*|(?<=[.!?])\s+|\n(?=#{1,6}\s)|(?P<weak>\n)")
+
+@lru_cache(maxsize=4)
+def _encoding(name: str):
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+@lru_cache(maxsize=4)
+def _token_byte_lengths(name: str) -> np.ndarray:
+    enc = _encoding(name)
+    lens = np.zeros(enc.n_vocab, dtype=np.int64)
+    for t in range(enc.n_vocab):
+        try:
+            lens[t] = len(enc.decode_single_token_bytes(t))
+        except KeyError:
+            pass
+    return lens
+
+def _tokenizer_name() -> str:
+    return os.getenv("ACADEMYRAG_TOKENIZER", "cl100k_base")
+
+@lru_cache(maxsize=4)
+def _hf_tokenizer(model_name: str):
+    from transformers import AutoTokenizer
+    if "/" not in model_name and not os.path.isdir(model_name):
+        model_name = f"sentence-transformers/{model_name}"
+    # Only a copy already on disk (the embedder downloads it on first use).
+    return AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+
+@lru_cache(maxsize=4)
+def _backend(name: str) -> Tuple[str, object]:
+    """
+    The tokenizer used for sizing: the tiktoken encoding, else the embedding
+    model's own tokenizer (ACADEMYRAG_ST_MODEL) when it is installed or cached,
+    else plain words - offline hosts without a cached encoding still chunk.
+    """
+    try:
+        _token_byte_lengths(name)
+        return "tiktoken", _encoding(name)
+    except Exception as e:
+        err = e
+    model = os.getenv("ACADEMYRAG_ST_MODEL", "all-MiniLM-L6-v2")
+    try:
+        tok = _hf_tokenizer(model)
+        print(f"[WARN] tiktoken encoding {name} unavailable ({type(err).__name__}); sizing chunks with the {model} tokenizer.")
+        return "hf", tok
+    except Exception:
+        print(f"[WARN] tiktoken encoding {name} unavailable ({type(err).__name__}); sizing chunks in words like the words chunker.")
+        return "words", None
+
+def _token_ends(text: str, raw: bytes) -> np.ndarray:
+    """Cumulative UTF-8 byte offset at which each token of text ends."""
+    name = _tokenizer_name()
+    kind, tok = _backend(name)
+    if kind == "tiktoken":
+        return np.cumsum(_token_byte_lengths(name)[tok.encode_ordinary(text)])
+    if kind == "words":
+        return np.fromiter((m.end() for m in re.finditer(rb"\S+", raw)), dtype=np.int64)
+    ends = np.asarray([e for _, e in tok(text, add_special_tokens=False, return_offsets_mapping=True,
+                                         verbose=False)["offset_mapping"]], dtype=np.int64)
+    if len(raw) != len(text):
+        # Character ends -> byte ends.
+        nbytes = np.fromiter((len(c.encode("utf-8")) for c in text), dtype=np.int64, count=len(text))
+        ends = np.concatenate([[0], np.cumsum(nbytes)])[ends]
+    return np.maximum.accumulate(ends) if len(ends) else ends
+
+def _trim(raw: bytes, start: int, end: int) -> Tuple[int, int]:
+    while start < end and raw[start:start + 1].isspace():
+        start += 1
+    while end > start and raw[end - 1:end].isspace():
+        end -= 1
+    return start, end
+
+def chunk_spans(text: str, chunk_size: int = 900, chunk_overlap: int = 120) -> List[Tuple[int, int]]:
+    """
+    Token-aware chunking. Returns (start, end) character offsets into text.
+    Each span holds at most chunk_size tokens (tiktoken, ACADEMYRAG_TOKENIZER;
+    see _backend for the offline fallbacks) and ends on a paragraph/sentence boundary where one is available (line
+    breaks otherwise); a heading starts a new chunk once the current one is
+    half full. Up to chunk_overlap tokens of trailing segments are repeated
+    at the start of the next chunk.
+    """
+    if not text or text.isspace():
+        return []
+    raw = text.encode("utf-8")
+    tok_end = _token_ends(text, raw)
+
+    bounds, strong = [0], [True]
+    for m in _SEGMENT_RE.finditer(raw):
+        if 0 < m.end() < len(raw):
+            bounds.append(m.end())
+            strong.append(m.lastgroup != "weak")
+    bounds.append(len(raw))
+    n = len(bounds) - 1
+    # P[k] = tokens ending at or before bounds[k]
+    P = np.searchsorted(tok_end, np.asarray(bounds), side="right").tolist()
+
+    byte_spans: List[Tuple[int, int]] = []
+    i = 0
+    while i < n:
+        if P[i + 1] - P[i] > chunk_size:
+            # A single segment over budget: cut it on token boundaries.
+            step = max(1, chunk_size - chunk_overlap)
+            for a in range(P[i], P[i + 1], step):
+                b = min(P[i + 1], a + chunk_size)
+                s = bounds[i] if a == P[i] else int(tok_end[a - 1])
+                e = bounds[i + 1] if b == P[i + 1] else int(tok_end[b - 1])
+                byte_spans.append(_trim(raw, s, e))
+                if b == P[i + 1]:
+                    break
+            i += 1
+            continue
+        j = bisect.bisect_right(P, P[i] + chunk_size, i + 1, n + 1) - 1
+        half = P[i] + chunk_size // 2
+        for k in range(i + 1, j):
+            if P[k] >= half and raw.startswith(b"#", bounds[k]):
+                j = k
+                break
+        if j < n and not strong[j]:
+            for k in range(j - 1, i, -1):
+                if P[k] < half:
+                    break
+                if strong[k]:
+                    j = k
+                    break
+        byte_spans.append(_trim(raw, bounds[i], bounds[j]))
+        if j >= n:
+            break
+        # Step back over whole trailing segments for the overlap.
+        k = j
+        while k - 1 > i and P[j] - P[k - 1] <= chunk_overlap:
+            k -= 1
+        i = k
+
+    byte_spans = [(s, e) for s, e in byte_spans if e > s]
+    if len(raw) == len(text):
+        return byte_spans
+    # Non-ASCII text: map byte offsets back to character offsets.
+    chars = np.cumsum((np.frombuffer(raw, dtype=np.uint8) & 0xC0) != 0x80)
+    return [(int(chars[s - 1]) if s else 0, int(chars[e - 1])) for s, e in byte_spans]
+
+def count_tokens(text: str) -> int:
+    kind, tok = _backend(_tokenizer_name())
+    if kind == "tiktoken":
+        return len(tok.encode_ordinary(text))
+    if kind == "hf":
+        return len(tok(text, add_special_tokens=False, verbose=False)["input_ids"])
+    return (len(text) + 3) // 4  # rough tokens-per-char estimate for context budgets
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark chunk_spans against chunk_text.")
+    ap.add_argument("--file", type=str, default=None, help="Text file to chunk (default: synthetic 1,000 pages)")
+    ap.add_argument("--pages", type=int, default=1000)
+    ap.add_argument("--chunk_size", type=int, default=900)
+    ap.add_argument("--chunk_overlap", type=int, default=120)
+    args = ap.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+    else:
+        para = ("## Cost drivers\n\nScale economies lower unit costs as volume grows. "
+                "Learning effects compound with cumulative output! Capacity utilization "
+                "matters: idle plants carry fixed costs? Linkages across the value chain "
+                "shift costs between activities.\n\n")
+        text = para * (args.pages * 8)  # ~3,000 chars/page
+    _backend(_tokenizer_name())  # exclude tokenizer load from the timing
+
+    for name, fn in (("chunk_text", chunk_text), ("chunk_spans", chunk_spans)):
+        t0 = time.perf_counter()
+        out = fn(text, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+        secs = time.perf_counter() - t0
+        print(f"{name:<12} {len(out):>6} chunks  {secs * 1000:8.1f} ms  ({len(text) / 1e6 / secs:0.1f} MB/s)")
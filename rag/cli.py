@@ -0,0 +1,80 @@
+"""
+The `academyrag` command (installed by setup.py; `python -m rag.cli` works too).
+
+    academyrag ingest --path data/raw          # python -m rag.ingest
+    academyrag query "what drives cost?" --k 6 [--answer] [--server URL]
+    academyrag eval --data eval.jsonl          # python -m rag.eval
+    academyrag bench --out bench.json          # python -m rag.bench
+    academyrag serve --port 8000               # python -m rag.server
+
+ingest, eval, bench and serve hand their arguments to the module's main(),
+so `academyrag ingest --help` lists the same flags as `python -m rag.ingest`.
+Only the module behind the chosen subcommand is imported, and embedding,
+reranking and LLM backends load on first use: `academyrag --help` needs
+nothing but argparse, and no subcommand pulls in torch or the OpenAI SDK
+before it actually embeds or generates. `python -m rag.bench --scenarios
+startup` tracks these times.
+"""
+
+import sys
+import argparse
+from typing import List, Optional
+
+# subcommand -> (module run as __main__, help)
+_MODULES = {
+    "ingest": ("rag.ingest", "Index a folder of PDF/PPTX/MD/TXT files"),
+    "eval": ("rag.eval", "Evaluate retrieval (and answers) on a JSONL dataset"),
+    "bench": ("rag.bench", "Offline ingest/query benchmarks"),
+    "serve": ("rag.server", "Serve retrieval and generation over HTTP"),
+}
+
+def _query(args):
+    if args.server:
+        from .client import Client
+        client = Client(args.server)
+        retrieve, stream_answer = client.retrieve_with_rerank, client.stream_answer
+    else:
+        from .retrieve import retrieve_with_rerank as retrieve
+        from .generate import stream_answer
+    docs = retrieve(args.question, top_k=args.k)
+    if not docs:
+        print("[INFO] No matches; is anything ingested?")
+        return
+    for i, d in enumerate(docs, 1):
+        meta = d.get("metadata", {})
+        print(f"[{i}] {meta.get('doc_title', 'Document')} p.{meta.get('page')}  score={d.get('score')}")
+        if not args.answer:
+            print("    " + d.get("text", "")[:args.chars].replace("\n", " "))
+    if args.answer:
+        print()
+        for tok in stream_answer(args.question, docs)["stream"]:
+            print(tok, end="", flush=True)
+        print()
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    ap = argparse.ArgumentParser(prog="academyrag", description="AcademyRAG command line.")
+    sub = ap.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (module, help_) in _MODULES.items():
+        sub.add_parser(name, help=f"{help_} (python -m {module})", add_help=False)
+    q = sub.add_parser("query", help="Retrieve the top chunks for a question, optionally answer it")
+    q.add_argument("question", type=str)
+    q.add_argument("--k", type=int, default=6)
+    q.add_argument("--answer", action="store_true", help="Stream an answer from the LLM")
+    q.add_argument("--server", type=str, default=None, help="Query a running `academyrag serve` instead")
+    q.add_argument("--chars", type=int, default=200, help="Characters of each chunk to show")
+    args, rest = ap.parse_known_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.command in _MODULES:
+        import importlib
+        sys.argv[0] = f"academyrag {args.command}"  # argparse's prog
+        importlib.import_module(_MODULES[args.command][0]).main(rest)
+        return
+    if rest:
+        q.error(f"unrecognized arguments: {' '.join(rest)}")
+    _query(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Client for the query service (rag/server.py).
+
+Method names and arguments mirror rag.retrieve / rag.generate, so callers
+can switch between in-process and remote execution:
+
+    client = Client("http://127.0.0.1:8000")
+    docs = client.retrieve_with_rerank("what drives cost?", top_k=6)
+    ans = client.stream_answer("what drives cost?", docs)
+    for tok in ans["stream"]: ...
+
+Each thread keeps its own keep-alive connection. Streamed answers use a
+connection of their own.
+
+Env:
+  ACADEMYRAG_SERVER_URL   default http://127.0.0.1:8000
+
+CLI:
+  python -m rag.client --health
+  python -m rag.client --query "what drives cost?" --k 6
+  python -m rag.client --bench --concurrency 32 --requests 2000   # queries/sec against the server
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator
+
+import numpy as np
+
+class Client:
+    def __init__(self, url: Optional[str] = None, timeout: float = 300.0):
+        self.url = (url or os.getenv("ACADEMYRAG_SERVER_URL", "http://127.0.0.1:8000")).rstrip("/")
+        parts = urlsplit(self.url)
+        if parts.scheme not in ("http", "") or not parts.hostname:
+            raise ValueError(f"Unsupported server URL: {self.url}")
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _call(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        for attempt in (0, 1):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+                break
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                # The server may have closed an idle keep-alive connection; retry once on a fresh one.
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        out = json.loads(payload or b"{}")
+        if resp.status >= 400:
+            raise RuntimeError(f"{method} {path} failed ({resp.status}): {out.get('error', payload[:200])}")
+        return out
+
+    def _lines(self, path: str, body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            conn.request("POST", path, body=json.dumps(body).encode("utf-8"),
+                         headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            if resp.status >= 400:
+                out = json.loads(resp.read() or b"{}")
+                raise RuntimeError(f"POST {path} failed ({resp.status}): {out.get('error')}")
+            for line in resp:
+                if line.strip():
+                    obj = json.loads(line)
+                    if "error" in obj:
+                        raise RuntimeError(f"POST {path} failed mid-stream: {obj['error']}")
+                    yield obj
+        finally:
+            conn.close()
+
+    # ---- service ------------------------------------------------------------
+
+    def health(self) -> Dict[str, Any]:
+        return self._call("GET", "/health")
+
+    def catalog(self) -> Dict[str, Any]:
+        """Document titles and file types, for filter pickers."""
+        return self._call("GET", "/catalog")
+
+    def ingest(self, path: str, chunk_size: int = 900, chunk_overlap: int = 120,
+               files: Optional[List[str]] = None) -> int:
+        """Ingest a folder (or just `files` in it) on the server's filesystem; returns the chunks embedded."""
+        return self._call("POST", "/ingest", {"path": path, "files": files, "chunk_size": chunk_size,
+                                              "chunk_overlap": chunk_overlap})["chunks"]
+
+    # ---- retrieval ----------------------------------------------------------
+
+    def retrieve_with_rerank(self, query: str, top_k: int = 6, rerank: Optional[bool] = None,
+                             filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self._call("POST", "/retrieve", {"query": query, "top_k": top_k, "rerank": rerank,
+                                                "filters": filters})["docs"]
+
+    def retrieve_many(self, queries: List[str], top_k: int = 6, rerank: Optional[bool] = None,
+                      timings: Optional[Dict[str, float]] = None,
+                      filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """One result list per query; `timings` gets the server-side stage times for these queries."""
+        if not queries:
+            return []
+        res = self._call("POST", "/retrieve", {"queries": list(queries), "top_k": top_k, "rerank": rerank,
+                                               "filters": filters})
+        if timings is not None:
+            for key, ms in res.get("timings", {}).items():
+                timings[key] = timings.get(key, 0.0) + ms
+        return res["results"]
+
+    # ---- generation ---------------------------------------------------------
+
+    def _generate(self, path: str, field: str, text: str, docs, use_cache: bool, **kw) -> Dict[str, Any]:
+        return self._call("POST", path, {field: text, "docs": docs, "use_cache": use_cache, **kw})
+
+    def _stream(self, path: str, field: str, text: str, docs, use_cache: bool, **kw) -> Dict[str, Any]:
+        lines = self._lines(path, {field: text, "docs": docs, "use_cache": use_cache, "stream": True, **kw})
+        head = next(lines)
+
+        def tokens():
+            for obj in lines:
+                if "delta" in obj:
+                    yield obj["delta"]
+
+        return {"stream": tokens(), "citations": head["citations"], "docs": head["docs"],
+                "cached": head.get("cached", False)}
+
+    def generate_answer(self, question: str, docs: Optional[List[Dict[str, Any]]] = None,
+                        use_cache: bool = True, **kw) -> Dict[str, Any]:
+        """Without docs the server retrieves them (top_k/filters in kw) and returns them under "docs"."""
+        return self._generate("/answer", "query", question, docs, use_cache, **kw)
+
+    def stream_answer(self, question: str, docs: Optional[List[Dict[str, Any]]] = None,
+                      use_cache: bool = True, **kw) -> Dict[str, Any]:
+        return self._stream("/answer", "query", question, docs, use_cache, **kw)
+
+    def generate_summary(self, topic: str, docs: Optional[List[Dict[str, Any]]] = None,
+                         use_cache: bool = True, **kw) -> Dict[str, Any]:
+        return self._generate("/summary", "topic", topic, docs, use_cache, **kw)
+
+    def stream_summary(self, topic: str, docs: Optional[List[Dict[str, Any]]] = None,
+                       use_cache: bool = True, **kw) -> Dict[str, Any]:
+        return self._stream("/summary", "topic", topic, docs, use_cache, **kw)
+
+    def generate_quiz(self, topic: str, docs: Optional[List[Dict[str, Any]]] = None,
+                      use_cache: bool = True, **kw) -> Dict[str, Any]:
+        return self._generate("/quiz", "topic", topic, docs, use_cache, **kw)
+
+def bench(client: Client, concurrency: int = 32, requests: int = 1000, top_k: int = 6) -> Dict[str, float]:
+    """Fire `requests` single-query retrievals from `concurrency` threads; queries/sec and latency."""
+    lat = np.zeros(requests)
+
+    def one(i: int):
+        t0 = time.perf_counter()
+        client.retrieve_with_rerank(f"question {i} about cost drivers and market entry", top_k=top_k)
+        lat[i] = (time.perf_counter() - t0) * 1000.0
+
+    before = client.health()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    after = client.health()
+    batches = after["batches"] - before["batches"]
+    return {"qps": requests / wall, "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+            "avg_batch": (after["queries"] - before["queries"]) / batches if batches else 0.0}
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Query a running AcademyRAG server.")
+    ap.add_argument("--url", default=None, help="Server URL (ACADEMYRAG_SERVER_URL)")
+    ap.add_argument("--health", action="store_true")
+    ap.add_argument("--query", type=str, default=None)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--bench", action="store_true", help="Load test retrieval")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=1000)
+    args = ap.parse_args()
+
+    client = Client(args.url)
+    if args.health:
+        print(json.dumps(client.health(), indent=2))
+    if args.query:
+        for i, d in enumerate(client.retrieve_with_rerank(args.query, top_k=args.k), 1):
+            meta = d.get("metadata", {})
+            print(f"[{i}] {meta.get('doc_title', 'Document')} p.{meta.get('page')}  score={d.get('score')}")
+    if args.bench:
+        r = bench(client, args.concurrency, args.requests, args.k)
+        print(f"[STATS] {r['qps']:.1f} queries/s at concurrency {args.concurrency}, "
+              f"p50 {r['p50_ms']:.1f} ms, p95 {r['p95_ms']:.1f} ms, avg batch {r['avg_batch']:.1f}")
@@ -0,0 +1,376 @@
+"""
+Optimized CPU embedding for sentence-transformers models.
+
+Two embedding providers run the same checkpoint as "sentence-transformers"
+(ACADEMYRAG_ST_MODEL), built for CPU-only ingest hosts:
+
+- onnx   ONNX Runtime. Uses the ONNX files the model ships (onnx/model.onnx,
+         or an int8 variant such as onnx/model_quint8_avx2.onnx), or exports
+         and quantizes the checkpoint once into ACADEMYRAG_ONNX_DIR (needs the
+         `onnx` package)
+- torch  PyTorch with Linear layers dynamically quantized to int8
+
+ACADEMYRAG_EMBED_PRECISION is int8 (default) or fp32 for both.
+
+Texts are tokenized once, sorted by token length and cut into batches of
+at most ACADEMYRAG_EMBED_BATCH texts (default 32) and
+ACADEMYRAG_EMBED_MAX_TOKENS padded tokens (default 8192), so short chunks
+are not padded up to the longest chunk of a random batch. Pooling (mean,
+CLS or max, from the model's Pooling config) and L2 normalization happen in
+NumPy, and encode() returns one float32 matrix: there are no per-float
+Python objects between the model and the store.
+
+ACADEMYRAG_EMBED_PROCESSES=N (default 0: off) spreads large encode calls
+over N worker processes, each with its own copy of the model and
+ACADEMYRAG_EMBED_THREADS threads (default: CPUs / N). Use it for bulk
+ingest; calls smaller than 8 texts per worker, like queries, stay in process.
+
+int8 vectors are close to, not equal to, fp32 ones. `--check` reports their
+cosine similarity and neighbour recall against the fp32 sentence-transformers
+model, with the speedup; `python -m rag.bench --scenarios embed` does the
+same on the synthetic corpus. An index embedded by another provider should
+be re-ingested after switching (the embedding cache is kept per provider).
+
+CLI:
+  python -m rag.cpu_embed --check --n 2000                 # on indexed chunks
+  python -m rag.cpu_embed --check --providers onnx,torch --precision fp32
+"""
+
+import os
+import json
+import time
+import platform
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+# Token arrays -> token embeddings (batch, tokens, hidden), float32.
+Runner = Callable[[Dict[str, np.ndarray]], np.ndarray]
+
+def _repo(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+def _model_dir(model_name: str, extra: Tuple[str, ...] = ()) -> str:
+    """A local directory with the model's configs, tokenizer and any of the `extra` files it has."""
+    if os.path.isdir(model_name):
+        return model_name
+    from huggingface_hub import snapshot_download
+    return snapshot_download(_repo(model_name), allow_patterns=["*.json", "*.txt", "*.model", *extra])
+
+def _read_json(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _pooling(root: str) -> str:
+    """The model's pooling mode (mean, cls or max); rejects heads this module can't reproduce."""
+    modules = _read_json(os.path.join(root, "modules.json")) or [{"type": "Transformer", "path": ""},
+                                                                  {"type": "Pooling", "path": "1_Pooling"}]
+    mode = "mean"
+    for mod in modules:
+        kind = mod["type"].rsplit(".", 1)[-1]
+        if kind == "Pooling":
+            cfg = _read_json(os.path.join(root, mod["path"], "config.json"))
+            mode = cfg.get("pooling_mode") or next(
+                (m for m, key in (("cls", "pooling_mode_cls_token"), ("max", "pooling_mode_max_tokens"),
+                                  ("mean", "pooling_mode_mean_tokens")) if cfg.get(key)), "mean")
+        elif kind not in ("Transformer", "Normalize"):
+            raise ValueError(f"{kind} modules aren't supported by the onnx/torch embedding providers; "
+                             f"use ACADEMYRAG_EMBED_PROVIDER=sentence-transformers")
+    if mode not in ("mean", "cls", "max"):
+        raise ValueError(f"Unsupported pooling mode {mode!r}")
+    return mode
+
+def length_batches(lengths: List[int], batch_size: int, max_tokens: int) -> List[np.ndarray]:
+    """
+    Indices grouped into batches of similar length, longest first: each batch
+    holds at most batch_size texts and pads to at most max_tokens tokens.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches, start = [], 0
+    while start < len(order):
+        width = max(1, lengths[order[start]])  # the batch's longest text comes first
+        size = max(1, min(batch_size, max_tokens // width))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+class CpuEncoder:
+    """Tokenize, length-batch, run, pool and normalize; encode() returns float32 [texts, dim]."""
+
+    def __init__(self, root: str, run: Runner, inputs: Tuple[str, ...], dim: int):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(root)
+        cfg = _read_json(os.path.join(root, "sentence_bert_config.json"))
+        limit = _read_json(os.path.join(root, "config.json")).get("max_position_embeddings", 512)
+        self.max_length = int(cfg.get("max_seq_length") or min(self.tokenizer.model_max_length, limit))
+        self.pooling = _pooling(root)
+        self.run = run
+        self.inputs = inputs
+        self.dim = dim
+        self.batch_size = int(os.getenv("ACADEMYRAG_EMBED_BATCH", "32"))
+        self.max_tokens = int(os.getenv("ACADEMYRAG_EMBED_MAX_TOKENS", "8192"))
+        self.pool: Optional[EncodePool] = None
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        m = mask[:, :, None].astype(np.float32)
+        if self.pooling == "max":
+            return np.where(m > 0, hidden, -np.inf).max(axis=1)
+        return (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+
+    def encode_local(self, texts: List[str]) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return out
+        enc = self.tokenizer(list(texts), truncation=True, max_length=self.max_length, padding=False)
+        ids = enc["input_ids"]
+        pad = self.tokenizer.pad_token_id or 0
+        for batch in length_batches([len(x) for x in ids], self.batch_size, self.max_tokens):
+            width = len(ids[batch[0]])
+            feed = {name: np.full((len(batch), width), pad if name == "input_ids" else 0, dtype=np.int64)
+                    for name in self.inputs}
+            for row, i in enumerate(batch):
+                n = len(ids[i])
+                feed["input_ids"][row, :n] = ids[i]
+                feed["attention_mask"][row, :n] = 1
+                if "token_type_ids" in feed and "token_type_ids" in enc:
+                    feed["token_type_ids"][row, :n] = enc["token_type_ids"][i]
+            out[batch] = self._pool(self.run(feed), feed["attention_mask"])
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if self.pool is not None and len(texts) >= 8 * self.pool.processes:
+            return self.pool.encode(texts)
+        return self.encode_local(texts)
+
+# ---- backends ---------------------------------------------------------------
+
+def _threads(processes: int) -> int:
+    return int(os.getenv("ACADEMYRAG_EMBED_THREADS", "0")) or max(1, (os.cpu_count() or 1) // max(1, processes))
+
+def precision() -> str:
+    value = os.getenv("ACADEMYRAG_EMBED_PRECISION", "int8")
+    if value not in ("int8", "fp32"):
+        raise ValueError(f"Unknown ACADEMYRAG_EMBED_PRECISION={value!r} (expected 'int8' or 'fp32')")
+    return value
+
+def _split(model_name: str) -> Tuple[str, bool]:
+    """"name@int8" / "name@fp32" (see Embedder.resolve) -> (name, int8); a bare name follows the env."""
+    name, _, suffix = model_name.rpartition("@")
+    if suffix in ("int8", "fp32"):
+        return name, suffix == "int8"
+    return model_name, precision() == "int8"
+
+def _load_torch(model_name: str, processes: int) -> CpuEncoder:
+    import torch
+    from transformers import AutoModel
+    model_name, int8 = _split(model_name)
+    torch.set_num_threads(_threads(processes))
+    root = _model_dir(model_name)
+    model = AutoModel.from_pretrained(root if os.path.isdir(model_name) else _repo(model_name)).eval()
+    if int8:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    types = getattr(model.config, "type_vocab_size", 0)
+    inputs = ("input_ids", "attention_mask") + (("token_type_ids",) if types else ())
+
+    def run(feed: Dict[str, np.ndarray]) -> np.ndarray:
+        with torch.inference_mode():
+            return model(**{k: torch.from_numpy(v) for k, v in feed.items()}).last_hidden_state.numpy()
+
+    return CpuEncoder(root, run, inputs, model.config.hidden_size)
+
+def _onnx_candidates(int8: bool) -> Tuple[str, ...]:
+    if os.getenv("ACADEMYRAG_ONNX_FILE"):
+        return (os.getenv("ACADEMYRAG_ONNX_FILE"),)
+    if not int8:
+        return ("onnx/model.onnx",)
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return ("onnx/model_qint8_arm64.onnx",)
+    return ("onnx/model_quint8_avx2.onnx", "onnx/model_qint8_avx512_vnni.onnx", "onnx/model_qint8_avx512.onnx")
+
+def _export_onnx(model_name: str, root: str, int8: bool) -> str:
+    """Export (and quantize) the checkpoint once; returns the cached file."""
+    try:
+        import onnx  # noqa: F401 (torch.onnx and onnxruntime.quantization need it)
+    except ImportError:
+        raise ImportError(f"{model_name} ships no ONNX file; exporting it needs `pip install onnx`") from None
+    import torch
+    from transformers import AutoModel
+    out_dir = os.path.join(os.getenv("ACADEMYRAG_ONNX_DIR", "./data/onnx"), model_name.replace("/", "__"))
+    fp32 = os.path.join(out_dir, "model.onnx")
+    path = os.path.join(out_dir, "model_int8.onnx") if int8 else fp32
+    if os.path.exists(path):
+        return path
+    os.makedirs(out_dir, exist_ok=True)
+    if not os.path.exists(fp32):
+        print(f"[INFO] Exporting {model_name} to ONNX ...")
+        model = AutoModel.from_pretrained(root if os.path.isdir(model_name) else _repo(model_name)).eval()
+        names = ["input_ids", "attention_mask"] + (["token_type_ids"] if getattr(model.config, "type_vocab_size", 0)
+                                                   else [])
+        dummy = tuple(torch.ones((1, 8), dtype=torch.int64) for _ in names)
+        axes = {name: {0: "batch", 1: "tokens"} for name in names}
+        axes["last_hidden_state"] = {0: "batch", 1: "tokens"}
+        torch.onnx.export(model, dummy, fp32 + ".tmp", input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=17, dynamo=False)
+        os.replace(fp32 + ".tmp", fp32)
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32, path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(path + ".tmp", path)
+    return path
+
+def _load_onnx(model_name: str, processes: int) -> CpuEncoder:
+    import onnxruntime as ort
+    model_name, int8 = _split(model_name)
+    candidates = _onnx_candidates(int8)
+    root = _model_dir(model_name, candidates)
+    path = next((os.path.join(root, f) for f in candidates if os.path.exists(os.path.join(root, f))), None)
+    if path is None:
+        path = _export_onnx(model_name, root, int8)
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.intra_op_num_threads = _threads(processes)
+    session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+    inputs = tuple(i.name for i in session.get_inputs())
+    missing = {"input_ids", "attention_mask"} - set(inputs)
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(sorted(missing))} input")
+    dim = session.get_outputs()[0].shape[-1]
+    if not isinstance(dim, int):
+        dim = _read_json(os.path.join(root, "config.json"))["hidden_size"]
+
+    def run(feed: Dict[str, np.ndarray]) -> np.ndarray:
+        return session.run(None, feed)[0]
+
+    return CpuEncoder(root, run, inputs, dim)
+
+_LOADERS = {"onnx": _load_onnx, "torch": _load_torch}
+
+def load_encoder(provider: str, model_name: str, processes: Optional[int] = None) -> CpuEncoder:
+    """The encoder for an "onnx" or "torch" provider, with a process pool if configured."""
+    if processes is None:
+        processes = int(os.getenv("ACADEMYRAG_EMBED_PROCESSES", "0"))
+    enc = _LOADERS[provider](model_name, processes if processes > 1 else 1)
+    if processes > 1:
+        enc.pool = EncodePool(provider, model_name, processes, enc.dim)
+    return enc
+
+# ---- process pool -------------------------------------------------------------
+
+_worker: Optional[CpuEncoder] = None
+
+def _init_worker(provider: str, model_name: str, processes: int):
+    global _worker
+    os.environ["ACADEMYRAG_EMBED_PROCESSES"] = "0"
+    _worker = _LOADERS[provider](model_name, processes)
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker.encode_local(texts)
+
+class EncodePool:
+    """Worker processes with a model each; encode() splits texts across them."""
+
+    def __init__(self, provider: str, model_name: str, processes: int, dim: int):
+        import multiprocessing
+        self.processes = processes
+        self.dim = dim
+        # spawn: ingest calls this from its embed thread, and forking a threaded process is unsafe.
+        self._pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(provider, model_name, processes))
+        self._lock = threading.Lock()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Deal a length-sorted order round-robin, so every worker gets a similar amount of tokens.
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        parts = [order[i::self.processes] for i in range(self.processes)]
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        with self._lock:
+            results = list(self._pool.map(_encode_in_worker, [[texts[j] for j in p] for p in parts]))
+        for p, vecs in zip(parts, results):
+            out[p] = vecs
+        return out
+
+# ---- accuracy / speed check ---------------------------------------------------
+
+def check(texts: List[str], model_name: str, providers: List[str], queries: int = 100,
+          k: int = 10) -> Dict[str, Any]:
+    """
+    Embed `texts` with the fp32 sentence-transformers model and with each
+    provider; texts/s, speedup, cosine similarity to the fp32 vectors and
+    recall@k of each text's nearest neighbours among the rest (for the first
+    `queries` texts) against the fp32 neighbours.
+    """
+    from .embed import get_model, _provider
+
+    def timed(provider: str) -> Tuple[np.ndarray, float, float]:
+        name = model_name if provider == "sentence-transformers" else f"{model_name}@{precision()}"
+        t0 = time.perf_counter()
+        backend = get_model(provider, name)
+        load = time.perf_counter() - t0
+        encode = _provider(provider)[1]
+        encode(backend, name, texts[:8])  # warm up
+        t0 = time.perf_counter()
+        vecs = np.asarray(encode(backend, name, texts), dtype=np.float32)
+        return vecs, time.perf_counter() - t0, load
+
+    def neighbours(vecs: np.ndarray) -> np.ndarray:
+        sims = vecs[:queries] @ vecs.T
+        np.fill_diagonal(sims[:, :queries], -np.inf)
+        return np.argsort(-sims, axis=1)[:, :k]
+
+    base, base_s, base_load = timed("sentence-transformers")
+    base_nn = neighbours(base)
+    out: Dict[str, Any] = {"texts": len(texts), "model": model_name,
+                           "sentence-transformers": {"texts_per_s": len(texts) / base_s, "load_s": base_load}}
+    for provider in providers:
+        try:
+            vecs, secs, load = timed(provider)
+        except Exception as e:
+            print(f"[SKIP] {provider}: {e}")
+            out[provider] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        cos = np.sum(vecs * base, axis=1)
+        nn = neighbours(vecs)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(nn, base_nn)])
+        out[provider] = {"texts_per_s": len(texts) / secs, "speedup": base_s / secs, "load_s": load,
+                         "cosine_mean": float(cos.mean()), "cosine_min": float(cos.min()),
+                         f"recall@{k}": float(recall)}
+    return out
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Check the optimized CPU embedding providers against fp32.")
+    ap.add_argument("--check", action="store_true", help="Report speedup and accuracy against fp32")
+    ap.add_argument("--providers", type=str, default="onnx,torch")
+    ap.add_argument("--precision", choices=["int8", "fp32"], default=None, help="ACADEMYRAG_EMBED_PRECISION")
+    ap.add_argument("--n", type=int, default=1000, help="Indexed chunks to embed")
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    if args.precision:
+        os.environ["ACADEMYRAG_EMBED_PRECISION"] = args.precision
+    from .store import get_store
+    from .embed import Embedder
+    docs = get_store().get(include=["documents"], limit=args.n).get("documents") or []
+    if not docs:
+        raise SystemExit("[INFO] No indexed chunks to embed; ingest something first.")
+    model_name = os.getenv("ACADEMYRAG_ST_MODEL", Embedder().st_model)
+    rep = check(docs, model_name, [p for p in args.providers.split(",") if p], k=args.k)
+    fp32 = rep.pop("sentence-transformers")
+    print(f"[STATS] {rep.pop('texts')} chunks, {rep.pop('model')}: fp32 sentence-transformers "
+          f"{fp32['texts_per_s']:0.1f} texts/s")
+    for provider, r in rep.items():
+        if "error" in r:
+            continue
+        print(f"[STATS] {provider} ({os.getenv('ACADEMYRAG_EMBED_PRECISION', 'int8')}): "
+              f"{r['texts_per_s']:0.1f} texts/s ({r['speedup']:0.2f}x), cosine to fp32 mean "
+              f"{r['cosine_mean']:0.4f} min {r['cosine_min']:0.4f}, recall@{args.k} {r[f'recall@{args.k}']:0.3f}")
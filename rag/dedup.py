@@ -0,0 +1,445 @@
+"""
+Near-duplicate chunk detection for ingest.
+
+Course material repeats itself: the same slide template in every deck,
+reprinted PDF pages, one markdown file copied into several folders. Each
+new chunk gets a MinHash signature over its word 3-grams (64 permutations);
+an LSH index (16 bands of 4 rows) finds earlier chunks sharing a band, and
+a candidate whose estimated Jaccard similarity is at least the threshold
+makes the new chunk an alias of it. Aliases are neither embedded nor
+written to the store or BM25 index; they keep their chunk id (so the
+manifest, catalog and checkpoint treat them like any other chunk) and
+point at one canonical chunk.
+
+Retrieval expands aliases: a hit carries "aliases", the other places the
+same text appears, and citations list them. A filter that selects only an
+alias searches its canonical chunk instead and cites the alias.
+
+When a canonical chunk is deleted (its file changed or went away), ingest
+re-runs its aliases through dedup, so one of them is embedded in its place.
+
+Stored next to the index in {ACADEMYRAG_DB_DIR}/dedup.sqlite:
+
+- sigs     canonical chunk id -> source path, MinHash signature
+- aliases  alias chunk id -> canonical id, text, metadata
+- bands    LSH key (band number + its rows) -> canonical chunk id
+
+Ingest looks candidates up in the bands table per new chunk, so memory
+stays flat however large the corpus is; only the batches still in flight
+between ingest's stages are tracked in memory.
+
+Env:
+  ACADEMYRAG_DEDUP=0              disable (ingest embeds every chunk; hits aren't expanded)
+  ACADEMYRAG_DEDUP_THRESHOLD      estimated Jaccard for a near-duplicate, default 0.9
+
+CLI:
+  python -m rag.dedup --stats      # canonical chunks, aliases, text saved
+  python -m rag.dedup --top 10     # most duplicated chunks
+  python -m rag.dedup --rebuild    # sign every chunk in the store (indexes built before dedup)
+"""
+
+import os
+import re
+import json
+import zlib
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Collection
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sigs (
+    id TEXT PRIMARY KEY,
+    source_path TEXT,
+    sig BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    id TEXT PRIMARY KEY,
+    canonical TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS aliases_canonical ON aliases(canonical);
+CREATE TABLE IF NOT EXISTS bands (
+    key BLOB NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (key, id)
+) WITHOUT ROWID;
+"""
+
+PERMS = 64
+BANDS = 16
+SHINGLE = 3
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240611)  # fixed: signatures are persisted
+_A = _rng.integers(1, _PRIME, size=(PERMS, 1), dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=(PERMS, 1), dtype=np.uint64)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash of the text's word 3-grams (uint32[PERMS]), or None for text without words."""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    grams = {" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # (a * x + b) mod p stays below 2**62 because a, b, x < 2**31.
+    return ((_A * (x % _PRIME) + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(a == b)) / PERMS
+
+def _bands(sig: np.ndarray) -> List[bytes]:
+    """One LSH key per band: the band number followed by its rows of the signature."""
+    rows = PERMS // BANDS
+    return [bytes([band]) + sig[band * rows:(band + 1) * rows].tobytes() for band in range(BANDS)]
+
+def _in(n: int) -> str:
+    return ",".join("?" * n)
+
+class DedupIndex:
+    def __init__(self, path: str, threshold: float = 0.9):
+        self.path = path
+        self.threshold = threshold
+        self.exists = os.path.exists(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        # What ingest decided but the write thread hasn't committed yet; the
+        # database holds everything else, so this is bounded by the batches
+        # in flight, not by corpus size.
+        self._new_sigs: Dict[str, np.ndarray] = {}
+        self._new_buckets: Dict[bytes, List[str]] = defaultdict(list)
+        self._new_aliases: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        self._gone: set = set()
+
+    # ---- ingest (main thread) -----------------------------------------------
+
+    def load(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Prepare for ingest. Returns aliases whose canonical chunk is gone (an
+        interrupted run), as (chunk id, text, metadata) to re-run.
+        """
+        with self._lock:
+            if (self._db.execute("SELECT 1 FROM bands LIMIT 1").fetchone() is None
+                    and self._db.execute("SELECT 1 FROM sigs LIMIT 1").fetchone() is not None):
+                self._index_bands()
+            rows = self._db.execute(
+                "SELECT a.id, a.text, a.metadata FROM aliases a LEFT JOIN sigs s ON s.id = a.canonical "
+                "WHERE s.id IS NULL").fetchall()
+        return [(cid, text, json.loads(meta)) for cid, text, meta in rows]
+
+    def _index_bands(self, page: int = 5000):
+        # Index built before the bands table: derive it from the stored signatures.
+        last = ""
+        while True:
+            rows = self._db.execute("SELECT id, sig FROM sigs WHERE id > ? ORDER BY id LIMIT ?",
+                                    (last, page)).fetchall()
+            if not rows:
+                break
+            self._db.executemany("INSERT OR IGNORE INTO bands(key, id) VALUES (?,?)",
+                                 [(key, cid) for cid, blob in rows
+                                  for key in _bands(np.frombuffer(blob, dtype=np.uint32))])
+            self._db.commit()
+            last = rows[-1][0]
+
+    def _canonical(self, cid: str) -> Optional[np.ndarray]:
+        """cid's signature if it is a live canonical chunk."""
+        if cid in self._gone:
+            return None
+        sig = self._new_sigs.get(cid)
+        if sig is None and cid not in self._new_aliases:
+            row = self._db.execute("SELECT sig FROM sigs WHERE id=?", (cid,)).fetchone()
+            sig = np.frombuffer(row[0], dtype=np.uint32) if row else None
+        return sig
+
+    def _alias_of(self, cid: str) -> Optional[str]:
+        """The canonical chunk cid is a live alias of."""
+        if cid in self._gone or cid in self._new_sigs:
+            return None
+        alias = self._new_aliases.get(cid)
+        if alias is not None:
+            return alias[0]
+        row = self._db.execute("SELECT canonical FROM aliases WHERE id=?", (cid,)).fetchone()
+        # An alias whose canonical chunk was dropped is being assigned again.
+        return row[0] if row and self._canonical(row[0]) is not None else None
+
+    def _register(self, cid: str, sig: np.ndarray):
+        self._gone.discard(cid)
+        self._new_sigs[cid] = sig
+        for key in _bands(sig):
+            self._new_buckets[key].append(cid)
+
+    def _unregister(self, cid: str):
+        sig = self._new_sigs.pop(cid, None)
+        if sig is None:
+            return
+        for key in _bands(sig):
+            bucket = self._new_buckets.get(key)
+            if bucket and cid in bucket:
+                bucket.remove(cid)
+                if not bucket:
+                    del self._new_buckets[key]
+
+    def assign(self, cid: str, text: str, meta: Dict[str, Any],
+               exclude: Collection[str] = ()) -> Optional[str]:
+        """
+        The canonical chunk id that cid near-duplicates, recording cid as its
+        alias; or None, registering cid as a canonical chunk to be embedded.
+        Chunks in exclude are not candidates (ingest passes the previous
+        chunks of an edited file, which are about to be deleted).
+        """
+        with self._lock:
+            # Already known (a rebuilt shard re-ingests its files): keep the chunk's role.
+            if self._canonical(cid) is not None:
+                return None
+            known = self._alias_of(cid)
+            if known is not None:
+                return known
+            sig = signature(text)
+            if sig is None:
+                return None
+            keys = _bands(sig)
+            cands = {c: self._new_sigs[c] for key in keys for c in self._new_buckets.get(key, ())}
+            for c, blob in self._db.execute(
+                    "SELECT s.id, s.sig FROM sigs s WHERE s.id IN "
+                    f"(SELECT id FROM bands WHERE key IN ({_in(len(keys))}))", keys):
+                if c not in self._new_aliases:
+                    cands.setdefault(c, np.frombuffer(blob, dtype=np.uint32))
+            best, best_sim = None, self.threshold
+            for c, other in cands.items():
+                if c in self._gone or c in exclude:
+                    continue
+                sim = similarity(sig, other)
+                if sim >= best_sim:
+                    best, best_sim = c, sim
+            if best is None:
+                self._register(cid, sig)
+                return None
+            self._gone.discard(cid)
+            self._new_aliases[cid] = (best, text, meta)
+            return best
+
+    def drop(self, ids: Sequence[str]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Forget deleted chunks. Returns the surviving aliases of any deleted
+        canonical chunk, as (chunk id, text, metadata) to assign() again.
+        """
+        gone = set(ids)
+        orphans = []
+        with self._lock:
+            for cid in gone:
+                if cid in self._gone:
+                    continue
+                canonical = self._canonical(cid) is not None
+                self._gone.add(cid)
+                self._new_aliases.pop(cid, None)
+                self._unregister(cid)
+                if not canonical:
+                    continue
+                members = [(m, text, meta) for m, (c, text, meta) in self._new_aliases.items() if c == cid]
+                for m, text, meta in self._db.execute(
+                        "SELECT id, text, metadata FROM aliases WHERE canonical=?", (cid,)).fetchall():
+                    if m not in self._new_aliases and m not in self._new_sigs and m not in self._gone:
+                        members.append((m, text, json.loads(meta)))
+                for m, text, meta in members:
+                    if m not in gone:
+                        self._new_aliases.pop(m, None)
+                        orphans.append((m, text, meta))
+        return orphans
+
+    # ---- ingest (write thread) ----------------------------------------------
+
+    def commit(self, chunks: Sequence[Tuple[str, str, Dict[str, Any]]],
+               aliases: Sequence[Tuple[str, str, Dict[str, Any], str]], stale: Sequence[str]):
+        """Persist one written batch: new canonical chunks, new aliases and deleted ids."""
+        with self._lock:
+            sig_rows, band_rows = [], []
+            for cid, _, meta in chunks:
+                sig = self._new_sigs.get(cid)
+                if sig is not None:
+                    sig_rows.append((cid, meta.get("source_path"), sig.tobytes()))
+                    band_rows.extend((key, cid) for key in _bands(sig))
+            # An alias whose canonical chunk was deleted is queued again, and may land in the
+            # same batch as both: the embedded chunk wins.
+            self._db.executemany(
+                "INSERT OR REPLACE INTO aliases(id, canonical, text, metadata) VALUES (?,?,?,?)",
+                [(cid, canonical, text, json.dumps(meta, ensure_ascii=False))
+                 for cid, text, meta, canonical in aliases])
+            self._db.executemany("DELETE FROM aliases WHERE id=?", [(cid,) for cid, _, _ in chunks])
+            self._db.executemany("INSERT OR REPLACE INTO sigs(id, source_path, sig) VALUES (?,?,?)", sig_rows)
+            self._db.executemany("INSERT OR IGNORE INTO bands(key, id) VALUES (?,?)", band_rows)
+            # Deletions last, like the store: a chunk re-assigned and then deleted in one batch stays deleted.
+            stale = list(stale)
+            for s in range(0, len(stale), 500):
+                part = stale[s:s + 500]
+                dead = self._db.execute(f"SELECT id, sig FROM sigs WHERE id IN ({_in(len(part))})", part).fetchall()
+                self._db.executemany("DELETE FROM bands WHERE key=? AND id=?",
+                                     [(key, cid) for cid, blob in dead
+                                      for key in _bands(np.frombuffer(blob, dtype=np.uint32))])
+            rows = [(cid,) for cid in stale]
+            self._db.executemany("DELETE FROM sigs WHERE id=?", rows)
+            self._db.executemany("DELETE FROM aliases WHERE id=?", rows)
+            self._db.commit()
+            # Now on disk: drop them from the pending state unless ingest has moved on since.
+            for cid, _, _ in chunks:
+                if cid in self._new_sigs:
+                    self._unregister(cid)
+            for cid, _, _, canonical in aliases:
+                pending = self._new_aliases.get(cid)
+                if pending is not None and pending[0] == canonical:
+                    del self._new_aliases[cid]
+            self._gone.difference_update(stale)
+
+    def update_metadata(self, rows: Sequence[Tuple[str, Dict[str, Any]]]):
+        """Replace the stored metadata of existing aliases (e.g. offsets that moved)."""
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("UPDATE aliases SET metadata=? WHERE id=?",
+                                 [(json.dumps(meta, ensure_ascii=False), cid) for cid, meta in rows])
+            self._db.commit()
+
+    def rebuild(self, store, page: int = 1000) -> int:
+        """Sign every chunk in the store as canonical (for indexes built before dedup)."""
+        n, offset = 0, 0
+        while True:
+            res = store.get(include=["documents", "metadatas"], limit=page, offset=offset)
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            rows, band_rows = [], []
+            for cid, text, meta in zip(ids, res["documents"], res["metadatas"]):
+                sig = signature(text or "")
+                if sig is not None:
+                    rows.append((cid, (meta or {}).get("source_path"), sig.tobytes()))
+                    band_rows.extend((key, cid) for key in _bands(sig))
+            with self._lock:
+                before = self._db.total_changes
+                self._db.executemany("INSERT OR IGNORE INTO sigs(id, source_path, sig) VALUES (?,?,?)", rows)
+                n += self._db.total_changes - before
+                self._db.executemany("INSERT OR IGNORE INTO bands(key, id) VALUES (?,?)", band_rows)
+                self._db.commit()
+            offset += len(ids)
+        self.exists = True
+        return n
+
+    # ---- retrieval ----------------------------------------------------------
+
+    def canonicals(self, ids: Sequence[str]) -> Dict[str, Tuple[str, str]]:
+        """alias id -> (canonical id, canonical source path) for the aliases among ids."""
+        ids = list(ids)
+        out = {}
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM aliases LIMIT 1").fetchone() is None:
+                return out
+            for s in range(0, len(ids), 500):
+                part = ids[s:s + 500]
+                out.update((cid, (canonical, path)) for cid, canonical, path in self._db.execute(
+                    "SELECT a.id, a.canonical, s.source_path FROM aliases a JOIN sigs s ON s.id = a.canonical "
+                    f"WHERE a.id IN ({','.join('?' * len(part))})", part))
+        return out
+
+    def expand(self, results: List[List[Dict[str, Any]]], selection=None):
+        """
+        Attach "aliases" ([{"id", "metadata"}]) to every hit that has any. A
+        hit found only because a filter selected one of its aliases is shown
+        as that alias, with the canonical chunk among its aliases.
+        """
+        ids = sorted({d["id"] for docs in results for d in docs if d.get("id")})
+        if not ids:
+            return results
+        members: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        with self._lock:
+            for s in range(0, len(ids), 500):
+                part = ids[s:s + 500]
+                for canonical, cid, meta in self._db.execute(
+                        "SELECT canonical, id, metadata FROM aliases "
+                        f"WHERE canonical IN ({','.join('?' * len(part))}) ORDER BY id", part):
+                    members[canonical].append({"id": cid, "metadata": json.loads(meta)})
+        added = selection.added if selection is not None else {}
+        for docs in results:
+            for i, d in enumerate(docs):
+                group = members.get(d.get("id"))
+                if not group:
+                    continue
+                if d["id"] in added:
+                    chosen = next((a for a in group if a["id"] in added[d["id"]]), group[0])
+                    rest = [a for a in group if a is not chosen]
+                    d = {**d, "metadata": chosen["metadata"],
+                         "aliases": [{"id": d["id"], "metadata": d.get("metadata", {})}] + rest}
+                else:
+                    d = {**d, "aliases": group}
+                docs[i] = d
+        return results
+
+    # ---- maintenance --------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            canonical = self._db.execute("SELECT COUNT(*) FROM sigs").fetchone()[0]
+            aliases, text = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(text AS BLOB))), 0) FROM aliases").fetchone()
+        return {"canonical": canonical, "aliases": aliases, "text_bytes_saved": text,
+                "dedup_rate": aliases / (canonical + aliases) if canonical + aliases else 0.0}
+
+    def top(self, n: int = 10) -> List[Tuple[str, int]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT canonical, COUNT(*) AS c FROM aliases GROUP BY canonical ORDER BY c DESC LIMIT ?",
+                (n,)).fetchall()
+
+def enabled() -> bool:
+    return os.getenv("ACADEMYRAG_DEDUP", "1") != "0"
+
+def load_dedup() -> DedupIndex:
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    return DedupIndex(os.path.join(db_dir, "dedup.sqlite"),
+                      threshold=float(os.getenv("ACADEMYRAG_DEDUP_THRESHOLD", "0.9")))
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_dedup() -> Optional[DedupIndex]:
+    """Process-wide index for retrieval, or None if dedup is off or nothing was ever deduplicated."""
+    global _index
+    if not enabled():
+        return None
+    if _index is None:
+        db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+        if not os.path.exists(os.path.join(db_dir, "dedup.sqlite")):
+            return None
+        with _index_lock:
+            if _index is None:
+                _index = load_dedup()
+    return _index
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Inspect and maintain the near-duplicate index.")
+    ap.add_argument("--stats", action="store_true", help="Canonical chunks, aliases and text saved")
+    ap.add_argument("--top", type=int, default=0, help="Show the N most duplicated chunks")
+    ap.add_argument("--rebuild", action="store_true", help="Sign every chunk in the vector store")
+    args = ap.parse_args()
+
+    index = load_dedup()
+    if args.rebuild:
+        from .store import get_store
+        index.load()
+        print(f"[OK] Signed {index.rebuild(get_store())} chunks.")
+    if args.top:
+        for canonical, n in index.top(args.top):
+            print(f"{n:6d}  {canonical}")
+    if args.stats or not (args.rebuild or args.top):
+        s = index.stats()
+        print(f"[STATS] canonical={s['canonical']} aliases={s['aliases']} ({s['dedup_rate']:.1%} of chunks), "
+              f"text saved={s['text_bytes_saved'] / 1e6:.2f} MB")
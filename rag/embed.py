@@ -1,29 +1,232 @@
 import os
-from typing import List
+import re
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
 from pydantic import BaseModel
-from tqdm import tqdm
 
-# Providers broke af so no openai lol
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
+from .embed_cache import get_cache
+from . import trace
+
+# Process-wide registry: each (provider, model) is loaded once and shared by
+# every Embedder instance (ingest batches, retrieval, Streamlit reruns).
+_registry_lock = threading.Lock()
+_models = {}
+_dims = {}
+
+# Small LRU of recent query vectors keyed by (provider, model, normalized text).
+_query_lock = threading.Lock()
+_query_cache: "OrderedDict[Tuple[str, str, str], np.ndarray]" = OrderedDict()
+QUERY_CACHE_SIZE = int(os.getenv("ACADEMYRAG_QUERY_CACHE_SIZE", "512"))
+
+def _normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+@lru_cache(maxsize=65536)
+def _hash_slot(token: str, dim: int) -> Tuple[int, float]:
+    h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, (1.0 if (h >> 63) else -1.0)
+
+class HashingEmbedder:
+    """
+    Deterministic offline stand-in for a real model (provider "stub"): a
+    normalized bag of hashed words. No downloads or network, and texts that
+    share words still land near each other, so retrieval stays meaningful
+    in benchmarks and tests.
+    """
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for tok in _WORD_RE.findall(text.lower()):
+                slot, sign = _hash_slot(tok, self.dim)
+                out[row, slot] += sign
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+# Embedding providers: name -> (load, encode). Backend packages are imported
+# by load() on first use, so importing this module (and with it retrieval,
+# ingest, eval and the CLI) never pulls in torch or the OpenAI SDK.
+#   load(model_name) -> (backend, dimension or None if the model doesn't say)
+#   encode(backend, model_name, texts) -> float32 matrix, one row per text
+_providers: Dict[str, Tuple[Callable[[str], Tuple[Any, Optional[int]]],
+                            Callable[[Any, str, List[str]], np.ndarray]]] = {}
+
+def register_provider(name: str, load: Callable[[str], Tuple[Any, Optional[int]]],
+                      encode: Callable[[Any, str, List[str]], np.ndarray]):
+    """Make `name` usable as ACADEMYRAG_EMBED_PROVIDER."""
+    _providers[name] = (load, encode)
+
+def _load_sentence_transformers(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    return model, model.get_sentence_embedding_dimension()
+
+def _load_openai(model_name: str):
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY")), None
+
+def _load_stub(model_name: str):
+    model = HashingEmbedder(int(model_name.rsplit("-", 1)[-1]))
+    return model, model.dim
+
+def _load_cpu(provider: str) -> Callable[[str], Tuple[Any, Optional[int]]]:
+    def load(model_name: str):
+        from .cpu_embed import load_encoder
+        encoder = load_encoder(provider, model_name)
+        return encoder, encoder.dim
+    return load
+
+def _encode_openai(client, model_name: str, texts: List[str]) -> np.ndarray:
+    resp = client.embeddings.create(model=model_name, input=texts)
+    return np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+
+register_provider("sentence-transformers", _load_sentence_transformers,
+                  lambda model, _, texts: model.encode(texts, normalize_embeddings=True, convert_to_numpy=True))
+register_provider("openai", _load_openai, _encode_openai)
+register_provider("stub", _load_stub, lambda model, _, texts: model.encode(texts))
+# ONNX Runtime / int8 PyTorch runs of the sentence-transformers model (rag/cpu_embed.py).
+register_provider("onnx", _load_cpu("onnx"), lambda encoder, _, texts: encoder.encode(texts))
+register_provider("torch", _load_cpu("torch"), lambda encoder, _, texts: encoder.encode(texts))
+_ST_PROVIDERS = ("sentence-transformers", "onnx", "torch")
+
+def _provider(name: str):
+    try:
+        return _providers[name]
+    except KeyError:
+        raise ValueError(f"Unknown embedding provider {name!r} (known: {', '.join(sorted(_providers))})") from None
+
+def get_model(provider: str, model_name: str):
+    """Return the loaded backend for (provider, model_name), loading it once."""
+    key = (provider, model_name)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    load = _provider(provider)[0]
+    with _registry_lock:
+        model = _models.get(key)
+        if model is None:
+            with trace.span("model.load", provider=provider, model=model_name):
+                model, dim = load(model_name)
+            if dim is not None:
+                _dims[key] = dim
+            _models[key] = model
+    return model
+
+def clear_query_cache():
+    with _query_lock:
+        _query_cache.clear()
 
 class Embedder(BaseModel):
-    provider: str = "openai"  # or "sentence-transformers"
+    provider: str = "openai"  # or "sentence-transformers" ("onnx", "torch": optimized CPU runs), or "stub"
     model: str = "text-embedding-3-large"
     st_model: str = "all-MiniLM-L6-v2"
+    use_cache: bool = True
 
-    def _get_openai(self):
-        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    def embed(self, texts: List[str]) -> List[List[float]]:
+    def resolve(self) -> Tuple[str, str]:
         provider = os.getenv("ACADEMYRAG_EMBED_PROVIDER", self.provider)
         if provider == "sentence-transformers":
-            model_name = os.getenv("ACADEMYRAG_ST_MODEL", self.st_model)
-            st_model = SentenceTransformer(model_name)
-            vecs = st_model.encode(texts, normalize_embeddings=True).tolist()
-            return vecs
-        else:
-            client = self._get_openai()
-            resp = client.embeddings.create(model=os.getenv("ACADEMYRAG_EMBED_MODEL", self.model),
-                                            input=texts)
-            return [d.embedding for d in resp.data]
+            return provider, os.getenv("ACADEMYRAG_ST_MODEL", self.st_model)
+        if provider in _ST_PROVIDERS:
+            # The precision is part of the model: int8 vectors get their own cache entries.
+            from .cpu_embed import precision
+            return provider, f"{os.getenv('ACADEMYRAG_ST_MODEL', self.st_model)}@{precision()}"
+        if provider == "stub":
+            return provider, f"hash-{int(os.getenv('ACADEMYRAG_STUB_DIM', '384'))}"
+        return provider, os.getenv("ACADEMYRAG_EMBED_MODEL", self.model)
+
+    def _get_openai(self):
+        return get_model("openai", self.resolve()[1])
+
+    @property
+    def dimension(self) -> int:
+        key = self.resolve()
+        get_model(*key)
+        if key not in _dims:
+            # API models don't advertise their width; probe once and remember it.
+            _dims[key] = len(self._encode(key, ["dimension probe"])[0])
+        return _dims[key]
+
+    def _encode(self, key: Tuple[str, str], texts: List[str]) -> np.ndarray:
+        provider, model_name = key
+        backend = get_model(provider, model_name)
+        trace.count("embed_texts_total", len(texts), provider=provider)
+        trace.count("embed_batches_total", 1, provider=provider)
+        with trace.span("embed.encode", provider=provider, texts=len(texts)):
+            return np.asarray(_provider(provider)[1](backend, model_name, texts), dtype=np.float32)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """One float32 row per text."""
+        with trace.span("embed", texts=len(texts)) as sp:
+            key = self.resolve()
+            cache = get_cache() if self.use_cache else None
+            if cache is None or not texts:
+                return self._encode(key, texts)
+            # Only cache misses go to the model/API.
+            model_id = ":".join(key)
+            vecs = cache.get_many(model_id, texts)
+            miss = [i for i, v in enumerate(vecs) if v is None]
+            sp.set(cache_hits=len(texts) - len(miss))
+            trace.count("embed_cache_hits_total", len(texts) - len(miss))
+            trace.count("embed_cache_misses_total", len(miss))
+            fresh = self._encode(key, [texts[i] for i in miss]) if miss else None
+            if fresh is not None:
+                cache.put_many(model_id, [texts[i] for i in miss], fresh)
+            dim = fresh.shape[1] if fresh is not None else len(vecs[0])
+            out = np.empty((len(texts), dim), dtype=np.float32)
+            hit = [i for i, v in enumerate(vecs) if v is not None]
+            if hit:
+                out[hit] = np.stack([vecs[i] for i in hit])
+            if fresh is not None:
+                out[miss] = fresh
+            return out
+
+    def cache_stats(self) -> dict:
+        cache = get_cache() if self.use_cache else None
+        return cache.stats() if cache is not None else {}
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query, reusing the vector if it was asked recently."""
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed queries, reusing recent vectors and encoding the rest in one batch."""
+        provider, model_name = self.resolve()
+        keys = [(provider, model_name, _normalize_query(t)) for t in texts]
+        vecs: List[Optional[np.ndarray]] = [None] * len(texts)
+        with _query_lock:
+            for i, ckey in enumerate(keys):
+                vec = _query_cache.get(ckey)
+                if vec is not None:
+                    _query_cache.move_to_end(ckey)
+                    vecs[i] = vec
+        miss = {}
+        for i, ckey in enumerate(keys):
+            if vecs[i] is None:
+                miss.setdefault(ckey, []).append(i)
+        trace.count("query_cache_hits_total", len(texts) - sum(len(idx) for idx in miss.values()))
+        trace.count("query_cache_misses_total", sum(len(idx) for idx in miss.values()))
+        if miss:
+            fresh = self._encode((provider, model_name), [texts[idx[0]] for idx in miss.values()])
+            with _query_lock:
+                for (ckey, idx), vec in zip(miss.items(), fresh):
+                    for i in idx:
+                        vecs[i] = vec
+                    _query_cache[ckey] = vec.copy()  # not a view pinning the whole batch
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        return np.stack(vecs) if vecs else np.empty((0, 0), dtype=np.float32)
+
+def warmup(embedder: Optional[Embedder] = None) -> int:
+    """Load the configured model up front and return its dimension."""
+    return (embedder or Embedder()).dimension
+
+if os.getenv("ACADEMYRAG_EMBED_WARMUP", "0") == "1":
+    warmup()
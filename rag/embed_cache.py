@@ -0,0 +1,262 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Vectors are keyed by sha256(model id, chunk text) so re-ingesting an
+unchanged chunk never goes back to the model/API. Layout under the cache dir:
+
+- cache.sqlite       key -> (model, dim, slot, last_used)
+- <model>_<dim>.f16  one memory-mapped row per slot (float16 or float32)
+
+Evicted slots are recycled, so the blob files stop growing once the cache
+reaches its size cap.
+
+CLI:
+  python -m rag.embed_cache --stats
+  python -m rag.embed_cache --prune      # drop entries not in the current index
+  python -m rag.embed_cache --max_mb 256 # evict least-recently-used down to 256MB
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import List, Optional, Sequence, Iterable
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS free_slots (
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    slot INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used);
+"""
+
+def cache_key(model_id: str, text: str) -> str:
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, max_bytes: int, dtype: str = "float16"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "cache.sqlite"), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._blobs = {}
+
+    # ---- blob files -------------------------------------------------------
+
+    def _blob_path(self, model_id: str, dim: int) -> str:
+        tag = hashlib.sha1(model_id.encode("utf-8")).hexdigest()[:12]
+        ext = "f16" if self.dtype == np.float16 else "f32"
+        return os.path.join(self.cache_dir, f"{tag}_{dim}.{ext}")
+
+    def _blob(self, model_id: str, dim: int, min_rows: int = 0) -> Optional[np.memmap]:
+        path = self._blob_path(model_id, dim)
+        row_bytes = dim * self.dtype.itemsize
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        rows = size // row_bytes
+        if min_rows > rows:
+            # Grow geometrically so appends stay amortized O(1).
+            new_rows = max(min_rows, rows * 2, 1024)
+            with open(path, "ab") as f:
+                f.truncate(new_rows * row_bytes)
+            rows = new_rows
+            self._blobs.pop(path, None)
+        if rows == 0:
+            return None
+        mm = self._blobs.get(path)
+        if mm is None or mm.shape[0] != rows:
+            mm = np.memmap(path, dtype=self.dtype, mode="r+", shape=(rows, dim))
+            self._blobs[path] = mm
+        return mm
+
+    # ---- lookups ----------------------------------------------------------
+
+    def get_many(self, model_id: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(model_id, t) for t in texts]
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            found = {}
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                q = "SELECT key, dim, slot FROM entries WHERE key IN (%s)" % ",".join("?" * len(part))
+                for k, dim, slot in self._db.execute(q, part):
+                    found[k] = (dim, slot)
+            for i, k in enumerate(keys):
+                hit = found.get(k)
+                if hit is None:
+                    continue
+                mm = self._blob(model_id, hit[0])
+                if mm is None or hit[1] >= mm.shape[0]:
+                    continue
+                out[i] = mm[hit[1]].astype(np.float32)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used=? WHERE key=?",
+                                     [(now, k) for k in found])
+                self._db.commit()
+        n_hit = sum(v is not None for v in out)
+        self.hits += n_hit
+        self.misses += len(texts) - n_hit
+        return out
+
+    def put_many(self, model_id: str, texts: Sequence[str], vecs: Sequence[Sequence[float]]):
+        if not texts:
+            return
+        arr = np.asarray(vecs, dtype=np.float32)
+        dim = arr.shape[1]
+        now = time.time()
+        with self._lock:
+            keys = [cache_key(model_id, t) for t in texts]
+            new = []
+            seen = set()
+            for i, k in enumerate(keys):
+                if k in seen:
+                    continue
+                seen.add(k)
+                if self._db.execute("SELECT 1 FROM entries WHERE key=?", (k,)).fetchone() is None:
+                    new.append(i)
+            if not new:
+                return
+            top = self._db.execute(
+                "SELECT MAX(s) FROM (SELECT slot AS s FROM entries WHERE model=? AND dim=? "
+                "UNION ALL SELECT slot FROM free_slots WHERE model=? AND dim=?)",
+                (model_id, dim, model_id, dim)).fetchone()[0]
+            nxt = 0 if top is None else top + 1
+            # Recycle evicted slots first, then append.
+            free = [r[0] for r in self._db.execute(
+                "SELECT slot FROM free_slots WHERE model=? AND dim=? LIMIT ?", (model_id, dim, len(new)))]
+            if free:
+                self._db.executemany("DELETE FROM free_slots WHERE model=? AND dim=? AND slot=?",
+                                     [(model_id, dim, s) for s in free])
+            slots = free + list(range(nxt, nxt + len(new) - len(free)))
+            mm = self._blob(model_id, dim, min_rows=max(slots) + 1)
+            for i, s in zip(new, slots):
+                mm[s] = arr[i]
+            mm.flush()
+            self._db.executemany("INSERT INTO entries(key, model, dim, slot, last_used) VALUES (?,?,?,?,?)",
+                                 [(keys[i], model_id, dim, s, now) for i, s in zip(new, slots)])
+            self._db.commit()
+        if self.size_bytes() > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    # ---- maintenance ------------------------------------------------------
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT COALESCE(SUM(dim), 0) FROM entries").fetchone()
+        return int(row[0]) * self.dtype.itemsize
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _release(self, keys: Iterable[str]) -> int:
+        n = 0
+        for k in keys:
+            row = self._db.execute("SELECT model, dim, slot FROM entries WHERE key=?", (k,)).fetchone()
+            if row is None:
+                continue
+            self._db.execute("DELETE FROM entries WHERE key=?", (k,))
+            self._db.execute("INSERT INTO free_slots(model, dim, slot) VALUES (?,?,?)", row)
+            n += 1
+        return n
+
+    def evict(self, target_bytes: int) -> int:
+        """Drop least-recently-used entries until the cache fits target_bytes."""
+        excess = self.size_bytes() - target_bytes
+        if excess <= 0:
+            return 0
+        victims = []
+        with self._lock:
+            for k, dim in self._db.execute("SELECT key, dim FROM entries ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                victims.append(k)
+                excess -= dim * self.dtype.itemsize
+            n = self._release(victims)
+            self._db.commit()
+        return n
+
+    def prune(self, model_id: str, keep_texts: Iterable[str]) -> int:
+        """Drop entries for model_id whose text is not in keep_texts."""
+        keep = {cache_key(model_id, t) for t in keep_texts}
+        with self._lock:
+            stale = [k for (k,) in self._db.execute("SELECT key FROM entries WHERE model=?", (model_id,))
+                     if k not in keep]
+            n = self._release(stale)
+            self._db.commit()
+        return n
+
+    def stats(self) -> dict:
+        return {"entries": self.count(), "bytes": self.size_bytes(), "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
+
+_cache = None
+
+def get_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if os.getenv("ACADEMYRAG_EMBED_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        cache_dir = os.getenv("ACADEMYRAG_EMBED_CACHE_DIR", "./data/embed_cache")
+        max_mb = float(os.getenv("ACADEMYRAG_EMBED_CACHE_MAX_MB", "1024"))
+        dtype = os.getenv("ACADEMYRAG_EMBED_CACHE_DTYPE", "float16")
+        _cache = EmbeddingCache(cache_dir, int(max_mb * 1024 * 1024), dtype=dtype)
+    return _cache
+
+def _indexed_documents(page: int = 1000):
+    from .store import get_store
+    store = get_store()
+    offset = 0
+    while True:
+        res = store.get(include=["documents"], limit=page, offset=offset)
+        docs = res.get("documents") or []
+        if not docs:
+            break
+        yield from docs
+        offset += len(docs)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from .embed import Embedder
+
+    ap = argparse.ArgumentParser(description="Inspect and maintain the embedding cache.")
+    ap.add_argument("--stats", action="store_true", help="Print entry count and size")
+    ap.add_argument("--prune", action="store_true", help="Drop entries not referenced by the current index")
+    ap.add_argument("--max_mb", type=float, default=None, help="Evict LRU entries down to this size")
+    args = ap.parse_args()
+
+    cache = get_cache()
+    if cache is None:
+        print("[INFO] Embedding cache disabled (ACADEMYRAG_EMBED_CACHE=0).")
+    else:
+        if args.prune:
+            model_id = ":".join(Embedder().resolve())
+            n = cache.prune(model_id, _indexed_documents())
+            print(f"[OK] Pruned {n} unreferenced entries for {model_id}.")
+        if args.max_mb is not None:
+            n = cache.evict(int(args.max_mb * 1024 * 1024))
+            print(f"[OK] Evicted {n} entries.")
+        st = cache.stats()
+        print(f"[INFO] {st['entries']} entries, {st['bytes'] / 1e6:0.1f}MB (cap {st['max_bytes'] / 1e6:0.0f}MB)")
@@ -7,6 +7,13 @@ Metrics:
 - MAP (Mean Average Precision)
 - nDCG@k
 - Faithfulness (lexical grounding score of answer to retrieved context)
+- Latency p50/p95/p99 per stage (embed, vector/lexical search, rerank, generation)
+
+Ranking metrics are computed with NumPy over a padded hit matrix for a whole
+batch of queries (and any extra k cutoffs) at once; hits come from a
+per-query doc_title -> pages lookup. Per-example rows, including their hit
+lists, stream to JSONL, so `--rescore` can sweep k over a large log without
+retrieving again.
 
 Dataset format (JSONL):
 Each line is a JSON object:
@@ -25,49 +32,110 @@ A retrieved chunk counts as a hit if its metadata matches any gold item:
 """
 
 from __future__ import annotations
-import json, math, argparse, os, re
-from typing import List, Dict, Any, Optional, Tuple
+import json, math, argparse, os, re, time
+from array import array
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Iterator
 from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
 
-from .retrieve import retrieve_with_rerank
+from .retrieve import retrieve_with_rerank, retrieve_many
 from .generate import generate_answer
 
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
 def _normalize_text(s: str) -> List[str]:
     if not s:
         return []
-    s = s.lower()
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    toks = [t for t in s.split() if t]
-    return toks
+    return _TOKEN_RE.findall(s.lower())
+
+@lru_cache(maxsize=65536)
+def _token_set(s: str) -> frozenset:
+    # Retrieved chunks recur across queries, so each text is tokenized once.
+    return frozenset(_normalize_text(s))
 
 def _jaccard(a: str, b: str) -> float:
-    A, B = set(_normalize_text(a)), set(_normalize_text(b))
+    A, B = _token_set(a), _token_set(b)
     if not A or not B:
         return 0.0
     return len(A & B) / len(A | B)
 
+GoldLookup = Dict[Any, set]
+
+def gold_lookup(gold: List[Dict[str, Any]]) -> GoldLookup:
+    """doc_title -> gold pages; a None page matches any page of that title."""
+    lookup: GoldLookup = defaultdict(set)
+    for g in gold:
+        lookup[g.get("doc_title")].add(g.get("page", None))
+    return dict(lookup)
+
+def _is_hit(lookup: GoldLookup, meta: Dict[str, Any]) -> int:
+    pages = lookup.get(meta.get("doc_title"))
+    return int(pages is not None and (None in pages or meta.get("page", None) in pages))
+
 def _match_retrieved_to_gold(retrieved: List[Dict[str, Any]],
                              gold: List[Dict[str, Any]]) -> List[int]:
     """
     Returns a binary list hits where hits[i] == 1 if retrieved[i] matches any gold item.
     Match on doc_title, and (if provided) page must match.
     """
+    lookup = gold_lookup(gold)
     hits = []
     for d in retrieved:
-        meta = d.get("metadata", {})
-        r_title = meta.get("doc_title")
-        r_page = meta.get("page", None)
-        ok = 0
-        for g in gold:
-            g_title = g.get("doc_title")
-            g_page  = g.get("page", None)
-            if r_title == g_title:
-                if g_page is None or g_page == r_page:
-                    ok = 1
-                    break
-        hits.append(ok)
+        # A near-duplicate hit counts for any document it also appears in.
+        metas = [d.get("metadata", {})] + [a["metadata"] for a in d.get("aliases", ())]
+        hits.append(max(_is_hit(lookup, m) for m in metas))
     return hits
 
+def hit_matrix(hit_lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pad per-query hit lists into a (queries, max_len) matrix; also returns the lengths."""
+    lengths = np.fromiter((len(h) for h in hit_lists), dtype=np.int64, count=len(hit_lists))
+    H = np.zeros((len(hit_lists), max(1, int(lengths.max(initial=0)))), dtype=np.float64)
+    for q, h in enumerate(hit_lists):
+        H[q, :len(h)] = h
+    return H, lengths
+
+def ranking_metrics(H: np.ndarray, lengths: np.ndarray, n_relevant: np.ndarray,
+                    k, extra_ks: Sequence[int] = ()) -> Dict[str, np.ndarray]:
+    """
+    P@k, R@k, MRR, MAP and nDCG@k for every query at once. k is a scalar or a
+    per-query array; each of extra_ks adds P@<k>, R@<k> and nDCG@<k>. Same
+    definitions as the scalar helpers below, padding included.
+    """
+    Q, K = H.shape
+    ranks = np.arange(1, K + 1, dtype=np.float64)
+    disc = 1.0 / np.log2(ranks + 1.0)
+    cum = np.cumsum(H, axis=1)
+    cum_dcg = np.cumsum(H * disc, axis=1)
+    cum_idcg = np.concatenate([[0.0], np.cumsum(disc)])
+    found = cum[:, -1]
+    n_relevant = np.asarray(n_relevant, dtype=np.float64)
+
+    first = H.argmax(axis=1) + 1.0
+    out = {
+        "MRR": np.where(found > 0, 1.0 / first, 0.0),
+        "MAP": np.where(found > 0, (H * cum / ranks).sum(axis=1) / np.maximum(found, 1.0), 0.0),
+    }
+
+    def at(kv, suffix):
+        kv = np.broadcast_to(np.asarray(kv, dtype=np.int64), (Q,))
+        kk = np.minimum(kv, K)
+        idx = np.maximum(kk - 1, 0)[:, None]
+        hk = np.where(kk > 0, np.take_along_axis(cum, idx, axis=1)[:, 0], 0.0)
+        dcg = np.where(kk > 0, np.take_along_axis(cum_dcg, idx, axis=1)[:, 0], 0.0)
+        idcg = cum_idcg[np.minimum(found, kk).astype(np.int64)]
+        denom = np.minimum(kv, lengths)
+        out[f"P@{suffix}"] = np.where(denom > 0, hk / np.maximum(denom, 1), 0.0)
+        out[f"R@{suffix}"] = np.where(n_relevant > 0, hk / np.maximum(n_relevant, 1.0), 0.0)
+        out[f"nDCG@{suffix}"] = np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1.0), 0.0)
+
+    at(k, "k")
+    for kx in extra_ks:
+        at(kx, kx)
+    return out
+
 def precision_at_k(hits: List[int], k: int) -> float:
     k = min(k, len(hits))
     if k == 0: return 0.0
@@ -117,70 +185,260 @@ def faithfulness_score(answer_text: str, retrieved_texts: List[str]) -> float:
     """
     if not answer_text or not retrieved_texts:
         return 0.0
-    scores = [_jaccard(answer_text, ctx) for ctx in retrieved_texts]
-    scores.sort(reverse=True)
-    top = scores[:3] if len(scores) >= 3 else scores
-    if not top: 
+    A = _token_set(answer_text)
+    if not A:
         return 0.0
+    scores = []
+    for ctx in retrieved_texts:
+        B = _token_set(ctx)
+        scores.append(len(A & B) / len(A | B) if B else 0.0)
+    top = sorted(scores, reverse=True)[:3]
     return sum(top) / len(top)
 
+def _score_batch(golds: List[List[Dict[str, Any]]], retrieved_lists: List[List[Dict[str, Any]]],
+                 k: int, extra_ks: Sequence[int] = ()) -> List[Dict[str, Any]]:
+    """Per-query hits, gold count and ranking metrics for a batch sharing k."""
+    hit_lists = [_match_retrieved_to_gold(r, g) for g, r in zip(golds, retrieved_lists)]
+    H, lengths = hit_matrix(hit_lists)
+    n_gold = np.asarray([len(g) for g in golds])
+    m = ranking_metrics(H, lengths, n_gold, k, extra_ks)
+    return [{"hits": h, "n_gold": int(n_gold[q]), **{name: float(v[q]) for name, v in m.items()}}
+            for q, h in enumerate(hit_lists)]
+
+def _score_retrieved(gold: List[Dict[str, Any]],
+                     retrieved: List[Dict[str, Any]],
+                     k: int) -> Dict[str, float]:
+    row = _score_batch([gold], [retrieved], k)[0]
+    return {key: row[key] for key in ("P@k", "R@k", "MRR", "MAP", "nDCG@k")}
+
+def _judge(query: str, retrieved: List[Dict[str, Any]], answer=generate_answer) -> Dict[str, float]:
+    # Build answer from retrieved context and score grounding
+    t0 = time.perf_counter()
+    ans = answer(query, retrieved, use_cache=False)  # measure the model, not the cache
+    generate_ms = (time.perf_counter() - t0) * 1000.0
+    answer_text = ans.get("text", "") or ""
+    retrieved_texts = [d.get("text", "") for d in retrieved]
+    return {
+        "faithfulness": faithfulness_score(answer_text, retrieved_texts),
+        "answer_len": len(answer_text.split()),
+        "generate_ms": generate_ms,
+    }
+
 def evaluate_query(query: str,
                    gold: List[Dict[str, Any]],
                    k: int = 6,
-                   judge_answer: bool = True) -> Dict[str, float]:
+                   judge_answer: bool = True,
+                   rerank: Optional[bool] = None) -> Dict[str, float]:
     """
     Retrieve, compute ranking metrics, optionally generate answer and compute faithfulness.
     """
-    retrieved = retrieve_with_rerank(query, top_k=k)
-    hits = _match_retrieved_to_gold(retrieved, gold)
-    total_relevant = len(gold)
-
-    metrics = {
-        "P@k": precision_at_k(hits, k),
-        "R@k": recall_at_k(hits, k, total_relevant),
-        "MRR": reciprocal_rank(hits),
-        "MAP": average_precision(hits),
-        "nDCG@k": ndcg_at_k(hits, k),
-    }
-
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    retrieved = retrieve_many([query], top_k=k, rerank=rerank, timings=timings)[0]
+    retrieve_ms = (time.perf_counter() - t0) * 1000.0
+    metrics = {**_score_retrieved(gold, retrieved, k), **timings, "retrieve_ms": retrieve_ms}
     if judge_answer:
-        # Build answer from retrieved context and score grounding
-        ans = generate_answer(query, retrieved)
-        answer_text = ans.get("text", "") or ""
-        retrieved_texts = [d.get("text", "") for d in retrieved]
-        metrics["faithfulness"] = faithfulness_score(answer_text, retrieved_texts)
-        metrics["answer_len"] = len(answer_text.split())
+        metrics.update(_judge(query, retrieved))
     return metrics
 
+LATENCY_PERCENTILES = (50, 95, 99)
+
+def _percentiles(vals) -> Dict[str, float]:
+    vals = np.asarray(vals, dtype=np.float64)
+    return {f"p{p}": float(np.percentile(vals, p)) for p in LATENCY_PERCENTILES}
+
+def latency_summary(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """p50/p95/p99 for every *_ms field in the per-example results."""
+    stages = sorted({key for r in results for key in r if key.endswith("_ms")})
+    return {stage: _percentiles([r[stage] for r in results if stage in r]) for stage in stages}
+
+# Per-example fields that are not averaged into the macro metrics.
+_ROW_META = ("i", "query", "k", "hits", "n_gold")
+
+class _Aggregate:
+    """Running macro sums and latency samples, so per-example rows need not be kept."""
+
+    def __init__(self):
+        self.n = 0
+        self.sums: Dict[str, float] = defaultdict(float)
+        self.ms: Dict[str, array] = defaultdict(lambda: array("d"))
+
+    def add(self, row: Dict[str, Any]):
+        self.n += 1
+        for key, val in row.items():
+            if key in _ROW_META:
+                continue
+            self.sums[key] += float(val)
+            if key.endswith("_ms"):
+                self.ms[key].append(float(val))
+
+    def macro(self) -> Dict[str, float]:
+        n = max(1, self.n)
+        return {key: val / n for key, val in self.sums.items()}
+
+    def latency(self) -> Dict[str, Dict[str, float]]:
+        return {stage: _percentiles(self.ms[stage]) for stage in sorted(self.ms)}
+
+def _iter_partial(path: str, examples: List[Tuple[str, Any, int]]) -> Iterator[Dict[str, Any]]:
+    # Rows already streamed by an earlier run. Rows whose query no longer
+    # matches the dataset line, and a torn final line, are skipped.
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            i = row.get("i")
+            if isinstance(i, int) and 0 <= i < len(examples) and examples[i][0] == row.get("query"):
+                yield row
+
 def evaluate_dataset(jsonl_path: str,
                      default_k: int = 6,
-                     judge_answer: bool = True) -> Dict[str, Any]:
+                     judge_answer: bool = True,
+                     rerank: Optional[bool] = None,
+                     batch_size: int = 64,
+                     workers: Optional[int] = None,
+                     out_path: Optional[str] = None,
+                     resume: bool = False,
+                     extra_ks: Sequence[int] = (),
+                     server: Optional[str] = None) -> Dict[str, Any]:
     """
-    Evaluate a JSONL dataset; returns macro-averaged metrics and per-example results.
+    Evaluate a JSONL dataset; returns the example count, macro-averaged
+    metrics and latency percentiles per stage.
+
+    Queries are retrieved batch_size at a time through retrieve_many() (stage
+    times are the batch time divided across its queries) and each batch is
+    scored in one vectorized pass; extra_ks adds P/R/nDCG at those cutoffs.
+    Answer generation runs on `workers` threads (ACADEMYRAG_EVAL_WORKERS,
+    default 4). If out_path is given, each result is appended to it as a JSON
+    line when it finishes and only running totals stay in memory; with
+    resume=True examples already there are skipped. Without out_path the
+    per-example rows are returned under "results". With `server` (a
+    rag.server URL) retrieval and generation run there instead.
     """
-    results = []
+    examples = []
     with open(jsonl_path, "r", encoding="utf-8") as f:
         for line in f:
             if not line.strip():
                 continue
             ex = json.loads(line)
-            q = ex["query"]
-            gold = ex.get("gold", [])
-            k = int(ex.get("k", default_k))
-            m = evaluate_query(q, gold, k=k, judge_answer=judge_answer)
-            results.append({"query": q, "k": k, **m})
-
-    # Aggregate
-    agg = defaultdict(float)
-    for r in results:
-        for key, val in r.items():
-            if key in ("query", "k"):
-                continue
-            agg[key] += float(val)
+            examples.append((ex["query"], ex.get("gold", []), int(ex.get("k", default_k))))
+    if workers is None:
+        workers = int(os.getenv("ACADEMYRAG_EVAL_WORKERS", "4"))
+    retrieve, answer = retrieve_many, generate_answer
+    if server:
+        from .client import Client
+        client = Client(server)
+        retrieve, answer = client.retrieve_many, client.generate_answer
+
+    agg = _Aggregate()
+    kept: Optional[List[Dict[str, Any]]] = [] if out_path is None else None
+    done = set()
+    if out_path and resume:
+        for row in _iter_partial(out_path, examples):
+            if row["i"] not in done:
+                done.add(row["i"])
+                agg.add(row)
+        print(f"[INFO] Resuming: {len(done)}/{len(examples)} examples already scored.")
+    out = open(out_path, "a" if resume else "w", encoding="utf-8") if out_path else None
+    if out is not None and out.tell() > 0:
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                out.write("\n")  # don't glue the next row onto a torn line
+
+    def emit(row: Dict[str, Any]):
+        agg.add(row)
+        if out is not None:
+            out.write(json.dumps(row) + "\n")
+            out.flush()
+        else:
+            kept.append(row)
+
+    # Batch examples that share k so each sees exactly the retrieval it would alone.
+    by_k: Dict[int, List[int]] = defaultdict(list)
+    for i, (_, _, k) in enumerate(examples):
+        if i not in done:
+            by_k[k].append(i)
+    step = max(1, batch_size)
+    pool = ThreadPoolExecutor(max_workers=max(1, workers)) if judge_answer else None
+    pending = {}
+    try:
+        for k, idx in by_k.items():
+            for start in range(0, len(idx), step):
+                batch = idx[start:start + step]
+                timings: Dict[str, float] = {}
+                t0 = time.perf_counter()
+                retrieved_all = retrieve([examples[i][0] for i in batch], top_k=k,
+                                         rerank=rerank, timings=timings)
+                timings["retrieve_ms"] = (time.perf_counter() - t0) * 1000.0
+                per_query = {key: ms / len(batch) for key, ms in timings.items()}
+                scores = _score_batch([examples[i][1] for i in batch], retrieved_all, k, extra_ks)
+                for i, retrieved, sc in zip(batch, retrieved_all, scores):
+                    q = examples[i][0]
+                    row = {"i": i, "query": q, "k": k, **sc, **per_query}
+                    if pool is None:
+                        emit(row)
+                    else:
+                        pending[pool.submit(_judge, q, retrieved, answer)] = row
+                # Keep retrieval at most a few batches ahead of generation.
+                while len(pending) > max(step, 4 * workers):
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        emit({**pending.pop(fut), **fut.result()})
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                emit({**pending.pop(fut), **fut.result()})
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if out is not None:
+            out.close()
+
+    report = {"n": agg.n, "macro": agg.macro(), "latency": agg.latency()}
+    if kept is not None:
+        report["results"] = sorted(kept, key=lambda r: r["i"])
+    return report
 
-    n = max(1, len(results))
-    macro = {k: v / n for k, v in agg.items()}
-    return {"macro": macro, "results": results}
+def rescore(results_path: str, extra_ks: Sequence[int] = (), block: int = 8192) -> Dict[str, Any]:
+    """
+    Recompute ranking metrics from a results JSONL (its "hits"/"n_gold"/"k"
+    fields), e.g. to sweep k over a large log without retrieving again.
+    Lines are read and scored block rows at a time.
+    """
+    agg = _Aggregate()
+    skipped = 0
+
+    def flush(rows):
+        H, lengths = hit_matrix([r["hits"] for r in rows])
+        m = ranking_metrics(H, lengths, np.asarray([r["n_gold"] for r in rows]),
+                            np.asarray([r["k"] for r in rows]), extra_ks)
+        agg.n += len(rows)
+        for name, v in m.items():
+            agg.sums[name] += float(v.sum())
+
+    rows = []
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if "hits" not in row or "n_gold" not in row:
+                skipped += 1
+                continue
+            rows.append(row)
+            if len(rows) >= block:
+                flush(rows)
+                rows = []
+    if rows:
+        flush(rows)
+    if skipped:
+        print(f"[WARN] Skipped {skipped} rows without hits/n_gold (written before they were recorded).")
+    return {"n": agg.n, "macro": agg.macro()}
 
 def _fmt_table(rows: List[Tuple[str, float]]) -> str:
     name_w = max(len(n) for n, _ in rows)
@@ -189,24 +447,81 @@ def _fmt_table(rows: List[Tuple[str, float]]) -> str:
         lines.append(f"{n.ljust(name_w)} : {v:0.4f}")
     return "\n".join(lines)
 
-def main():
+def compare_rerank(jsonl_path: str, default_k: int = 6, server: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Retrieval-only ablation: the same dataset with the reranker off and on,
+    so its quality gain can be read next to its latency cost.
+    """
+    if not server:
+        # Warm the store, embedder and cross-encoder so load time isn't charged to either side.
+        from .rerank import get_reranker
+        retrieve_with_rerank("warmup", top_k=1, rerank=False)
+        get_reranker()
+    off = evaluate_dataset(jsonl_path, default_k=default_k, judge_answer=False, rerank=False, server=server)
+    on = evaluate_dataset(jsonl_path, default_k=default_k, judge_answer=False, rerank=True, server=server)
+    return {"off": off, "on": on}
+
+def main(argv: Optional[List[str]] = None):
     ap = argparse.ArgumentParser(description="Evaluate AcademyRAG on a JSONL dataset.")
-    ap.add_argument("--data", required=True, help="Path to eval.jsonl")
+    ap.add_argument("--data", default=None, help="Path to eval.jsonl")
     ap.add_argument("--k", type=int, default=6, help="Default top-k for retrieval")
     ap.add_argument("--no-answer", action="store_true", help="Skip answer generation & faithfulness")
-    args = ap.parse_args()
+    ap.add_argument("--batch_size", type=int, default=64, help="Queries retrieved per batch")
+    ap.add_argument("--workers", type=int, default=None, help="Concurrent answer generations (default ACADEMYRAG_EVAL_WORKERS or 4)")
+    ap.add_argument("--resume", action="store_true", help="Skip examples already in <data>.results.jsonl")
+    ap.add_argument("--rerank", choices=["on", "off", "compare"], default=None,
+                    help="Force the reranker on/off, or compare both (retrieval only)")
+    ap.add_argument("--ks", type=str, default="", help="Extra cutoffs for P/R/nDCG, e.g. 1,3,10")
+    ap.add_argument("--rescore", type=str, default=None, metavar="RESULTS_JSONL",
+                    help="Recompute ranking metrics from an earlier results stream instead of running")
+    ap.add_argument("--server", type=str, default=None, metavar="URL",
+                    help="Retrieve and generate through a running rag.server instead of in-process")
+    args = ap.parse_args(argv)
+    extra_ks = [int(x) for x in args.ks.split(",") if x.strip()]
 
-    report = evaluate_dataset(args.data, default_k=args.k, judge_answer=(not args.no_answer))
+    if args.rescore:
+        report = rescore(args.rescore, extra_ks)
+        print(f"\n== Macro Averages ({report['n']} examples) ==")
+        print(_fmt_table(sorted(report["macro"].items())))
+        return
+    if not args.data:
+        ap.error("--data is required unless --rescore is given")
+
+    if args.rerank == "compare":
+        report = compare_rerank(args.data, default_k=args.k, server=args.server)
+        off, on = report["off"]["macro"], report["on"]["macro"]
+        print("\n== Rerank ablation (off -> on) ==")
+        name_w = max(len(n) for n in off)
+        for key in sorted(off):
+            print(f"{key.ljust(name_w)} : {off[key]:0.4f} -> {on[key]:0.4f}  ({on[key] - off[key]:+0.4f})")
+        out_path = os.path.splitext(args.data)[0] + ".rerank.results.json"
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote detailed results → {out_path}")
+        return
+
+    rerank = None if args.rerank is None else args.rerank == "on"
+    stream_path = os.path.splitext(args.data)[0] + ".results.jsonl"
+    report = evaluate_dataset(args.data, default_k=args.k, judge_answer=(not args.no_answer), rerank=rerank,
+                              batch_size=args.batch_size, workers=args.workers,
+                              out_path=stream_path, resume=args.resume, extra_ks=extra_ks,
+                              server=args.server)
     macro = report["macro"]
     print("\n== Macro Averages ==")
-    rows = [(k, macro[k]) for k in sorted(macro.keys())]
+    rows = [(k, macro[k]) for k in sorted(macro.keys()) if not k.endswith("_ms")]
     print(_fmt_table(rows))
 
-    # Optionally write detailed results
+    print("\n== Latency (ms) ==")
+    name_w = max([len(n) for n in report["latency"]] + [5])
+    print(f"{'stage'.ljust(name_w)}   " + "  ".join(f"{'p' + str(p):>9}" for p in LATENCY_PERCENTILES))
+    for stage, pct in report["latency"].items():
+        print(f"{stage.ljust(name_w)} : " + "  ".join(f"{pct['p' + str(p)]:9.2f}" for p in LATENCY_PERCENTILES))
+
+    # Summary only; the per-example rows are in the stream.
     out_path = os.path.splitext(args.data)[0] + ".results.json"
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(report, f, indent=2)
-    print(f"\nWrote detailed results → {out_path}")
+    print(f"\nWrote summary → {out_path} (per-example results: {stream_path})")
 
 if __name__ == "__main__":
     main()
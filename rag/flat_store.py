@@ -0,0 +1,520 @@
+"""
+Flat, memory-mapped vector store with exact search.
+
+Layout under {ACADEMYRAG_DB_DIR}/flat/:
+
+- vectors.f32|.f16   row-major matrix of L2-normalized embeddings (append-only)
+- ids.txt            chunk id per row (append-only)
+- docs.jsonl         {"document", "metadata"} per row (append-only sidecar)
+- offsets.i64        byte offset of each row's line in docs.jsonl
+- deleted.i32        tombstoned rows (append-only log)
+- meta.json          dim, dtype, committed row count and file sizes
+- codes.bin          compressed mode only: int8 or PQ code per row (rag/quantize.py)
+- quantizer.npz      compressed mode only: int8 scales or PQ codebooks
+
+A query is one matrix product against the mapped rows plus argpartition;
+there is no graph or SQLite to load, so a cold start only maps the file, and
+processes opening the same index share its pages through the OS cache.
+Rewriting an id tombstones its old row; `--compact` drops dead rows.
+Distances are squared L2 between unit vectors (2 - 2cos), matching Chroma's
+default space, so retrieval scores keep their meaning across backends.
+A filtered query (a catalog Selection) gathers and scores only the selected
+rows.
+
+In compressed mode (`--compress int8|pq`) queries scan the small codes
+instead; the best n * ACADEMYRAG_FLAT_RESCORE (default 4) candidates are
+re-scored exactly against the full-precision rows, which are read from the
+mapped file only for those candidates. `--recall` reports recall@k of both
+the raw codes and the re-scored search against exact search.
+
+CLI:
+  python -m rag.flat_store --stats
+  python -m rag.flat_store --import-chroma   # copy the Chroma collection in
+  python -m rag.flat_store --compact
+  python -m rag.flat_store --compress pq --pq_m 96 --recall
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+from array import array
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from .store import VectorStore, DEFAULT_INCLUDE
+from .quantize import train_quantizer, save_quantizer, load_quantizer
+
+# Cap on the scores matrix computed at once (queries x rows), in floats.
+_SCORE_BLOCK = 1 << 25
+# Rows sampled to train a quantizer.
+_TRAIN_ROWS = 25000
+
+class FlatStore(VectorStore):
+    def __init__(self, path: str, dtype: str = "float32"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.rescore = int(os.getenv("ACADEMYRAG_FLAT_RESCORE", "4"))
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._load()
+
+    # ---- files ------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _vec_path(self) -> str:
+        return self._file("vectors.f16" if self.dtype == np.float16 else "vectors.f32")
+
+    def _load(self):
+        meta_path = self._file("meta.json")
+        self._meta = {"dim": None, "dtype": self.dtype.name, "rows": 0, "live": 0,
+                      "ids_bytes": 0, "docs_bytes": 0, "deleted": 0}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self._meta.update(json.load(f))
+            self.dtype = np.dtype(self._meta["dtype"])
+        self._meta_mtime = os.stat(meta_path).st_mtime_ns if os.path.exists(meta_path) else None
+        rows = self._meta["rows"]
+        # Anything past the committed sizes is the tail of an interrupted write.
+        self._ids: List[str] = []
+        if rows:
+            with open(self._file("ids.txt"), "rb") as f:
+                self._ids = f.read(self._meta["ids_bytes"]).decode("utf-8").splitlines()
+        self._offsets = array("q")
+        if rows:
+            with open(self._file("offsets.i64"), "rb") as f:
+                self._offsets.frombytes(f.read(rows * 8))
+        self._dead = bytearray(rows)
+        if self._meta["deleted"]:
+            with open(self._file("deleted.i32"), "rb") as f:
+                for num in np.frombuffer(f.read(self._meta["deleted"] * 4), dtype=np.int32).tolist():
+                    self._dead[num] = 1
+        self._row: Dict[str, int] = {cid: i for i, cid in enumerate(self._ids) if not self._dead[i]}
+        self._vecs: Optional[np.memmap] = None
+        self._codes: Optional[np.memmap] = None
+        self._quant = None
+        if self._meta.get("compression"):
+            self._quant = load_quantizer(self._file("quantizer.npz"))
+        self._map_vectors()
+        self._clean = False
+
+    @staticmethod
+    def _mapped(path: str, dtype: np.dtype, width: int, min_rows: int,
+                current: Optional[np.memmap]) -> Optional[np.memmap]:
+        row_bytes = width * dtype.itemsize
+        cap = (os.path.getsize(path) if os.path.exists(path) else 0) // row_bytes
+        if min_rows > cap:
+            # Grow geometrically so appends stay amortized O(1).
+            cap = max(min_rows, cap * 2, 4096)
+            with open(path, "ab") as f:
+                f.truncate(cap * row_bytes)
+            current = None
+        if cap and (current is None or current.shape[0] != cap):
+            current = np.memmap(path, dtype=dtype, mode="r+", shape=(cap, width))
+        return current
+
+    def _map_vectors(self, min_rows: int = 0):
+        dim = self._meta["dim"]
+        if not dim:
+            return
+        self._vecs = self._mapped(self._vec_path(), self.dtype, dim, min_rows, self._vecs)
+        if self._quant is not None:
+            self._codes = self._mapped(self._file("codes.bin"), np.dtype(self._quant.code_dtype),
+                                       self._quant.code_len, min_rows, self._codes)
+
+    def _truncate_tails(self):
+        # Before the first write: drop bytes an interrupted writer left past the commit point.
+        if self._clean:
+            return
+        for name, size in (("ids.txt", self._meta["ids_bytes"]), ("docs.jsonl", self._meta["docs_bytes"]),
+                           ("offsets.i64", self._meta["rows"] * 8), ("deleted.i32", self._meta["deleted"] * 4)):
+            p = self._file(name)
+            if os.path.exists(p) and os.path.getsize(p) > size:
+                with open(p, "r+b") as f:
+                    f.truncate(size)
+        self._clean = True
+
+    def _write_meta(self):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, self._file("meta.json"))
+        self._meta_mtime = os.stat(self._file("meta.json")).st_mtime_ns
+
+    def _refresh(self):
+        # Pick up rows committed by another process (e.g. an ingest next to the app).
+        try:
+            mtime = os.stat(self._file("meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._meta_mtime:
+            self._load()
+
+    # ---- updates ----------------------------------------------------------
+
+    def _tombstone(self, rows: List[int]):
+        if not rows:
+            return
+        with open(self._file("deleted.i32"), "ab") as f:
+            f.write(np.asarray(rows, dtype=np.int32).tobytes())
+        for r in rows:
+            self._dead[r] = 1
+        self._meta["deleted"] += len(rows)
+        self._meta["live"] -= len(rows)
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        if not ids:
+            return
+        arr = np.asarray(embeddings, dtype=np.float32)
+        # Out of place: asarray may hand back the caller's own array.
+        arr = arr / np.maximum(np.linalg.norm(arr, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._truncate_tails()
+            if self._meta["dim"] is None:
+                self._meta["dim"] = int(arr.shape[1])
+            elif arr.shape[1] != self._meta["dim"]:
+                raise ValueError(f"Embedding dimension {arr.shape[1]} != index dimension {self._meta['dim']}")
+            start = self._meta["rows"]
+            self._tombstone(sorted({self._row[cid] for cid in ids if cid in self._row}))
+            self._map_vectors(start + len(ids))
+            self._vecs[start:start + len(ids)] = arr
+            self._vecs.flush()
+            if self._quant is not None:
+                self._codes[start:start + len(ids)] = self._quant.encode(arr)
+                self._codes.flush()
+
+            lines, offsets = [], array("q")
+            pos = self._meta["docs_bytes"]
+            for doc, meta in zip(documents, metadatas):
+                line = (json.dumps({"document": doc, "metadata": meta}, ensure_ascii=False) + "\n").encode("utf-8")
+                offsets.append(pos)
+                pos += len(line)
+                lines.append(line)
+            with open(self._file("docs.jsonl"), "ab") as f:
+                f.writelines(lines)
+            with open(self._file("offsets.i64"), "ab") as f:
+                f.write(offsets.tobytes())
+            id_bytes = "".join(cid + "\n" for cid in ids).encode("utf-8")
+            with open(self._file("ids.txt"), "ab") as f:
+                f.write(id_bytes)
+
+            dupes = []
+            for i, cid in enumerate(ids):
+                if cid in self._row and self._row[cid] >= start:
+                    dupes.append(self._row[cid])  # repeated within this batch: last one wins
+                self._row[cid] = start + i
+            self._ids.extend(ids)
+            self._offsets.extend(offsets)
+            self._dead.extend(bytes(len(ids)))
+            self._meta["rows"] += len(ids)
+            self._meta["live"] += len(ids)
+            self._tombstone(dupes)
+            self._meta["ids_bytes"] += len(id_bytes)
+            self._meta["docs_bytes"] = pos
+            self._write_meta()
+
+    def delete(self, ids):
+        with self._lock:
+            self._truncate_tails()
+            rows = [self._row.pop(cid) for cid in ids if cid in self._row]
+            if rows:
+                self._tombstone(rows)
+                self._write_meta()
+
+    # ---- reads ------------------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._row)
+
+    def _records(self, rows: List[int]) -> List[Dict[str, Any]]:
+        out = []
+        with open(self._file("docs.jsonl"), "rb") as f:
+            for r in rows:
+                f.seek(self._offsets[r])
+                out.append(json.loads(f.readline()))
+        return out
+
+    def _result(self, rows: List[int], include: Sequence[str]) -> Dict[str, Any]:
+        res: Dict[str, Any] = {"ids": [self._ids[r] for r in rows]}
+        if "documents" in include or "metadatas" in include:
+            recs = self._records(rows)
+            if "documents" in include:
+                res["documents"] = [rec["document"] for rec in recs]
+            if "metadatas" in include:
+                res["metadatas"] = [rec["metadata"] for rec in recs]
+        if "embeddings" in include:
+            res["embeddings"] = [self._vecs[r].astype(np.float32).tolist() for r in rows]
+        return res
+
+    def get(self, ids=None, include=DEFAULT_INCLUDE, limit=None, offset=None):
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                rows = [self._row[cid] for cid in ids if cid in self._row]
+            else:
+                live = np.flatnonzero(np.frombuffer(self._dead, dtype=np.uint8) == 0)
+                start = offset or 0
+                rows = live[start:start + limit if limit is not None else None].tolist()
+            return self._result(rows, include)
+
+    def _scores(self, q: np.ndarray, rows: int) -> np.ndarray:
+        """Cosine similarity of each query row against the first `rows` vectors."""
+        mat = self._vecs[:rows]
+        if mat.dtype == np.float32:
+            return q @ np.asarray(mat).T
+        # float16 has no BLAS path; upcast a block at a time.
+        out = np.empty((q.shape[0], rows), dtype=np.float32)
+        step = max(1, _SCORE_BLOCK // max(1, q.shape[1]))
+        for s in range(0, rows, step):
+            out[:, s:s + step] = q @ np.asarray(mat[s:s + step], dtype=np.float32).T
+        return out
+
+    def _search_exact(self, q: np.ndarray, rows: int, n: int, dead: Optional[np.ndarray]):
+        per = max(1, _SCORE_BLOCK // rows)
+        hits: List[List[int]] = []
+        sims: List[np.ndarray] = []
+        for s in range(0, len(q), per):
+            scores = self._scores(q[s:s + per], rows)
+            if dead is not None:
+                scores[:, dead] = -np.inf
+            top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            top_s = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_s, axis=1)
+            hits.extend(np.take_along_axis(top, order, axis=1).tolist())
+            sims.extend(np.take_along_axis(top_s, order, axis=1))
+        return hits, sims
+
+    def _candidates(self, q: np.ndarray, rows: int, depth: int, dead: Optional[np.ndarray]) -> np.ndarray:
+        """Per query, the rows with the best approximate scores from the codes, in row order."""
+        per = max(1, _SCORE_BLOCK // rows)
+        out = []
+        for s in range(0, len(q), per):
+            approx = self._quant.scores(q[s:s + per], self._codes[:rows])
+            if dead is not None:
+                approx[:, dead] = -np.inf
+            out.append(np.sort(np.argpartition(-approx, depth - 1, axis=1)[:, :depth], axis=1))
+        return np.concatenate(out)
+
+    def _search_compressed(self, q: np.ndarray, rows: int, n: int, dead: Optional[np.ndarray]):
+        depth = min(max(n * self.rescore, 32), len(self._row))
+        hits: List[List[int]] = []
+        sims: List[np.ndarray] = []
+        for qv, cand in zip(q, self._candidates(q, rows, depth, dead)):
+            # Exact re-scoring touches only the candidates' full-precision rows.
+            exact = np.asarray(self._vecs[cand], dtype=np.float32) @ qv
+            order = np.argsort(-exact)[:n]
+            hits.append(cand[order].tolist())
+            sims.append(exact[order])
+        return hits, sims
+
+    def _search_subset(self, q: np.ndarray, subset: np.ndarray, n: int):
+        """Exact top-n over the given rows only, so the cost follows the slice, not the index."""
+        step = max(1, _SCORE_BLOCK // max(1, len(q) * q.shape[1]))
+        scores = np.empty((len(q), len(subset)), dtype=np.float32)
+        for s in range(0, len(subset), step):
+            scores[:, s:s + step] = q @ np.asarray(self._vecs[subset[s:s + step]], dtype=np.float32).T
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_s = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_s, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return subset[top].tolist(), list(np.take_along_axis(top_s, order, axis=1))
+
+    def query(self, query_embeddings, n_results=10, include=DEFAULT_INCLUDE + ("distances",), selection=None):
+        q = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        empty = {"ids": [], "distances": [], "documents": [], "metadatas": []}
+        with self._lock:
+            self._refresh()
+            rows = self._meta["rows"]
+            subset = None
+            if selection is not None:
+                subset = np.fromiter((self._row[cid] for cid in selection.ids if cid in self._row), dtype=np.int64)
+                subset.sort()
+            n = min(n_results, len(self._row) if subset is None else len(subset))
+            if n == 0 or self._vecs is None:
+                return {key: [[] for _ in range(len(q))] for key in empty}
+            dead = np.frombuffer(self._dead, dtype=bool) if self._meta["deleted"] else None
+            if subset is not None:
+                # Slices are scored exactly; the codes only pay off on full scans.
+                hits, sims = self._search_subset(q, subset, n)
+            elif self._quant is not None:
+                hits, sims = self._search_compressed(q, rows, n, dead)
+            else:
+                hits, sims = self._search_exact(q, rows, n, dead)
+            out: Dict[str, Any] = {key: [] for key in empty if key == "ids" or key in include}
+            for r, s in zip(hits, sims):
+                res = self._result(r, include)
+                for key in out:
+                    if key == "distances":
+                        out[key].append((2.0 - 2.0 * s).clip(min=0.0).tolist())
+                    else:
+                        out[key].append(res[key])
+            return out
+
+    # ---- maintenance ------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            dim = self._meta["dim"] or 0
+            out = {"rows": self._meta["rows"], "live": len(self._row), "dead": self._meta["deleted"],
+                   "dim": dim, "dtype": self.dtype.name,
+                   "vector_bytes": self._meta["rows"] * dim * self.dtype.itemsize,
+                   "sidecar_bytes": self._meta["docs_bytes"],
+                   "compression": self._meta.get("compression") or "none"}
+            if self._quant is not None:
+                out["code_bytes"] = self._meta["rows"] * self._quant.code_len * np.dtype(self._quant.code_dtype).itemsize
+                out["compression_ratio"] = round(out["vector_bytes"] / max(1, out["code_bytes"]), 2)
+            return out
+
+    def compress(self, kind: str, pq_m: int = 0, seed: int = 0):
+        """
+        Train a quantizer ("int8" or "pq") on a sample of live rows and encode
+        every row; later upserts are encoded as they arrive. "none" goes back
+        to exact search.
+        """
+        with self._lock:
+            self._refresh()
+            self._truncate_tails()
+            self._codes = None
+            if kind == "none":
+                self._quant = None
+                self._meta["compression"] = None
+                self._write_meta()
+                for name in ("codes.bin", "quantizer.npz"):
+                    if os.path.exists(self._file(name)):
+                        os.remove(self._file(name))
+                return
+            rows = self._meta["rows"]
+            live = np.flatnonzero(np.frombuffer(self._dead, dtype=np.uint8) == 0)
+            if len(live) == 0:
+                raise ValueError("Cannot train a quantizer on an empty index")
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(live, size=min(len(live), _TRAIN_ROWS), replace=False))
+            self._quant = train_quantizer(kind, np.asarray(self._vecs[sample], dtype=np.float32), pq_m)
+            if os.path.exists(self._file("codes.bin")):
+                os.remove(self._file("codes.bin"))
+            self._map_vectors(rows)
+            for s in range(0, rows, 65536):
+                # The codes map is sized in whole growth steps, so it can be longer than rows.
+                self._codes[s:min(rows, s + 65536)] = self._quant.encode(np.asarray(self._vecs[s:min(rows, s + 65536)], dtype=np.float32))
+            self._codes.flush()
+            save_quantizer(self._quant, self._file("quantizer.npz"))
+            self._meta["compression"] = kind
+            self._write_meta()
+
+    def recall(self, k: int = 10, queries: int = 200, noise: float = 0.05, seed: int = 0) -> Dict[str, float]:
+        """
+        Recall@k of the compressed search against exact search, using perturbed
+        stored vectors as queries: for the raw codes alone and after re-scoring.
+        """
+        if self._quant is None:
+            raise ValueError("Index is not compressed; run compress() first")
+        with self._lock:
+            self._refresh()
+            rows = self._meta["rows"]
+            k = min(k, len(self._row))
+            live = np.flatnonzero(np.frombuffer(self._dead, dtype=np.uint8) == 0)
+            rng = np.random.default_rng(seed)
+            pick = np.sort(rng.choice(live, size=min(queries, len(live)), replace=False))
+            q = np.asarray(self._vecs[pick], dtype=np.float32)
+            q += rng.normal(scale=noise / np.sqrt(q.shape[1]), size=q.shape).astype(np.float32)
+            q /= np.linalg.norm(q, axis=1, keepdims=True)
+            dead = np.frombuffer(self._dead, dtype=bool) if self._meta["deleted"] else None
+
+            t0 = time.perf_counter()
+            exact, _ = self._search_exact(q, rows, k, dead)
+            exact_ms = (time.perf_counter() - t0) * 1000.0 / len(q)
+            t0 = time.perf_counter()
+            rescored, _ = self._search_compressed(q, rows, k, dead)
+            comp_ms = (time.perf_counter() - t0) * 1000.0 / len(q)
+            raw = self._candidates(q, rows, k, dead).tolist()
+
+        def _recall(found):
+            return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, exact)]))
+        return {"k": k, "queries": len(q), "recall_codes": _recall(raw), "recall_rescored": _recall(rescored),
+                "exact_ms": exact_ms, "compressed_ms": comp_ms}
+
+    def compact(self) -> int:
+        """Rewrite the index without tombstoned rows; returns the rows dropped."""
+        with self._lock:
+            self._refresh()
+            dropped = self._meta["rows"] - len(self._row)
+            if dropped == 0:
+                return 0
+            tmp_path = self.path.rstrip("/") + ".compact"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            fresh = FlatStore(tmp_path, dtype=self.dtype.name)
+            if self._quant is not None:
+                save_quantizer(self._quant, fresh._file("quantizer.npz"))
+                fresh._quant = self._quant
+                fresh._meta["compression"] = self._meta["compression"]
+            live = sorted(self._row.values())
+            for s in range(0, len(live), 4096):
+                part = live[s:s + 4096]
+                recs = self._records(part)
+                fresh.upsert([self._ids[r] for r in part], [rec["document"] for rec in recs],
+                             [rec["metadata"] for rec in recs], np.asarray(self._vecs[part], dtype=np.float32))
+            old_path = self.path.rstrip("/") + ".old"
+            self._vecs = None
+            os.replace(self.path, old_path)
+            os.replace(tmp_path, self.path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            self._load()
+            return dropped
+
+def import_chroma(store: FlatStore, db_dir: str, page: int = 1000) -> int:
+    """Copy every chunk (text, metadata, embedding) from the Chroma collection."""
+    from .store import ChromaStore
+    src = ChromaStore(db_dir)
+    offset = 0
+    while True:
+        res = src.get(include=["documents", "metadatas", "embeddings"], limit=page, offset=offset)
+        if not len(res["ids"]):
+            break
+        store.upsert(res["ids"], res["documents"], res["metadatas"], res["embeddings"])
+        offset += len(res["ids"])
+    return offset
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Maintain the flat vector index.")
+    ap.add_argument("--stats", action="store_true")
+    ap.add_argument("--import-chroma", action="store_true", help="Copy the Chroma collection into the flat index")
+    ap.add_argument("--compact", action="store_true", help="Drop tombstoned rows")
+    ap.add_argument("--compress", choices=["int8", "pq", "none"], default=None,
+                    help="Train a quantizer and encode the index (none: back to exact search)")
+    ap.add_argument("--pq_m", type=int, default=0, help="PQ subspaces (default dim/4; must divide dim)")
+    ap.add_argument("--recall", action="store_true", help="Report recall@k of the compressed index vs exact")
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    store = FlatStore(os.path.join(db_dir, "flat"), dtype=os.getenv("ACADEMYRAG_FLAT_DTYPE", "float32"))
+    if args.import_chroma:
+        t0 = time.perf_counter()
+        n = import_chroma(store, db_dir)
+        print(f"[OK] Imported {n} chunks from Chroma in {time.perf_counter() - t0:0.1f}s.")
+    if args.compact:
+        print(f"[OK] Dropped {store.compact()} dead rows.")
+    if args.compress:
+        t0 = time.perf_counter()
+        store.compress(args.compress, pq_m=args.pq_m)
+        print(f"[OK] Compression set to {args.compress} in {time.perf_counter() - t0:0.1f}s.")
+    if args.recall:
+        rep = store.recall(k=args.k)
+        print(f"[STATS] recall@{rep['k']} over {rep['queries']} queries: codes {rep['recall_codes']:0.3f}, "
+              f"re-scored {rep['recall_rescored']:0.3f}")
+        print(f"[STATS] latency: exact {rep['exact_ms']:0.2f} ms, compressed {rep['compressed_ms']:0.2f} ms per query")
+    if args.stats or not (args.import_chroma or args.compact or args.compress or args.recall):
+        for k, v in store.stats().items():
+            print(f"[STATS] {k}: {v}")
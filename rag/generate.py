@@ -1,68 +1,252 @@
+"""
+LLM generation over an OpenAI-compatible chat API.
+
+Requests run on one background asyncio loop with a single AsyncOpenAI
+client, so HTTP connections are pooled across calls and threads (Streamlit
+reruns, eval workers). Completions are streamed; the sync helpers either
+join the stream (generate_*) or hand tokens over as they arrive (stream_*).
+At most ACADEMYRAG_LLM_CONCURRENCY requests are in flight, and connection
+errors, timeouts, 429s and 5xx are retried with jittered exponential backoff
+as long as no token has been emitted yet.
+
+Answers, summaries and quizzes go through the semantic answer cache
+(rag/answer_cache.py) unless use_cache=False; a cached stream yields the
+whole text at once. On a miss the retrieved chunks are packed into a
+token-budgeted context first (rag/pack.py); citations follow the packed
+blocks.
+
+Env:
+  ACADEMYRAG_LLM_MODEL         default gpt-4o-mini
+  ACADEMYRAG_LLM_BASE_URL      OpenAI-compatible endpoint (default: OpenAI)
+  ACADEMYRAG_LLM_CONCURRENCY   default 8
+  ACADEMYRAG_LLM_MAX_RETRIES   default 3
+  ACADEMYRAG_LLM_TIMEOUT       seconds per request, default 60
+"""
+
 import os
-from typing import List, Dict, Any
+import queue
+import random
+import asyncio
+import time
+import threading
+from typing import List, Dict, Any, AsyncIterator, Iterator, Callable
 
-from openai import OpenAI
 from .prompts import ANSWER_SYSTEM, SUMMARY_SYSTEM, QUIZ_SYSTEM
+from .answer_cache import get_answer_cache
+from .pack import pack_context, format_context
+from . import trace
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_sem = None
+_END = object()
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="academyrag-llm", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def _retryable():
+    # The SDK is imported with the first request, not with this module.
+    import openai
+    return (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError,
+            openai.InternalServerError)
+
+def _get_client() -> "openai.AsyncOpenAI":
+    # Only called from coroutines running on _get_loop(), so no lock is needed
+    # and the client and semaphore are bound to that loop.
+    global _client, _sem
+    if _client is None:
+        import openai
+        base_url = os.getenv("ACADEMYRAG_LLM_BASE_URL") or None
+        api_key = os.getenv("OPENAI_API_KEY")
+        if api_key is None and base_url:
+            api_key = "local"  # local stand-in servers don't check it
+        _client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=float(os.getenv("ACADEMYRAG_LLM_TIMEOUT", "60")),
+            max_retries=0,  # retried here, where we know whether tokens went out
+        )
+        _sem = asyncio.Semaphore(int(os.getenv("ACADEMYRAG_LLM_CONCURRENCY", "8")))
+    return _client
 
-def _client():
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def _format_context(docs: List[Dict[str, Any]]) -> str:
-    parts = []
-    for i, d in enumerate(docs, 1):
-        meta = d.get("metadata", {})
-        title = meta.get("doc_title", "Document")
-        page = meta.get("page")
-        slide = meta.get("slide_title")
-        loc = f"(p.{page})" if page is not None else ""
-        if slide:
-            loc = f"{loc} — {slide}" if loc else slide
-        parts.append(f"[{i}] {title} {loc}\n{d['text']}")
-    return "\n\n".join(parts)
+def _citation(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "doc_title": meta.get("doc_title", "Document"),
+        "page": meta.get("page"),
+        "slide_title": meta.get("slide_title"),
+        "source_path": meta.get("source_path")
+    }
 
 def _citations(docs: List[Dict[str, Any]]):
     cits = []
     for d in docs:
-        meta = d.get("metadata", {})
-        cits.append({
-            "doc_title": meta.get("doc_title", "Document"),
-            "page": meta.get("page"),
-            "slide_title": meta.get("slide_title"),
-            "source_path": meta.get("source_path")
-        })
+        cit = _citation(d.get("metadata", {}))
+        if d.get("aliases"):
+            # The same passage appears in these places too (rag/dedup.py).
+            cit["aliases"] = [_citation(a["metadata"]) for a in d["aliases"]]
+        cits.append(cit)
     return cits
 
-def _chat(system: str, user: str) -> str:
+async def _astream_chat(system: str, user: str) -> AsyncIterator[str]:
+    """Yield completion text deltas as they arrive; runs on the background loop only."""
     prov = os.getenv("ACADEMYRAG_LLM_PROVIDER", "openai")
     if prov != "openai":
         raise RuntimeError("Only OpenAI chat supported in this MVP. Set ACADEMYRAG_LLM_PROVIDER=openai and OPENAI_API_KEY.")
-    cl = _client()
-    msg = cl.chat.completions.create(
-        model=os.getenv("ACADEMYRAG_LLM_MODEL", "gpt-4o-mini"),
-        messages=[
-            {"role":"system","content":system},
-            {"role":"user","content":user}
-        ],
-        temperature=0.2,
-    )
-    return msg.choices[0].message.content
-
-def generate_answer(question: str, docs: List[Dict[str, Any]]):
-    ctx = _format_context(docs)
-    user = f"QUESTION:\n{question}\n\nCONTEXT:\n{ctx}"
-    text = _chat(ANSWER_SYSTEM, user)
-    return {"text": text, "citations": _citations(docs)}
-
-def generate_summary(topic: str, docs: List[Dict[str, Any]]):
-    ctx = _format_context(docs)
-    user = f"TOPIC: {topic}\n\nCONTEXT:\n{ctx}"
-    text = _chat(SUMMARY_SYSTEM, user)
-    return {"text": text, "citations": _citations(docs)}
-
-def generate_quiz(topic: str, docs: List[Dict[str, Any]]):
-    ctx = _format_context(docs)
-    user = f"TOPIC: {topic}\n\nCONTEXT:\n{ctx}"
-    text = _chat(QUIZ_SYSTEM, user)
+    client = _get_client()
+    max_retries = int(os.getenv("ACADEMYRAG_LLM_MAX_RETRIES", "3"))
+    trace.count("llm_requests_total")
+    async with _sem:
+        attempt = 0
+        while True:
+            started = False
+            try:
+                stream = await client.chat.completions.create(
+                    model=os.getenv("ACADEMYRAG_LLM_MODEL", "gpt-4o-mini"),
+                    messages=[
+                        {"role":"system","content":system},
+                        {"role":"user","content":user}
+                    ],
+                    temperature=0.2,
+                    stream=True,
+                )
+                deltas = 0
+                try:
+                    async for event in stream:
+                        if event.choices and event.choices[0].delta.content:
+                            started = True
+                            deltas += 1
+                            yield event.choices[0].delta.content
+                finally:
+                    # One streamed delta is roughly one completion token.
+                    trace.count("llm_stream_deltas_total", deltas)
+                return
+            except Exception as e:
+                if not isinstance(e, _retryable()) or started or attempt >= max_retries:
+                    raise
+                trace.count("llm_retries_total")
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+                attempt += 1
+
+async def _achat(system: str, user: str) -> str:
+    return "".join([tok async for tok in _astream_chat(system, user)])
+
+def stream_chat(system: str, user: str) -> Iterator[str]:
+    """Sync iterator over _astream_chat, fed from the background loop."""
+    q: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for tok in _astream_chat(system, user):
+                q.put(tok)
+        except Exception as e:
+            q.put(e)
+        finally:
+            q.put(_END)
+
+    fut = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    start, t0 = time.time(), time.perf_counter()
+    first_ms = None
+    done = False
+    try:
+        while True:
+            item = q.get()
+            if item is _END:
+                done = True
+                return
+            if isinstance(item, Exception):
+                raise item
+            if first_ms is None:
+                first_ms = (time.perf_counter() - t0) * 1000.0
+            yield item
+    finally:
+        fut.cancel()  # consumer stopped early (e.g. a Streamlit rerun)
+        trace.record("llm.stream", start, (time.perf_counter() - t0) * 1000.0,
+                     first_token_ms=first_ms, prompt_chars=len(system) + len(user), completed=done)
+
+def _chat(system: str, user: str) -> str:
+    with trace.span("llm.chat", prompt_chars=len(system) + len(user)):
+        return asyncio.run_coroutine_threadsafe(_achat(system, user), _get_loop()).result()
+
+def _answer_prompt(question: str, docs: List[Dict[str, Any]]) -> str:
+    return f"QUESTION:\n{question}\n\nCONTEXT:\n{format_context(docs)}"
+
+def _topic_prompt(topic: str, docs: List[Dict[str, Any]]) -> str:
+    return f"TOPIC: {topic}\n\nCONTEXT:\n{format_context(docs)}"
+
+def _cache_key(kind: str, query: str, docs: List[Dict[str, Any]], use_cache: bool):
+    cache = get_answer_cache() if use_cache else None
+    ids = [d.get("id") for d in docs]
+    if cache is None or not ids or None in ids:
+        return None, None
+    from .embed import Embedder
+    vec = Embedder().embed_query(query)  # usually an LRU hit left by retrieval
+    kind = f"{kind}:{os.getenv('ACADEMYRAG_LLM_MODEL', 'gpt-4o-mini')}"
+    return cache, (kind, query, ids, vec)
+
+def _cached(kind: str, query: str, docs: List[Dict[str, Any]], use_cache: bool,
+            produce: Callable[[List[Dict[str, Any]]], Dict[str, Any]],
+            keep: Callable[[Dict[str, Any]], bool] = lambda r: True):
+    # Keyed on the retrieved chunks, so a hit skips packing as well.
+    with trace.span("generate", kind=kind) as sp:
+        cache, key = _cache_key(kind, query, docs, use_cache)
+        if cache is not None:
+            hit = cache.lookup(*key)
+            sp.set(cache_hit=hit is not None)
+            if hit is not None:
+                return hit
+        t0 = time.perf_counter()
+        res = produce(pack_context(query, docs))
+        if cache is not None and keep(res):
+            cache.put(*key, res, (time.perf_counter() - t0) * 1000.0)
+        return res
+
+def _cached_stream(kind: str, query: str, docs: List[Dict[str, Any]], use_cache: bool,
+                   system: str, prompt: Callable[[str, List[Dict[str, Any]]], str]):
+    cache, key = _cache_key(kind, query, docs, use_cache)
+    if cache is not None:
+        hit = cache.lookup(*key)
+        if hit is not None:
+            return {"stream": iter([hit["text"]]), "citations": hit["citations"], "cached": True}
+    ctx = pack_context(query, docs)
+    cits = _citations(ctx)
+
+    def tokens():
+        t0 = time.perf_counter()
+        parts = []
+        for tok in stream_chat(system, prompt(query, ctx)):
+            parts.append(tok)
+            yield tok
+        # Only reached when the stream ran to completion.
+        if cache is not None:
+            cache.put(*key, {"text": "".join(parts), "citations": cits}, (time.perf_counter() - t0) * 1000.0)
+
+    return {"stream": tokens(), "citations": cits}
+
+def generate_answer(question: str, docs: List[Dict[str, Any]], use_cache: bool = True):
+    return _cached("answer", question, docs, use_cache, lambda ctx: {
+        "text": _chat(ANSWER_SYSTEM, _answer_prompt(question, ctx)), "citations": _citations(ctx)})
+
+def stream_answer(question: str, docs: List[Dict[str, Any]], use_cache: bool = True):
+    """Like generate_answer, but "stream" yields the text as it is generated."""
+    return _cached_stream("answer", question, docs, use_cache, ANSWER_SYSTEM, _answer_prompt)
+
+def generate_summary(topic: str, docs: List[Dict[str, Any]], use_cache: bool = True):
+    return _cached("summary", topic, docs, use_cache, lambda ctx: {
+        "text": _chat(SUMMARY_SYSTEM, _topic_prompt(topic, ctx)), "citations": _citations(ctx)})
+
+def stream_summary(topic: str, docs: List[Dict[str, Any]], use_cache: bool = True):
+    return _cached_stream("summary", topic, docs, use_cache, SUMMARY_SYSTEM, _topic_prompt)
+
+def _quiz(topic: str, docs: List[Dict[str, Any]]):
+    text = _chat(QUIZ_SYSTEM, _topic_prompt(topic, docs))
     # Expecting JSON-like but model returns text; attempt to parse simply
     import json, re
     try:
@@ -73,3 +257,8 @@ def generate_quiz(topic: str, docs: List[Dict[str, Any]]):
     except Exception:
         # Fallback: return raw text packaged
         return {"raw": text, "questions": []}
+
+def generate_quiz(topic: str, docs: List[Dict[str, Any]], use_cache: bool = True):
+    # Unparsed output isn't worth replaying.
+    return _cached("quiz", topic, docs, use_cache, lambda ctx: _quiz(topic, ctx),
+                   keep=lambda r: "raw" not in r)
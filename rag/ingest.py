@@ -1,28 +1,40 @@
 import os
+import time
+import queue
 import argparse
-from typing import Dict, Any, List
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait, as_completed
+from typing import Dict, Any, List, Tuple, Optional, Iterator, Callable
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from .chunk import chunk_text
+from . import trace
+from .chunk import chunk_text, chunk_spans
 from .embed import Embedder
 from .store import get_store
+from .lexical import get_lexical_index
+from .answer_cache import get_answer_cache
+from .catalog import load_catalog
+from . import dedup as dedup_mod
+from .manifest import load_manifest, load_checkpoint, file_sha256, chunk_id
 
-def _read_text_from_file(path: str) -> List[Dict[str, Any]]:
+def _iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield one record per page/slide (or per file for MD/TXT) without holding the whole file."""
     ext = os.path.splitext(path)[1].lower()
-    records = []
     if ext in [".md", ".txt"]:
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
             txt = f.read()
-        records.append({"text": txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path}})
+        yield {"text": txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path}}
     elif ext == ".pdf":
         try:
             import fitz  # pymupdf
             doc = fitz.open(path)
             for i, page in enumerate(doc):
                 txt = page.get_text()
-                records.append({"text": txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path, "page": i+1}})
+                yield {"text": txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path, "page": i+1}}
         except Exception as e:
             print(f"[WARN] PDF read failed for {path}: {e}")
     elif ext == ".pptx":
@@ -35,58 +47,498 @@ def _read_text_from_file(path: str) -> List[Dict[str, Any]]:
                     if hasattr(shape, "text"):
                         txt.append(shape.text)
                 slide_txt = "\n".join(txt)
-                records.append({"text": slide_txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path, "page": i+1, "slide_title": f"Slide {i+1}"}})
+                yield {"text": slide_txt, "metadata": {"doc_title": os.path.basename(path), "source_path": path, "page": i+1, "slide_title": f"Slide {i+1}"}}
         except Exception as e:
             print(f"[WARN] PPTX read failed for {path}: {e}")
     else:
         print(f"[SKIP] Unsupported file type: {path}")
-    return records
 
-def ingest_path(path: str, chunk_size: int = 900, chunk_overlap: int = 120):
+def _read_text_from_file(path: str) -> List[Dict[str, Any]]:
+    with trace.span("read", path=path) as sp:
+        recs = list(_iter_records(path))
+        sp.set(records=len(recs))
+    return recs
+
+def _chunk_record(rec: Dict[str, Any], chunking: list) -> List[Tuple[str, Dict[str, Any]]]:
+    chunker, chunk_size, chunk_overlap = chunking
+    text, meta = rec["text"], rec["metadata"]
+    with trace.span("chunk", chunker=chunker, chars=len(text)) as sp:
+        if chunker == "words":
+            out = [(ch, meta) for ch in chunk_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)]
+        else:
+            # Keep the span so the UI can highlight the chunk in its page/file.
+            out = [(text[start:end], {**meta, "char_start": start, "char_end": end})
+                   for start, end in chunk_spans(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)]
+        sp.set(chunks=len(out))
+    trace.count("chunks_total", len(out), chunker=chunker)
+    return out
+
+def _iter_file_chunks(fpath: str, chunking: list) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """Parse and chunk one file lazily into (chunk id, text, metadata) triples."""
+    seen = Counter()
+    for rec in _iter_records(fpath):
+        page = rec["metadata"].get("page")
+        for ch, meta in _chunk_record(rec, chunking):
+            # Offsets stay out of the id, so an edit above a chunk doesn't re-embed it; the
+            # manifest keeps them and ingest refreshes the metadata of chunks that moved.
+            cid = chunk_id(fpath, page, ch)
+            occ = seen[cid]
+            seen[cid] += 1
+            yield (chunk_id(fpath, page, ch, occ) if occ else cid), ch, meta
+
+def _file_chunks(fpath: str, chunking: list) -> List[Tuple[str, str, Dict[str, Any]]]:
+    return list(_iter_file_chunks(fpath, chunking))
+
+def _parse_worker(fpath: str, chunking: list):
+    t0 = time.perf_counter()
+    chunks = _file_chunks(fpath, chunking)
+    return chunks, time.perf_counter() - t0
+
+# ---- pipeline ---------------------------------------------------------------
+#
+#   scan (main) -> parse (process pool) -> embed_q -> embed (thread)
+#               -> write_q -> write (thread: store + manifest)
+#
+# Each file is followed in embed_q by an "end" marker carrying its manifest
+# entry and stale chunk ids. The marker rides in the batch that follows the
+# file's last chunk, so the writer records a file only after all of its
+# chunks are committed. Committed batches are checkpointed when the BM25
+# index next flushes a segment, so the checkpoint never covers chunks the
+# BM25 index would lose in a crash. Near-duplicate chunks (rag/dedup.py) travel as
+# "alias" items: they skip the model and are recorded by the writer with
+# their batch. Unchanged chunks whose offsets moved travel as "moved" items;
+# the writer rewrites their metadata around the stored vectors.
+
+_DONE = object()
+
+class _StageStats:
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.dim = 0
+
+    def line(self, name: str) -> str:
+        rate = self.items / self.busy if self.busy > 0 else 0.0
+        return f"[STATS] {name:<5} {self.items} {self.unit}, busy {self.busy:0.2f}s ({rate:0.1f} {self.unit}/s)"
+
+def _walk(path: str) -> List[str]:
+    return [os.path.normpath(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files]
+
+def _scan(fpaths: List[str], manifest, chunking: list, seen: set, counts: Counter):
+    """
+    Yield (fpath, stat, sha256, entry, reparse) for files whose manifest entry
+    needs updating; reparse is False when only the stat changed.
+    """
+    for fpath in fpaths:
+        if not os.path.isfile(fpath):
+            continue  # a listed file that has since been deleted
+        seen.add(fpath)
+        st = os.stat(fpath)
+        entry = manifest.get(fpath)
+        if entry and entry.get("chunking") != chunking:
+            entry = {**entry, "sha256": None}  # re-chunk with the new settings
+        elif entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            counts["unchanged"] += 1
+            continue
+        sha = file_sha256(fpath)
+        if entry and entry["sha256"] == sha:
+            # Touched but not modified: refresh stat so the next run skips it cheaply.
+            counts["unchanged"] += 1
+            yield fpath, st, sha, entry, False
+            continue
+        counts["changed"] += 1
+        yield fpath, st, sha, entry, True
+
+def _start_pool(workers: int) -> ProcessPoolExecutor:
+    # Fork the workers up front, before the embed/write threads exist; where
+    # fork isn't available fall back to the platform default (spawn).
+    # Workers don't trace; the parent records each file's parse time instead.
+    ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=trace.disable)
+    pool.submit(int).result()
+    return pool
+
+def _timed(it, stat: _StageStats, path: str):
+    """Iterate lazily, charging the time spent producing items to stat."""
+    start, busy = time.time(), 0.0
+    t0 = time.perf_counter()
+    for x in it:
+        busy += time.perf_counter() - t0
+        yield x
+        t0 = time.perf_counter()
+    busy += time.perf_counter() - t0
+    stat.busy += busy
+    stat.items += 1
+    trace.record("parse", start, busy * 1000.0, path=path)
+
+def _parse_all(jobs, pool: Optional[ProcessPoolExecutor], chunking: list, max_inflight: int,
+               stat: _StageStats):
+    """
+    Run the parse stage, yielding (job, chunks) as files finish. Without a
+    pool, chunks is a generator so pages are read only as the embed queue
+    drains.
+    """
+    def done(job, res):
+        chunks, secs = res
+        stat.items += 1
+        stat.busy += secs
+        trace.record("parse", time.time() - secs, secs * 1000.0, path=job[0], chunks=len(chunks))
+        return job, chunks
+
+    if pool is None:
+        for job in jobs:
+            yield job, (_timed(_iter_file_chunks(job[0], chunking), stat, job[0]) if job[4] else [])
+        return
+    inflight = {}
+    for job in jobs:
+        if not job[4]:
+            yield job, []
+            continue
+        inflight[pool.submit(_parse_worker, job[0], chunking)] = job
+        if len(inflight) >= max_inflight:
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                yield done(inflight.pop(fut), fut.result())
+    for fut in as_completed(list(inflight)):
+        yield done(inflight.pop(fut), fut.result())
+
+def _embed_stage(embedder: Embedder, inq: queue.Queue, outq: queue.Queue, batch_size: int,
+                 stat: _StageStats, errors: List[BaseException]):
+    pending, ends, aliases, moved = [], [], [], []
+
+    def flush():
+        if errors:
+            pending.clear()
+            ends.clear()
+            aliases.clear()
+            moved.clear()
+            return
+        if pending:
+            t0 = time.perf_counter()
+            try:
+                embs = embedder.embed([ch for _, ch, _ in pending])
+            except Exception as e:
+                errors.append(e)
+                return flush()
+            stat.busy += time.perf_counter() - t0
+            stat.items += len(pending)
+            stat.dim = embs.shape[1]
+        else:
+            embs = []
+        outq.put((list(pending), embs, list(ends), list(aliases), list(moved)))
+        pending.clear()
+        ends.clear()
+        aliases.clear()
+        moved.clear()
+
+    while True:
+        item = inq.get()
+        if item is _DONE:
+            flush()
+            outq.put(_DONE)
+            return
+        if item[0] == "chunk":
+            pending.append(item[1])
+            if len(pending) >= batch_size:
+                flush()
+        elif item[0] == "alias":
+            aliases.append(item[1])
+        elif item[0] == "moved":
+            moved.append(item[1])
+        else:
+            ends.append(item[1])
+
+def _refresh_offsets(store, dedup, moved: List[Tuple[str, str, Dict[str, Any]]]):
+    """Store the new metadata of kept chunks, re-upserting their stored vectors."""
+    metas = {cid: meta for cid, _, meta in moved}
+    got = store.get(ids=list(metas), include=["documents", "embeddings"])
+    ids = got.get("ids") or []
+    if ids:
+        store.upsert(ids=ids, documents=got["documents"], metadatas=[metas[cid] for cid in ids],
+                     embeddings=got["embeddings"])
+    if dedup is not None:
+        # The rest are aliases, which have no vectors of their own.
+        found = set(ids)
+        dedup.update_metadata([(cid, meta) for cid, meta in metas.items() if cid not in found])
+
+def _write_stage(store, lexical, manifest, catalog, dedup, ckpt, inq: queue.Queue, stat: _StageStats,
+                 errors: List[BaseException], on_write: Callable[[int], None]):
+    held = []  # (committed, files) per batch written since the last BM25 flush
+
+    def flush():
+        with trace.span("lexical.save", batches=len(held)):
+            lexical.save()
+        for committed, files in held:
+            ckpt.record(committed, files)
+        held.clear()
+
+    while True:
+        item = inq.get()
+        if item is _DONE:
+            if not errors:
+                try:
+                    flush()
+                except Exception as e:
+                    errors.append(e)
+            return
+        if errors:
+            continue  # drain so upstream stages never block
+        chunks, embs, ends, aliases, moved = item
+        t0 = time.perf_counter()
+        trace.count("write_batches_total")
+        trace.count("write_chunks_total", len(chunks))
+        try:
+            stale = [cid for _, _, ids in ends for cid in ids]
+            if chunks:
+                with trace.span("store.upsert", chunks=len(chunks)):
+                    store.upsert(
+                        ids=[cid for cid, _, _ in chunks],
+                        documents=[ch for _, ch, _ in chunks],
+                        metadatas=[meta for _, _, meta in chunks],
+                        embeddings=embs,
+                    )
+                with trace.span("lexical.add", chunks=len(chunks)):
+                    lexical.add([cid for cid, _, _ in chunks], [ch for _, ch, _ in chunks])
+                catalog.note_chunks(chunks)
+            if moved:
+                with trace.span("store.refresh", chunks=len(moved)):
+                    _refresh_offsets(store, dedup, moved)
+            # After the upserts: an alias promoted earlier in this batch may belong to a file now rewritten.
+            if stale:
+                with trace.span("store.delete", ids=len(stale)):
+                    store.delete(ids=stale)
+                lexical.delete(stale)
+            if aliases:
+                catalog.note_chunks([(cid, ch, meta) for cid, ch, meta, _ in aliases])
+            if dedup is not None:
+                dedup.commit(chunks, aliases, stale)
+            answers = get_answer_cache()
+            if answers is not None:
+                # Cached answers quoting a removed or rewritten chunk are stale.
+                answers.invalidate(stale + [cid for cid, _, _ in chunks])
+            committed: Dict[str, List[str]] = {}
+            for cid, _, meta in chunks + [a[:3] for a in aliases]:
+                committed.setdefault(meta["source_path"], []).append(cid)
+            files = {}
+            for fpath, entry, _ in ends:
+                if entry is None:
+                    manifest.remove(fpath)
+                    catalog.remove(fpath)
+                else:
+                    manifest.set(fpath, **entry)
+                    entry = manifest.get(fpath)
+                    catalog.set_file(fpath, entry["chunk_ids"], store)
+                files[fpath] = entry
+            held.append((committed, files))
+            if lexical.flush_due():
+                flush()
+        except Exception as e:
+            errors.append(e)
+            continue
+        stat.busy += time.perf_counter() - t0
+        stat.items += len(chunks)
+        on_write(len(chunks))
+
+def ingest_path(path: str, chunk_size: int = 900, chunk_overlap: int = 120,
+                workers: Optional[int] = None, queue_depth: int = 8, batch_size: int = 64,
+                chunker: Optional[str] = None, files: Optional[List[str]] = None,
+                progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """
+    Incrementally ingest a folder. Parsing/chunking runs on a process pool of
+    `workers` (default: ACADEMYRAG_INGEST_WORKERS or CPU count), overlapped
+    with batched embedding and store writes; `queue_depth` bounds how many
+    batches may wait between stages.
+
+    With workers=1 files are streamed page by page through the pipeline, so
+    peak memory is bounded by batch_size * queue_depth chunks rather than by
+    file or corpus size. Committed batches are checkpointed whenever the BM25
+    index flushes (ACADEMYRAG_BM25_FLUSH_DOCS / ACADEMYRAG_BM25_FLUSH_SECS);
+    an interrupted run picks up after the last checkpointed batch.
+
+    chunker is "tokens" (default, ACADEMYRAG_CHUNKER; sizes in tokenizer
+    tokens, sentence-aligned) or "words" (the original whitespace chunker).
+
+    New chunks that near-duplicate an indexed one (ACADEMYRAG_DEDUP, on by
+    default) are stored as aliases of it instead of being embedded.
+
+    `files` limits the run to those files (e.g. fresh uploads) instead of
+    walking the folder; other files under it are neither scanned nor
+    purged. `progress` is called from the pipeline threads with a dict of
+    files_total, files_done, chunks_queued, chunks_written and elapsed_s.
+    """
     store = get_store()
     embedder = Embedder()
-    to_upsert = {"ids": [], "documents": [], "embeddings": [], "metadatas": []}
-    did = 0
-
-    for root, _, files in os.walk(path):
-        for name in files:
-            fpath = os.path.join(root, name)
-            recs = _read_text_from_file(fpath)
-            for rec in recs:
-                for ch_i, ch in enumerate(chunk_text(rec["text"], chunk_size=chunk_size, chunk_overlap=chunk_overlap)):
-                    _id = f"{name}_{did}_{ch_i}"
-                    did += 1
-                    to_upsert["ids"].append(_id)
-                    to_upsert["documents"].append(ch)
-                    to_upsert["metadatas"].append(rec["metadata"])
-
-    if not to_upsert["documents"]:
-        print("[INFO] No documents to embed.")
-        return
+    manifest = load_manifest()
+    catalog = load_catalog()
+    ckpt = load_checkpoint()
+    if not catalog.exists and manifest.files:
+        catalog.rebuild(store)  # index built before the catalog existed
+    dedup = dedup_mod.load_dedup() if dedup_mod.enabled() else None
+    orphans = []
+    if dedup is not None:
+        orphans = dedup.load()
+        if not dedup.exists and manifest.files:
+            print(f"[INFO] Signed {dedup.rebuild(store)} existing chunks for near-duplicate detection.")
+    if ckpt.batches:
+        print(f"[INFO] Resuming interrupted ingest after {ckpt.batches} committed batches.")
+        ckpt.apply(manifest)
+        for fpath, entry in ckpt.files.items():
+            if entry is None:
+                catalog.remove(fpath)
+            else:
+                catalog.set_file(fpath, entry["chunk_ids"], store)
+    chunking = [chunker or os.getenv("ACADEMYRAG_CHUNKER", "tokens"), chunk_size, chunk_overlap]
+    if workers is None:
+        workers = int(os.getenv("ACADEMYRAG_INGEST_WORKERS", "0")) or os.cpu_count() or 1
 
-    # Batch embed to avoid token/time limits
-    batch = 64
-    embeddings = []
-    docs = to_upsert["documents"]
-    for i in range(0, len(docs), batch):
-        chunk = docs[i:i+batch]
-        embs = embedder.embed(chunk)
-        embeddings.extend(embs)
-    to_upsert["embeddings"] = embeddings
-
-    store.add(
-        ids=to_upsert["ids"],
-        documents=to_upsert["documents"],
-        metadatas=to_upsert["metadatas"],
-        embeddings=to_upsert["embeddings"],
-    )
-    print(f"[OK] Ingested {len(to_upsert['documents'])} chunks.")
-    return len(to_upsert["documents"])
+    stats = {"parse": _StageStats("files"), "embed": _StageStats("chunks"), "write": _StageStats("chunks")}
+    counts = Counter()
+    errors: List[BaseException] = []
+    embed_q: queue.Queue = queue.Queue(maxsize=queue_depth * batch_size)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_depth)
+    fpaths = [os.path.normpath(f) for f in files] if files is not None else _walk(path)
+    prog = {"files_total": len(fpaths), "files_done": 0, "chunks_queued": 0, "chunks_written": 0,
+            "elapsed_s": 0.0}
 
-if __name__ == "__main__":
+    def report():
+        if progress is not None:
+            prog["elapsed_s"] = time.perf_counter() - t0
+            progress(dict(prog))
+
+    def on_write(n: int):
+        prog["chunks_written"] += n  # only the write thread updates this key
+        report()
+
+    cs0 = embedder.cache_stats()
+    t0 = time.perf_counter()
+    seen_files = set()
+    with trace.span("ingest", path=path, workers=workers) as root:
+        # The stage threads report their spans under this ingest's trace.
+        embed_t = threading.Thread(target=trace.bind(_embed_stage), daemon=True,
+                                   args=(embedder, embed_q, write_q, batch_size, stats["embed"], errors))
+        write_t = threading.Thread(target=trace.bind(_write_stage), daemon=True,
+                                   args=(store, get_lexical_index(), manifest, catalog, dedup, ckpt, write_q,
+                                         stats["write"], errors, on_write))
+        pool = _start_pool(workers) if workers > 1 else None
+        embed_t.start()
+        write_t.start()
+
+        def enqueue(c, exclude=()):
+            canonical = dedup.assign(*c, exclude=exclude) if dedup is not None else None
+            if canonical is None:
+                embed_q.put(("chunk", c))
+                counts["chunks"] += 1
+            else:
+                embed_q.put(("alias", (*c, canonical)))
+                counts["aliases"] += 1
+                counts["alias_bytes"] += len(c[1].encode("utf-8"))
+
+        def forget(stale):
+            # Aliases of a deleted chunk are deduplicated again (one of them gets embedded).
+            if dedup is not None:
+                for c in dedup.drop(stale):
+                    enqueue(c)
+
+        try:
+            for c in orphans:
+                enqueue(c)
+            jobs = _scan(fpaths, manifest, chunking, seen_files, counts)
+            parsed = _parse_all(jobs, pool, chunking, workers + queue_depth, stats["parse"])
+            for (fpath, st, sha, entry, reparse), chunks in parsed:
+                if errors:
+                    break
+                old_ids = set(entry["chunk_ids"]) if entry else set()
+                old_spans = dict(zip(entry["chunk_ids"], entry.get("offsets") or ())) if entry else {}
+                # Chunks committed by an interrupted run are already in the store.
+                done_ids = ckpt.committed.get(fpath, set())
+                new_ids = [] if reparse else entry["chunk_ids"]
+                spans = [] if reparse else entry.get("offsets")
+                # Old chunks not seen again yet will be deleted with the file's end marker, so an
+                # edited chunk must not become an alias of its own predecessor.
+                unseen = set(old_ids)
+                for c in chunks:
+                    new_ids.append(c[0])
+                    unseen.discard(c[0])
+                    span = [c[2]["char_start"], c[2]["char_end"]] if "char_start" in c[2] else None
+                    if span is not None:
+                        spans.append(span)
+                    if c[0] not in old_ids and c[0] not in done_ids:  # identical chunks are already indexed
+                        enqueue(c, unseen)
+                    elif span is not None and c[0] in old_ids and old_spans.get(c[0]) != span:
+                        embed_q.put(("moved", c))
+                info = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha,
+                        "chunking": chunking, "chunk_ids": new_ids, "offsets": spans or None}
+                stale = list(old_ids - set(new_ids))
+                embed_q.put(("end", (fpath, info, stale)))
+                forget(stale)
+                prog["files_done"] = len(seen_files)
+                prog["chunks_queued"] = counts["chunks"]
+                report()
+
+            if not errors:
+                # Files that vanished since the last run: purge their chunks.
+                if files is None:
+                    removed = [p for p in manifest.under(path) if p not in seen_files]
+                else:
+                    removed = [p for p in fpaths if p not in seen_files and manifest.get(p)]
+                for fpath in removed:
+                    embed_q.put(("end", (fpath, None, manifest.get(fpath)["chunk_ids"])))
+                    forget(manifest.get(fpath)["chunk_ids"])
+                counts["removed"] = len(removed)
+        finally:
+            embed_q.put(_DONE)
+            embed_t.join()
+            write_t.join()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        root.set(chunks=counts["chunks"], aliases=counts["aliases"], changed=counts["changed"],
+                 removed=counts["removed"])
+    prog["files_done"] = prog["files_total"]
+    report()
+    if errors:
+        raise errors[0]
+
+    manifest.save()
+    catalog.save()
+    ckpt.clear()
+    wall = time.perf_counter() - t0
+    print(f"[INFO] {counts['changed']} changed, {counts['unchanged']} unchanged, {counts['removed']} removed files.")
+    if counts["chunks"]:
+        print(f"[OK] Ingested {counts['chunks']} chunks.")
+    else:
+        print("[INFO] No documents to embed.")
+    for name, stat in stats.items():
+        print(stat.line(name))
+    if counts["aliases"]:
+        vec_bytes = counts["aliases"] * stats["embed"].dim * 4  # float32
+        print(f"[STATS] dedup {counts['aliases']} near-duplicate chunks aliased "
+              f"({counts['aliases'] / (counts['aliases'] + counts['chunks']):.1%}): "
+              f"saved {counts['aliases']} embeddings, ~{(vec_bytes + counts['alias_bytes']) / 1e6:0.2f} MB "
+              f"of vectors and text")
+    print(f"[STATS] total {wall:0.2f}s wall, {workers} parse workers "
+          f"({counts['chunks'] / wall if wall > 0 else 0.0:0.1f} chunks/s)")
+    cs = embedder.cache_stats()
+    if cs:
+        print(f"[INFO] Embedding cache: {cs['hits'] - cs0['hits']} hits, "
+              f"{cs['misses'] - cs0['misses']} misses.")
+    return counts["chunks"]
+
+def main(argv: Optional[List[str]] = None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--path", type=str, required=True, help="Folder containing PDFs/PPTX/MD/TXT")
     ap.add_argument("--chunk_size", type=int, default=900)
     ap.add_argument("--chunk_overlap", type=int, default=120)
-    args = ap.parse_args()
-    ingest_path(args.path, args.chunk_size, args.chunk_overlap)
+    ap.add_argument("--chunker", choices=["tokens", "words"], default=None,
+                    help="Token/sentence-aware (default) or legacy whitespace chunking")
+    ap.add_argument("--workers", type=int, default=None, help="Parse processes (default: CPU count)")
+    ap.add_argument("--queue_depth", type=int, default=8, help="Batches buffered between stages")
+    ap.add_argument("--batch_size", type=int, default=64, help="Chunks per embed/write batch")
+    ap.add_argument("--stream", action="store_true",
+                    help="Parse inline page by page (same as --workers 1); memory bounded by batch size")
+    args = ap.parse_args(argv)
+    ingest_path(args.path, args.chunk_size, args.chunk_overlap, chunker=args.chunker,
+                workers=1 if args.stream else args.workers, queue_depth=args.queue_depth, batch_size=args.batch_size)
+
+if __name__ == "__main__":
+    main()
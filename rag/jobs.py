@@ -0,0 +1,132 @@
+"""
+Background ingest jobs for long-running processes (the Streamlit app).
+
+IngestJobs runs submitted ingest_path() calls one at a time on a daemon
+thread, so sessions keep querying the existing index while new documents
+are parsed, embedded and written; the store, BM25 index and catalog take
+their own locks. Each Job exposes live progress (files parsed, chunks
+embedded and written, elapsed time) and an ETA.
+
+Jobs run with one parse worker (page-by-page streaming): forking a process
+pool from a multi-threaded server is unsafe and would compete with queries
+for the CPU.
+
+    jobs = IngestJobs()
+    job = jobs.submit("data/raw", files=["data/raw/new.pdf"])
+    job.status, job.progress, job.eta_s()
+"""
+
+import time
+import queue
+import itertools
+import threading
+from typing import List, Dict, Any, Optional, Callable
+
+class Job:
+    def __init__(self, job_id: int, path: str, files: Optional[List[str]]):
+        self.id = job_id
+        self.path = path
+        self.files = files
+        self.status = "queued"  # -> running -> done | failed
+        self.error: Optional[str] = None
+        self.chunks = 0
+        self.progress: Dict[str, Any] = {"files_total": len(files) if files is not None else 0,
+                                         "files_done": 0, "chunks_queued": 0, "chunks_written": 0,
+                                         "elapsed_s": 0.0}
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def fraction(self) -> float:
+        """Share of the work done: files parsed, discounted by chunks still waiting to be written."""
+        p = self.progress
+        if self.status == "done":
+            return 1.0
+        if not p["files_total"]:
+            return 0.0
+        written = p["chunks_written"] / p["chunks_queued"] if p["chunks_queued"] else 1.0
+        return min(1.0, p["files_done"] / p["files_total"] * written)
+
+    def eta_s(self) -> Optional[float]:
+        done = self.fraction()
+        if self.status != "running" or done <= 0.0:
+            return None
+        return self.progress["elapsed_s"] * (1.0 - done) / done
+
+    def describe(self) -> str:
+        p = self.progress
+        if self.status == "failed":
+            return f"failed: {self.error}"
+        if self.status == "queued":
+            return "queued"
+        if self.status == "done":
+            return f"done: {self.chunks} new chunks in {self.finished - self.started:.1f}s"
+        text = (f"{p['files_done']}/{p['files_total']} files parsed, "
+                f"{p['chunks_written']}/{p['chunks_queued']} chunks embedded")
+        eta = self.eta_s()
+        return text + (f", ETA {eta:.0f}s" if eta is not None else "")
+
+class IngestJobs:
+    """A FIFO of ingest jobs drained by one worker thread."""
+
+    def __init__(self, chunk_size: int = 900, chunk_overlap: int = 120, keep: int = 20,
+                 runner: Optional[Callable[..., int]] = None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.keep = keep
+        # runner(path, files, progress) -> chunks; defaults to in-process ingest_path().
+        self._runner = runner or self._ingest
+        self._jobs: List[Job] = []
+        # Bumped after each successful job, so callers can tell their cached results are stale.
+        self.generation = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        threading.Thread(target=self._work, name="academyrag-ingest-jobs", daemon=True).start()
+
+    def _ingest(self, path: str, files: Optional[List[str]], progress) -> int:
+        from .ingest import ingest_path
+        return ingest_path(path, self.chunk_size, self.chunk_overlap, workers=1, files=files, progress=progress)
+
+    def submit(self, path: str, files: Optional[List[str]] = None) -> Job:
+        """Queue an ingest of `files` under path (or the whole folder)."""
+        with self._lock:
+            job = Job(next(self._ids), path, list(files) if files is not None else None)
+            self._jobs.append(job)
+            # Forget old finished jobs.
+            done = [j for j in self._jobs if not j.active]
+            for j in done[:max(0, len(done) - self.keep)]:
+                self._jobs.remove(j)
+        self._queue.put(job)
+        return job
+
+    def jobs(self) -> List[Job]:
+        """Most recent first."""
+        with self._lock:
+            return list(reversed(self._jobs))
+
+    def active(self) -> List[Job]:
+        return [j for j in self.jobs() if j.active]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started = time.time()
+            job.status = "running"
+
+            def progress(p: Dict[str, Any], job=job):
+                job.progress = p
+
+            try:
+                job.chunks = self._runner(job.path, job.files, progress)
+                job.status = "done"
+                self.generation += 1
+            except Exception as e:
+                job.error = repr(e)
+                job.status = "failed"
+                print(f"[WARN] Ingest job {job.id} failed: {e!r}")
+            job.finished = time.time()
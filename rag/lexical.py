@@ -0,0 +1,340 @@
+"""
+Persisted BM25 inverted index for exact-term retrieval (acronyms, course
+codes, part numbers) alongside the dense Chroma collection.
+
+Layout under {ACADEMYRAG_DB_DIR}/bm25/:
+
+- ids.txt             chunk id per document number (append-only)
+- doclen.i32          token count per document number (append-only)
+- deleted.npy         tombstoned document numbers
+- meta.json           segment list and corpus stats
+- seg_<n>.terms.json  term -> [offset, count] into the postings arrays
+- seg_<n>.docs.npy    int32 document numbers, grouped by term
+- seg_<n>.tf.npy      uint16 term frequencies, parallel to docs
+
+Postings arrays are memory-mapped. New chunks accumulate in memory and are
+flushed as a new segment on save(); small segments are merged so the count
+stays bounded. Re-adding an id tombstones its previous document. Ingest
+saves once ACADEMYRAG_BM25_FLUSH_DOCS chunks (default 4096) are pending or
+ACADEMYRAG_BM25_FLUSH_SECS seconds (default 60) have passed, and at the end.
+
+CLI:
+  python -m rag.lexical --rebuild       # rebuild from the vector store
+  python -m rag.lexical --query "ISO 9001"
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from array import array
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were with".split())
+
+K1 = 1.2
+B = 0.75
+MAX_SEGMENTS = 8
+FLUSH_DOCS = 4096
+FLUSH_SECS = 60.0
+MIN_IDF = float(np.log(2.0))  # df > N/2
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+class _Segment:
+    def __init__(self, base: str):
+        self.base = base
+        with open(base + ".terms.json", "r", encoding="utf-8") as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        self.docs = np.load(base + ".docs.npy", mmap_mode="r")
+        self.tf = np.load(base + ".tf.npy", mmap_mode="r")
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        loc = self.terms.get(term)
+        if loc is None:
+            return None
+        off, cnt = loc
+        return self.docs[off:off + cnt], self.tf[off:off + cnt]
+
+    def remove_files(self):
+        for ext in (".terms.json", ".docs.npy", ".tf.npy"):
+            if os.path.exists(self.base + ext):
+                os.remove(self.base + ext)
+
+def _write_segment(base: str, postings: Dict[str, List[Tuple[int, int]]]):
+    terms = {}
+    docs, tfs = [], []
+    off = 0
+    for term in sorted(postings):
+        plist = sorted(postings[term])
+        terms[term] = [off, len(plist)]
+        docs.extend(d for d, _ in plist)
+        tfs.extend(min(tf, 65535) for _, tf in plist)
+        off += len(plist)
+    np.save(base + ".docs.npy", np.asarray(docs, dtype=np.int32))
+    np.save(base + ".tf.npy", np.asarray(tfs, dtype=np.uint16))
+    with open(base + ".terms.json", "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+
+class BM25Index:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._meta = {"segments": [], "next_segment": 0, "total_len": 0, "live": 0}
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+        self._ids: List[str] = []
+        ids_path = os.path.join(path, "ids.txt")
+        if os.path.exists(ids_path):
+            with open(ids_path, "r", encoding="utf-8") as f:
+                self._ids = f.read().splitlines()
+        # Growable doc tables; numpy views are taken only for the duration of a call.
+        self._doclen = array("i")
+        len_path = os.path.join(path, "doclen.i32")
+        if os.path.exists(len_path):
+            with open(len_path, "rb") as f:
+                self._doclen.frombytes(f.read())
+        # A crash between appends can leave the two doc tables out of step.
+        n = min(len(self._ids), len(self._doclen))
+        del self._ids[n:], self._doclen[n:]
+        self._flushed = n
+        self._dead = bytearray(n)
+        dead_path = os.path.join(path, "deleted.npy")
+        if os.path.exists(dead_path):
+            for num in np.load(dead_path).tolist():
+                if num < n:
+                    self._dead[num] = 1
+        self._num: Dict[str, int] = {cid: i for i, cid in enumerate(self._ids) if not self._dead[i]}
+        self._segments = [_Segment(os.path.join(path, s)) for s in self._meta["segments"]]
+        self._delta: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._norm = None
+        self._norm_key = None
+
+    def __len__(self) -> int:
+        return len(self._num)
+
+    # ---- updates ----------------------------------------------------------
+
+    def _tombstone(self, num: int):
+        self._dead[num] = 1
+        self._meta["total_len"] -= self._doclen[num]
+        self._meta["live"] -= 1
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        with self._lock:
+            for cid, text in zip(ids, texts):
+                old = self._num.get(cid)
+                if old is not None:
+                    self._tombstone(old)
+                num = len(self._ids)
+                toks = tokenize(text)
+                self._ids.append(cid)
+                self._doclen.append(len(toks))
+                self._dead.append(0)
+                self._num[cid] = num
+                for term, tf in Counter(toks).items():
+                    self._delta[term].append((num, tf))
+                self._meta["total_len"] += len(toks)
+                self._meta["live"] += 1
+                self._dirty = True
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            for cid in ids:
+                num = self._num.pop(cid, None)
+                if num is not None:
+                    self._tombstone(num)
+                    self._dirty = True
+
+    def flush_due(self) -> bool:
+        """Whether enough chunks or time have piled up since the last save() to write a segment."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            docs = int(os.getenv("ACADEMYRAG_BM25_FLUSH_DOCS", str(FLUSH_DOCS)))
+            secs = float(os.getenv("ACADEMYRAG_BM25_FLUSH_SECS", str(FLUSH_SECS)))
+            return len(self._ids) - self._flushed >= docs or time.monotonic() - self._saved_at >= secs
+
+    def save(self):
+        with self._lock:
+            self._saved_at = time.monotonic()
+            if not self._dirty:
+                return
+            if self._delta:
+                name = f"seg_{self._meta['next_segment']:06d}"
+                self._meta["next_segment"] += 1
+                _write_segment(os.path.join(self.path, name), self._delta)
+                self._segments.append(_Segment(os.path.join(self.path, name)))
+                self._delta = defaultdict(list)
+            with open(os.path.join(self.path, "ids.txt"), "a", encoding="utf-8") as f:
+                for cid in self._ids[self._flushed:]:
+                    f.write(cid + "\n")
+            with open(os.path.join(self.path, "doclen.i32"), "ab") as f:
+                f.write(self._doclen[self._flushed:].tobytes())
+            self._flushed = len(self._ids)
+            dead = np.flatnonzero(np.frombuffer(self._dead, dtype=np.uint8)).astype(np.int32)
+            np.save(os.path.join(self.path, "deleted.npy"), dead)
+            if len(self._segments) > MAX_SEGMENTS:
+                self._merge_smallest()
+            self._write_meta()
+            self._dirty = False
+
+    def _write_meta(self):
+        self._meta["segments"] = [os.path.basename(s.base) for s in self._segments]
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def _merge_smallest(self):
+        # Merge the smaller half of the segments, dropping tombstoned docs.
+        by_size = sorted(self._segments, key=lambda s: len(s.docs))
+        victims = by_size[:len(by_size) // 2 + 1]
+        merged: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        dead = np.frombuffer(self._dead, dtype=bool)
+        for seg in victims:
+            for term, (off, cnt) in seg.terms.items():
+                docs = np.asarray(seg.docs[off:off + cnt])
+                tfs = np.asarray(seg.tf[off:off + cnt])
+                keep = ~dead[docs]
+                merged[term].extend(zip(docs[keep].tolist(), tfs[keep].tolist()))
+        name = f"seg_{self._meta['next_segment']:06d}"
+        self._meta["next_segment"] += 1
+        del dead
+        _write_segment(os.path.join(self.path, name), {t: p for t, p in merged.items() if p})
+        keep_segs = [s for s in self._segments if s not in victims]
+        self._segments = keep_segs + [_Segment(os.path.join(self.path, name))]
+        self._write_meta()
+        for seg in victims:
+            seg.remove_files()
+
+    # ---- search -----------------------------------------------------------
+
+    def _norms(self) -> np.ndarray:
+        # K1 * (1 - B + B * dl / avgdl) per document, cached until the corpus changes.
+        key = (len(self._doclen), self._meta["total_len"], self._meta["live"])
+        if self._norm_key != key:
+            avgdl = max(1.0, self._meta["total_len"] / max(1, self._meta["live"]))
+            dl = np.frombuffer(self._doclen, dtype=np.int32).astype(np.float32)
+            self._norm = K1 * (1 - B + B * dl / avgdl)
+            self._norm_key = key
+        return self._norm
+
+    def mask(self, ids: Iterable[str]) -> np.ndarray:
+        """Boolean mask over doc numbers for search(only=...)."""
+        with self._lock:
+            m = np.zeros(len(self._ids), dtype=bool)
+            nums = [self._num[cid] for cid in ids if cid in self._num]
+            m[nums] = True
+            return m
+
+    def search(self, query: str, k: int = 10, only: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Return up to k (chunk id, BM25 score) pairs, best first; `only` is a mask() to restrict to."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_live = max(1, self._meta["live"])
+            plans = []
+            for term in terms:
+                plists = [p for p in (s.postings(term) for s in self._segments) if p is not None]
+                if term in self._delta:
+                    d = np.asarray(self._delta[term], dtype=np.int64)
+                    plists.append((d[:, 0], d[:, 1]))
+                if plists:
+                    df = sum(len(p[0]) for p in plists)
+                    plans.append((np.log(1.0 + (n_live - df + 0.5) / (df + 0.5)), plists))
+            if not plans:
+                return []
+            # Terms in over half the corpus barely move the ranking but dominate
+            # the cost; drop them when the query has rarer terms.
+            if any(idf >= MIN_IDF for idf, _ in plans):
+                plans = [p for p in plans if p[0] >= MIN_IDF]
+
+            norm = self._norms()
+            acc = np.zeros(len(self._ids), dtype=np.float32)
+            for idf, plists in plans:
+                for docs, tf in plists:
+                    docs = np.asarray(docs)
+                    tf = np.asarray(tf, dtype=np.float32)
+                    # doc numbers are unique within a postings list, so += is safe
+                    acc[docs] += idf * tf * (K1 + 1) / (tf + norm[docs])
+            cand = np.flatnonzero(acc)
+            scores = acc[cand]
+            scores[np.frombuffer(self._dead, dtype=bool)[cand]] = 0.0
+            if only is not None:
+                # Docs added after the mask was taken are outside it.
+                scores[cand >= len(only)] = 0.0
+                inside = cand < len(only)
+                scores[inside] *= only[cand[inside]]
+            k = min(k, len(cand))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[cand[i]], float(scores[i])) for i in top if scores[i] > 0]
+
+_index = None
+
+def get_lexical_index() -> BM25Index:
+    global _index
+    if _index is None:
+        db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+        _index = BM25Index(os.path.join(db_dir, "bm25"))
+    return _index
+
+def rebuild_from_store(page: int = 1000) -> int:
+    """Drop the BM25 index and rebuild it from every chunk in the vector store."""
+    global _index
+    import shutil
+    from .store import get_store
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    shutil.rmtree(os.path.join(db_dir, "bm25"), ignore_errors=True)
+    _index = None
+    index = get_lexical_index()
+    store = get_store()
+    offset = 0
+    while True:
+        res = store.get(include=["documents"], limit=page, offset=offset)
+        if not res["ids"]:
+            break
+        index.add(res["ids"], res["documents"])
+        if index.flush_due():
+            index.save()
+        offset += len(res["ids"])
+    index.save()
+    return len(index)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Maintain or query the BM25 index.")
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild from the vector store")
+    ap.add_argument("--query", type=str, default=None)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    if args.rebuild:
+        print(f"[OK] Indexed {rebuild_from_store()} chunks.")
+    if args.query:
+        index = get_lexical_index()
+        t0 = time.perf_counter()
+        hits = index.search(args.query, k=args.k)
+        ms = (time.perf_counter() - t0) * 1000
+        for cid, score in hits:
+            print(f"{score:8.3f}  {cid}")
+        print(f"[INFO] {len(hits)} hits in {ms:0.2f} ms over {len(index)} chunks.")
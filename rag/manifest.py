@@ -0,0 +1,134 @@
+"""
+Ingest manifest: what was indexed from each source file.
+
+Stored as JSON next to the index ({ACADEMYRAG_DB_DIR}/manifest.json):
+{
+  "files": {
+    "data/raw/cost_drivers_101.md": {
+      "size": 1234, "mtime": 1718000000.0, "sha256": "...", "chunking": ["tokens", 900, 120],
+      "chunk_ids": ["cost_drivers_101.md_3f2a..."], "offsets": [[0, 3412]]
+    }
+  }
+}
+
+Chunk ids are derived from (source path, page, chunk text), so re-ingesting
+the same content always produces the same ids. Token chunks also record
+their [char_start, char_end] in "offsets" (parallel to chunk_ids), which
+shift without changing the id when text above them is edited.
+"""
+
+import os
+import json
+import hashlib
+from typing import Dict, Any, List, Optional
+
+def file_sha256(path: str, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(bufsize)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+def chunk_id(source_path: str, page: Optional[int], text: str, occurrence: int = 0) -> str:
+    """
+    Deterministic id for a chunk; occurrence disambiguates repeats within one
+    page.
+    """
+    h = hashlib.sha1()
+    h.update(f"{source_path}\0{page}\0{occurrence}\0".encode("utf-8"))
+    h.update(text.encode("utf-8"))
+    return f"{os.path.basename(source_path)}_{h.hexdigest()[:20]}"
+
+class Manifest:
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def get(self, fpath: str) -> Optional[Dict[str, Any]]:
+        return self.files.get(fpath)
+
+    def set(self, fpath: str, size: int, mtime: float, sha256: str,
+            chunking: List[Any], chunk_ids: List[str], offsets: Optional[List[List[int]]] = None):
+        self.files[fpath] = {"size": size, "mtime": mtime, "sha256": sha256,
+                             "chunking": list(chunking), "chunk_ids": list(chunk_ids)}
+        if offsets:
+            self.files[fpath]["offsets"] = [list(o) for o in offsets]
+
+    def remove(self, fpath: str) -> List[str]:
+        entry = self.files.pop(fpath, None)
+        return entry["chunk_ids"] if entry else []
+
+    def under(self, root: str) -> List[str]:
+        root = os.path.normpath(root)
+        return [p for p in list(self.files) if p == root or p.startswith(root + os.sep)]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp, self.path)
+
+class Checkpoint:
+    """
+    Append-only JSONL log of the batches an unfinished ingest run has
+    committed. Each line holds the chunk ids written per file and the
+    manifest entries of files that completed in that batch. Replaying it
+    lets an interrupted run resume after its last committed batch; it is
+    removed once the manifest itself is saved.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.batches = 0
+        self.files: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.committed: Dict[str, set] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # torn final line from a crash
+                    self._merge(rec)
+
+    def _merge(self, rec: Dict[str, Any]):
+        for fpath, ids in rec.get("committed", {}).items():
+            self.committed.setdefault(fpath, set()).update(ids)
+        self.files.update(rec.get("files", {}))
+        self.batches += 1
+
+    def record(self, committed: Dict[str, List[str]], files: Dict[str, Optional[Dict[str, Any]]]):
+        rec = {"committed": committed, "files": files}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec) + "\n")
+        self._merge(rec)
+
+    def apply(self, manifest: Manifest):
+        for fpath, entry in self.files.items():
+            if entry is None:
+                manifest.remove(fpath)
+            else:
+                manifest.files[fpath] = entry
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.batches = 0
+        self.files = {}
+        self.committed = {}
+
+def load_manifest() -> Manifest:
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    return Manifest(os.path.join(db_dir, "manifest.json"))
+
+def load_checkpoint() -> Checkpoint:
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    return Checkpoint(os.path.join(db_dir, "ingest.checkpoint.jsonl"))
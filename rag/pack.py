@@ -0,0 +1,207 @@
+"""
+Context packing between retrieval and generation.
+
+1. Diversify: order the retrieved chunks by maximal marginal relevance, so
+   near-duplicates fall behind other sources (ACADEMYRAG_MMR_LAMBDA, default
+   0.7; 1.0 keeps the retrieval order). Relevance is the reciprocal of each
+   chunk's retrieval rank, so the reranker's or RRF's order is what gets
+   diversified; the stored embeddings only measure redundancy.
+2. Merge: chunks of the same page/file whose char_start/char_end spans
+   overlap are joined into one block, so the chunk_overlap text is sent once.
+3. Budget: blocks are added in MMR order while the formatted context stays
+   within ACADEMYRAG_CONTEXT_TOKENS (default 3000) tiktoken tokens.
+
+The result is a list of blocks in the same shape as retrieved docs (id, text,
+metadata) plus "ids", the chunks each block covers. Prompt numbering and
+citations are both taken from this list, so [n] always points at the right
+block. Chunks from the legacy words chunker carry no offsets and are never
+merged. ACADEMYRAG_CONTEXT_PACK=0 passes docs through unchanged.
+
+CLI:
+  python -m rag.pack --query "what drives cost?" --k 12   # tokens before/after
+"""
+
+import os
+import time
+import argparse
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from . import trace
+
+_SEP = "\n\n"
+
+def format_block(i: int, d: Dict[str, Any]) -> str:
+    meta = d.get("metadata", {})
+    title = meta.get("doc_title", "Document")
+    page = meta.get("page")
+    slide = meta.get("slide_title")
+    loc = f"(p.{page})" if page is not None else ""
+    if slide:
+        loc = f"{loc} — {slide}" if loc else slide
+    return f"[{i}] {title} {loc}\n{d['text']}"
+
+def format_context(docs: List[Dict[str, Any]]) -> str:
+    return _SEP.join(format_block(i, d) for i, d in enumerate(docs, 1))
+
+def _count(text: str) -> int:
+    from .chunk import count_tokens
+    return count_tokens(text)
+
+def _embeddings(docs: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    ids = [d.get("id") for d in docs]
+    if None in ids:
+        return None
+    try:
+        from .store import get_store
+        res = get_store().get(ids=ids, include=["embeddings"])
+    except Exception:
+        return None
+    by_id = dict(zip(res.get("ids") or [], res.get("embeddings") if res.get("embeddings") is not None else []))
+    if any(cid not in by_id for cid in ids):
+        return None
+    X = np.asarray([by_id[cid] for cid in ids], dtype=np.float32)
+    return X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+
+def mmr_order(rel: np.ndarray, X: np.ndarray, lam: float = 0.7) -> List[int]:
+    """Indices of unit rows X in maximal-marginal-relevance order for relevance scores rel."""
+    sim = X @ X.T
+    order = [int(rel.argmax())]
+    best_sim = sim[order[0]].copy()
+    left = np.ones(len(X), dtype=bool)
+    left[order[0]] = False
+    while left.any():
+        score = np.where(left, lam * rel - (1.0 - lam) * best_sim, -np.inf)
+        i = int(score.argmax())
+        order.append(i)
+        left[i] = False
+        np.maximum(best_sim, sim[i], out=best_sim)
+    return order
+
+def _span_key(d: Dict[str, Any]):
+    meta = d.get("metadata", {})
+    if meta.get("char_start") is None or meta.get("char_end") is None:
+        return None
+    return meta.get("source_path"), meta.get("page")
+
+def _merge(block: Dict[str, Any], d: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """block and d joined into one block if their spans overlap or touch, else None."""
+    a, b = block["metadata"], d["metadata"]
+    if b["char_start"] > a["char_end"] or a["char_start"] > b["char_end"]:
+        return None
+    first, second = (block, d) if a["char_start"] <= b["char_start"] else (d, block)
+    fs, fe = first["metadata"]["char_start"], first["metadata"]["char_end"]
+    ss, se = second["metadata"]["char_start"], second["metadata"]["char_end"]
+    if se <= fe:
+        text = first["text"]  # second lies inside first
+    else:
+        text = first["text"] + second["text"][fe - ss:]
+    merged = {
+        "id": block["id"],
+        "ids": block["ids"] + d["ids"],
+        "text": text,
+        "metadata": {**block["metadata"], "char_start": fs, "char_end": max(fe, se)},
+    }
+    aliases = block.get("aliases", []) + d.get("aliases", [])
+    if aliases:
+        merged["aliases"] = aliases
+    return merged
+
+def _truncate(text: str, budget: int) -> str:
+    try:
+        from .chunk import _encoding, _tokenizer_name
+        enc = _encoding(_tokenizer_name())
+        return enc.decode(enc.encode_ordinary(text)[:max(budget, 0)])
+    except Exception:
+        return text[:max(budget, 0) * 4]
+
+def pack_context(query: str, docs: List[Dict[str, Any]], max_tokens: Optional[int] = None,
+                 lam: Optional[float] = None, stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Diversified, de-overlapped blocks from docs that fit in max_tokens."""
+    if not docs or os.getenv("ACADEMYRAG_CONTEXT_PACK", "1") == "0":
+        return docs
+    start, t0 = time.time(), time.perf_counter()
+    if max_tokens is None:
+        max_tokens = int(os.getenv("ACADEMYRAG_CONTEXT_TOKENS", "3000"))
+    if lam is None:
+        lam = float(os.getenv("ACADEMYRAG_MMR_LAMBDA", "0.7"))
+
+    order = list(range(len(docs)))
+    X = _embeddings(docs) if lam < 1.0 and len(docs) > 1 else None
+    if X is not None:
+        # docs arrive best first (reranked or fused).
+        order = mmr_order(1.0 / np.arange(1, len(docs) + 1, dtype=np.float32), X, lam)
+
+    counts: Dict[str, int] = {}
+
+    def cost(i: int, b: Dict[str, Any]) -> int:
+        text = format_block(i, b)
+        if text not in counts:
+            counts[text] = _count(text)
+        return counts[text]
+
+    blocks: List[Dict[str, Any]] = []
+    for i in order:
+        d = docs[i]
+        new = {"id": d.get("id"), "ids": [d.get("id")], "text": d["text"], "metadata": dict(d.get("metadata", {}))}
+        if d.get("aliases"):
+            new["aliases"] = list(d["aliases"])
+        cand = list(blocks)
+        key = _span_key(d)
+        if key is not None:
+            # Fold in every block it overlaps; a chunk can bridge two of them.
+            for b in blocks:
+                merged = _merge(b, new) if _span_key(b) == key else None
+                if merged is not None:
+                    cand.remove(b)
+                    new = merged
+        pos = min([blocks.index(b) for b in blocks if b not in cand], default=len(cand))
+        cand.insert(pos, new)
+        # Separators are about one token each; the exact check is below.
+        total = sum(cost(j, b) for j, b in enumerate(cand, 1)) + len(cand) - 1
+        if total <= max_tokens:
+            blocks = cand
+        elif not blocks:
+            # The best chunk alone is over budget: send as much of it as fits.
+            new["text"] = _truncate(new["text"], max_tokens - cost(1, {**new, "text": ""}))
+            if new["metadata"].get("char_start") is not None:
+                new["metadata"]["char_end"] = new["metadata"]["char_start"] + len(new["text"])
+            blocks = [new]
+        # Otherwise skip it; a shorter chunk further down may still fit.
+    total = _count(format_context(blocks))
+    while len(blocks) > 1 and total > max_tokens:
+        blocks = blocks[:-1]
+        total = _count(format_context(blocks))
+    trace.count("context_tokens_total", total)
+    trace.record("pack", start, (time.perf_counter() - t0) * 1000.0,
+                 chunks=len(docs), blocks=len(blocks), tokens=total)
+
+    if stats is not None:
+        stats.update({
+            "chunks_in": len(docs), "blocks_out": len(blocks),
+            "chunks_out": sum(len(b["ids"]) for b in blocks),
+            "tokens_in": _count(format_context(docs)), "tokens_out": total,
+        })
+    return blocks
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from .retrieve import retrieve_with_rerank
+
+    ap = argparse.ArgumentParser(description="Show what context packing does to one query's prompt.")
+    ap.add_argument("--query", type=str, required=True)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--max_tokens", type=int, default=None)
+    ap.add_argument("--lam", type=float, default=None, help="MMR lambda (1.0 = relevance order only)")
+    args = ap.parse_args()
+
+    docs = retrieve_with_rerank(args.query, top_k=args.k)
+    stats: Dict[str, Any] = {}
+    blocks = pack_context(args.query, docs, max_tokens=args.max_tokens, lam=args.lam, stats=stats)
+    for i, b in enumerate(blocks, 1):
+        meta = b["metadata"]
+        print(f"[{i}] {meta.get('doc_title', 'Document')} p.{meta.get('page')} <- {len(b['ids'])} chunk(s)")
+    print(f"[STATS] chunks {stats['chunks_in']} -> {stats['chunks_out']} in {stats['blocks_out']} blocks, "
+          f"tokens {stats['tokens_in']} -> {stats['tokens_out']}")
@@ -0,0 +1,122 @@
+"""
+Vector quantizers for the flat index's compressed mode.
+
+- int8: per-dimension symmetric scale, 1 byte per dimension (4x vs float32)
+- pq:   product quantization, `m` subspaces with 256 k-means centroids each,
+        1 byte per subspace (dim*4/m x vs float32; 16x for the default m=dim/4)
+
+Both score a query against codes without decoding them (asymmetric: the query
+stays full precision), returning approximate inner products. The flat store
+re-scores the best candidates against the full-precision vectors.
+"""
+
+from typing import Dict, Any
+
+import numpy as np
+
+# Rows scored per block, to bound the temporaries.
+_BLOCK = 65536
+
+class Int8Quantizer:
+    kind = "int8"
+    code_dtype = np.int8
+
+    def __init__(self, scale: np.ndarray):
+        self.scale = scale.astype(np.float32)
+
+    @property
+    def code_len(self) -> int:
+        return len(self.scale)
+
+    @classmethod
+    def train(cls, X: np.ndarray) -> "Int8Quantizer":
+        return cls(np.maximum(np.abs(X).max(axis=0), 1e-6) / 127.0)
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(X / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, Q: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate Q . x for every query row and code row: (queries, rows)."""
+        qs = (Q * self.scale).astype(np.float32)
+        out = np.empty((len(Q), len(codes)), dtype=np.float32)
+        for s in range(0, len(codes), _BLOCK):
+            # One upcast per block, shared by every query in the batch.
+            out[:, s:s + _BLOCK] = qs @ np.asarray(codes[s:s + _BLOCK], dtype=np.float32).T
+        return out
+
+    def state(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "scale": self.scale}
+
+class PQQuantizer:
+    kind = "pq"
+    code_dtype = np.uint8
+
+    def __init__(self, codebooks: np.ndarray):
+        # codebooks: (m, 256, dsub)
+        self.codebooks = codebooks.astype(np.float32)
+
+    @property
+    def code_len(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, X: np.ndarray, m: int, seed: int = 0) -> "PQQuantizer":
+        from sklearn.cluster import MiniBatchKMeans
+        dim = X.shape[1]
+        if dim % m:
+            raise ValueError(f"PQ subspaces m={m} must divide the dimension {dim}")
+        dsub = dim // m
+        k = min(256, len(X))
+        books = np.empty((m, 256, dsub), dtype=np.float32)
+        for j in range(m):
+            km = MiniBatchKMeans(n_clusters=k, n_init=1, batch_size=4096, random_state=seed + j)
+            km.fit(X[:, j * dsub:(j + 1) * dsub])
+            # Fewer than 256 training rows: fill the spare codewords with copies of trained
+            # ones, so no code or lookup-table slot scores a centroid that was never fitted.
+            books[j] = km.cluster_centers_[np.arange(256) % k]
+        return cls(books)
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        m, _, dsub = self.codebooks.shape
+        codes = np.empty((len(X), m), dtype=np.uint8)
+        for j in range(m):
+            sub = X[:, j * dsub:(j + 1) * dsub]
+            book = self.codebooks[j]
+            # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c)
+            d = (book * book).sum(axis=1)[None, :] - 2.0 * (sub @ book.T)
+            codes[:, j] = d.argmin(axis=1)
+        return codes
+
+    def scores(self, Q: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate Q . x via per-subspace lookup tables: (queries, rows)."""
+        m, _, dsub = self.codebooks.shape
+        tables = np.einsum("jkd,qjd->qjk", self.codebooks, Q.reshape(len(Q), m, dsub))
+        out = np.empty((len(Q), len(codes)), dtype=np.float32)
+        for s in range(0, len(codes), _BLOCK):
+            block = np.asarray(codes[s:s + _BLOCK])
+            acc = tables[:, 0, block[:, 0]]
+            for j in range(1, m):
+                acc += tables[:, j, block[:, j]]
+            out[:, s:s + _BLOCK] = acc
+        return out
+
+    def state(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "codebooks": self.codebooks}
+
+def train_quantizer(kind: str, X: np.ndarray, pq_m: int = 0):
+    if kind == "int8":
+        return Int8Quantizer.train(X)
+    if kind == "pq":
+        return PQQuantizer.train(X, pq_m or max(1, X.shape[1] // 4))
+    raise ValueError(f"Unknown compression {kind!r} (expected 'int8' or 'pq')")
+
+def save_quantizer(quant, path: str):
+    with open(path, "wb") as f:
+        np.savez(f, **quant.state())
+
+def load_quantizer(path: str):
+    with np.load(path) as z:
+        kind = str(z["kind"])
+        if kind == "int8":
+            return Int8Quantizer(z["scale"])
+        return PQQuantizer(z["codebooks"])
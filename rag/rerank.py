@@ -0,0 +1,135 @@
+"""
+Second-stage reranking with a small cross-encoder on CPU.
+
+Off unless ACADEMYRAG_RERANK=1: the model is downloaded on first use and
+changes both rankings and latency.
+
+The first stage over-fetches candidates; rerank() rescores (query, chunk)
+pairs in one batched forward pass. The model loads once per process, scores
+are cached per (model, query, chunk id), and a latency budget caps how many
+uncached pairs are scored per call: the estimated per-pair cost (running
+average) decides how many pairs fit, shared rank by rank across a batch's
+queries, and the rest keep their first-stage order below the reranked head.
+
+Env:
+  ACADEMYRAG_RERANK=1                  enable
+  ACADEMYRAG_RERANK_MODEL              default cross-encoder/ms-marco-MiniLM-L-6-v2
+  ACADEMYRAG_RERANK_CANDIDATES         first-stage depth (default 30)
+  ACADEMYRAG_RERANK_BUDGET_MS          model time per rerank call, i.e. per query or per
+                                       retrieve_many() batch (default 250)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from . import trace
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+SCORE_CACHE_SIZE = int(os.getenv("ACADEMYRAG_RERANK_CACHE_SIZE", "20000"))
+
+_lock = threading.Lock()
+_models = {}
+_failed = set()
+_score_lock = threading.Lock()
+_scores: "OrderedDict[tuple[str, str, str], float]" = OrderedDict()
+# Running estimate of model seconds per pair, per model.
+_pair_cost: Dict[str, float] = {}
+
+def enabled() -> bool:
+    return os.getenv("ACADEMYRAG_RERANK", "0") == "1"
+
+def default_candidates() -> int:
+    return int(os.getenv("ACADEMYRAG_RERANK_CANDIDATES", "30"))
+
+def _model_name() -> str:
+    return os.getenv("ACADEMYRAG_RERANK_MODEL", DEFAULT_MODEL)
+
+def get_reranker(model_name: Optional[str] = None):
+    """Load the cross-encoder once; None if it can't be loaded (e.g. offline)."""
+    model_name = model_name or _model_name()
+    model = _models.get(model_name)
+    if model is not None or model_name in _failed:
+        return model
+    with _lock:
+        if model_name not in _models and model_name not in _failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                _models[model_name] = CrossEncoder(model_name, device="cpu")
+            except Exception as e:
+                print(f"[WARN] Reranker {model_name} unavailable, using first-stage order: {e}")
+                _failed.add(model_name)
+    return _models.get(model_name)
+
+def rerank(query: str, docs: List[Dict[str, Any]], top_k: int,
+           budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Rescore docs (first-stage order, each with "id" and "text") and return the
+    best top_k. Each returned item keeps its first-stage score under
+    "retrieval_score" and carries the cross-encoder score in "score"; items
+    the budget left unscored follow the scored ones with "score" None.
+    """
+    return rerank_many([query], [docs], top_k, budget_ms=budget_ms)[0]
+
+def rerank_many(queries: List[str], doc_lists: List[List[Dict[str, Any]]], top_k: int,
+                budget_ms: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+    """rerank() for several queries, with every uncached pair in one forward pass."""
+    model_name = _model_name()
+    model = get_reranker(model_name)
+    if model is None:
+        return [docs[:top_k] for docs in doc_lists]
+    if budget_ms is None:
+        budget_ms = float(os.getenv("ACADEMYRAG_RERANK_BUDGET_MS", "250"))
+    qkeys = [" ".join(q.lower().split()) for q in queries]
+
+    scores: List[List[Optional[float]]] = []
+    with _score_lock:
+        for qkey, docs in zip(qkeys, doc_lists):
+            row = []
+            for d in docs:
+                key = (model_name, qkey, d.get("id") or d["text"])
+                s = _scores.get(key)
+                if s is not None:
+                    _scores.move_to_end(key)
+                row.append(s)
+            scores.append(row)
+
+    todo = [[i for i, s in enumerate(row) if s is None] for row in scores]
+    cost = _pair_cost.get(model_name)
+    if cost:
+        # Only as many pairs as the budget allows for the whole call, taken rank by
+        # rank so every query gets its best first-stage candidates scored first.
+        cap = max(top_k, int(budget_ms / 1000.0 / cost))
+        depth = max(map(len, todo), default=0)
+        pairs = [(q, t[r]) for r in range(depth) for q, t in enumerate(todo) if r < len(t)][:cap]
+    else:
+        pairs = [(q, i) for q, t in enumerate(todo) for i in t]
+    trace.count("rerank_cache_hits_total", sum(s is not None for row in scores for s in row))
+    trace.count("rerank_pairs_scored_total", len(pairs))
+    if pairs:
+        t0 = time.perf_counter()
+        with trace.span("rerank.predict", pairs=len(pairs)):
+            fresh = model.predict([(queries[q], doc_lists[q][i]["text"]) for q, i in pairs],
+                                  batch_size=min(len(pairs), 256), show_progress_bar=False)
+        per_pair = (time.perf_counter() - t0) / len(pairs)
+        _pair_cost[model_name] = per_pair if cost is None else 0.8 * cost + 0.2 * per_pair
+        with _score_lock:
+            for (q, i), s in zip(pairs, fresh):
+                d = doc_lists[q][i]
+                scores[q][i] = float(s)
+                _scores[(model_name, qkeys[q], d.get("id") or d["text"])] = float(s)
+            while len(_scores) > SCORE_CACHE_SIZE:
+                _scores.popitem(last=False)
+
+    out = []
+    for docs, row in zip(doc_lists, scores):
+        head = sorted((i for i, s in enumerate(row) if s is not None), key=lambda i: row[i], reverse=True)
+        tail = [i for i, s in enumerate(row) if s is None]
+        ranked = []
+        for i in (head + tail)[:top_k]:
+            # Unscored items don't keep their fusion score: it isn't comparable to the model's.
+            ranked.append({**docs[i], "retrieval_score": docs[i].get("score"), "score": row[i]})
+        out.append(ranked)
+    return out
@@ -1,15 +1,167 @@
-from typing import List, Dict, Any
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from .store import get_store
-from .embed import Embedder
+from .embed import Embedder, get_model
+from .lexical import get_lexical_index
+from .catalog import get_catalog
+from .dedup import get_dedup
+from . import rerank as reranker
+from . import trace
 
-def retrieve_with_rerank(query: str, top_k: int = 6) -> List[Dict[str, Any]]:
+RRF_K = int(os.getenv("ACADEMYRAG_RRF_K", "60"))
+
+def _dense(store, q_vecs: np.ndarray, n: int, selection=None) -> List[List[Dict[str, Any]]]:
+    """One vector query for all q_vecs; a ranked list of hits per vector."""
+    with trace.span("store.query", queries=len(q_vecs), n=n, filtered=selection is not None):
+        res = store.query(query_embeddings=q_vecs, n_results=n, include=["documents","metadatas","distances"],
+                          selection=selection)
+    # A selection widened to near-duplicates' canonical chunks may admit neighbours of those.
+    allowed = set(selection.ids) if selection is not None and not selection.exact else None
+    out = []
+    for qi in range(len(q_vecs)):
+        docs = []
+        if res and res.get("documents"):
+            for cid, doc, meta, dist in zip(res["ids"][qi], res["documents"][qi], res["metadatas"][qi], res["distances"][qi]):
+                if allowed is not None and cid not in allowed:
+                    continue
+                item = {"id": cid, "text": doc, "metadata": meta, "score": 1.0/(1.0+dist) if dist is not None else None}
+                docs.append(item)
+        out.append(docs)
+    return out
+
+def rrf_fuse(ranked: List[Tuple[float, List[str]]], k: int = RRF_K) -> Dict[str, float]:
+    """Reciprocal rank fusion: each list adds weight / (k + rank) to the ids it ranks."""
+    fused: Dict[str, float] = {}
+    for weight, ids in ranked:
+        for rank, cid in enumerate(ids, start=1):
+            fused[cid] = fused.get(cid, 0.0) + weight / (k + rank)
+    return fused
+
+def _lap(timings: Optional[Dict[str, float]], key: str, t0: float) -> float:
+    # Add the time since t0 to timings[key] (ms) and return a fresh t0.
+    now = time.perf_counter()
+    if timings is not None:
+        timings[key] = timings.get(key, 0.0) + (now - t0) * 1000.0
+    return now
+
+def _first_stage(queries: List[str], n: int, hybrid: Optional[bool], dense_weight: Optional[float],
+                 lexical_weight: Optional[float],
+                 timings: Optional[Dict[str, float]] = None,
+                 selection=None) -> List[List[Dict[str, Any]]]:
     store = get_store()
     embedder = Embedder()
-    q_vec = embedder.embed([query])[0]
-    res = store.query(query_embeddings=[q_vec], n_results=top_k, include=["documents","metadatas","distances"])
-    docs = []
-    if res and res.get("documents"):
-        for doc, meta, dist in zip(res["documents"][0], res["metadatas"][0], res["distances"][0]):
-            item = {"text": doc, "metadata": meta, "score": 1.0/(1.0+dist) if dist is not None else None}
-            docs.append(item)
-    return docs
+    t0 = time.perf_counter()
+    with trace.span("embed_query", queries=len(queries)):
+        q_vecs = embedder.embed_queries(queries)
+    t0 = _lap(timings, "embed_ms", t0)
+    if hybrid is None:
+        hybrid = os.getenv("ACADEMYRAG_HYBRID", "1") == "1"
+    lexical = get_lexical_index() if hybrid else None
+    if lexical is None or len(lexical) == 0:
+        docs = _dense(store, q_vecs, n, selection)
+        _lap(timings, "search_ms", t0)
+        return docs
+
+    # Over-fetch from both sources so fusion can promote items ranked lower in one.
+    depth = max(4 * n, 20)
+    dense_all = _dense(store, q_vecs, depth, selection)
+    only = lexical.mask(selection.ids) if selection is not None else None
+    if dense_weight is None:
+        dense_weight = float(os.getenv("ACADEMYRAG_DENSE_WEIGHT", "1.0"))
+    if lexical_weight is None:
+        lexical_weight = float(os.getenv("ACADEMYRAG_LEXICAL_WEIGHT", "1.0"))
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    fused_all = []
+    with trace.span("lexical.search", queries=len(queries), depth=depth):
+        for query, dense in zip(queries, dense_all):
+            lex = lexical.search(query, k=depth, only=only)
+            fused = rrf_fuse([(dense_weight, [d["id"] for d in dense]),
+                              (lexical_weight, [cid for cid, _ in lex])])
+            fused_all.append((fused, sorted(fused, key=fused.get, reverse=True)[:n]))
+            for d in dense:
+                by_id.setdefault(d["id"], d)
+
+    missing = sorted({cid for _, best in fused_all for cid in best if cid not in by_id})
+    if missing:
+        # Lexical-only hits: fetch their text/metadata from the store, once for all queries.
+        with trace.span("store.get", ids=len(missing)):
+            got = store.get(ids=missing, include=["documents","metadatas"])
+        for cid, doc, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+            by_id[cid] = {"id": cid, "text": doc, "metadata": meta}
+    _lap(timings, "search_ms", t0)
+    return [[{**by_id[cid], "score": fused[cid]} for cid in best if cid in by_id]
+            for fused, best in fused_all]
+
+def retrieve_many(queries: List[str], top_k: int = 6, hybrid: Optional[bool] = None,
+                  dense_weight: Optional[float] = None,
+                  lexical_weight: Optional[float] = None,
+                  rerank: Optional[bool] = None,
+                  candidates: Optional[int] = None,
+                  timings: Optional[Dict[str, float]] = None,
+                  filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    retrieve_with_rerank() for a batch of queries: the queries are embedded
+    in one call, the vector store is searched with a single multi-vector
+    query, and the reranker scores every (query, chunk) pair in one pass.
+    Returns one result list per query, in input order. If `timings` is
+    given, the batch's embed_ms / search_ms / rerank_ms are added to it.
+    `filters` (see rag/catalog.py) restricts both searches to a slice of
+    the corpus, resolved through the document catalog.
+
+    Hits with near-duplicates elsewhere in the corpus (rag/dedup.py) list
+    them under "aliases".
+    """
+    if not queries:
+        return []
+    trace.count("retrieve_queries_total", len(queries))
+    with trace.span("retrieve", queries=len(queries), top_k=top_k):
+        dedup = get_dedup()
+        selection = get_catalog().resolve(filters) if filters else None
+        if selection is not None and dedup is not None:
+            # Selected aliases are searched through their canonical chunks.
+            selection.add_canonicals(dedup.canonicals(selection.ids))
+        if selection is not None and selection.empty:
+            return [[] for _ in queries]
+        if rerank is None:
+            rerank = reranker.enabled()
+        if not rerank:
+            out = _first_stage(queries, top_k, hybrid, dense_weight, lexical_weight, timings, selection)
+        else:
+            n = max(top_k, candidates or reranker.default_candidates())
+            docs = _first_stage(queries, n, hybrid, dense_weight, lexical_weight, timings, selection)
+            t0 = time.perf_counter()
+            with trace.span("rerank", pairs=sum(len(d) for d in docs)):
+                out = reranker.rerank_many(queries, docs, top_k)
+            _lap(timings, "rerank_ms", t0)
+        return dedup.expand(out, selection) if dedup is not None else out
+
+def retrieve_with_rerank(query: str, top_k: int = 6, hybrid: Optional[bool] = None,
+                         dense_weight: Optional[float] = None,
+                         lexical_weight: Optional[float] = None,
+                         rerank: Optional[bool] = None,
+                         candidates: Optional[int] = None,
+                         filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    First stage: dense retrieval fused with BM25 (ACADEMYRAG_HYBRID, on by
+    default) via reciprocal rank fusion. Second stage: the top `candidates`
+    are rescored by a cross-encoder (ACADEMYRAG_RERANK=1, off by default) and
+    the best top_k returned. "score" is the last stage's score (None for
+    candidates the reranker's budget left unscored). `filters` limits the
+    search to matching documents/pages (see rag/catalog.py).
+    """
+    return retrieve_many([query], top_k, hybrid, dense_weight, lexical_weight, rerank, candidates,
+                         filters=filters)[0]
+
+def warmup() -> int:
+    """Load the embedder, store, BM25 index, catalog and reranker up front; returns the chunk count."""
+    get_model(*Embedder().resolve())  # no API probe for remote embedders
+    chunks = get_store().count()
+    get_lexical_index()
+    get_catalog()
+    get_dedup()
+    if reranker.enabled():
+        reranker.get_reranker()
+    return chunks
@@ -0,0 +1,380 @@
+"""
+Headless query service: a small asyncio HTTP/1.1 server that keeps the
+embedder, store, BM25 index and reranker loaded between requests.
+
+Concurrent retrievals are micro-batched. Requests queue up while a batch is
+running; the next batch takes everything waiting (up to
+ACADEMYRAG_SERVE_MAX_BATCH queries) and, if the previous batch had more
+than one query, waits up to ACADEMYRAG_SERVE_MAX_WAIT_MS for more. It runs
+through retrieve_many() as one embedding call and one multi-vector store
+query. Queries are grouped by (top_k, filters, rerank) so each one sees
+exactly the retrieval it would alone. Retrieval runs on one worker thread (the models are CPU bound);
+generation and ingest have their own threads.
+
+Endpoints (JSON in, JSON out):
+  GET  /health    index size and batching stats
+  GET  /catalog   document titles and file types (for filter pickers)
+  GET  /metrics   Prometheus text (counters need ACADEMYRAG_TRACE=1)
+  POST /retrieve  {"query": str | "queries": [str], "top_k": 6, "filters": {...}, "rerank": null}
+                  -> {"docs": [...]} or {"results": [[...]]}, plus this request's share of "timings"
+  POST /answer    {"query": str, "top_k": 6, "filters": {...}, "docs": [...], "stream": false,
+                   "use_cache": true}; with "docs" retrieval is skipped
+                  -> {"text", "citations", "docs"}; with "stream" NDJSON lines
+                     {"citations", "docs"}, then {"delta": str}..., then {"done": true}
+  POST /summary   same as /answer with "topic"
+  POST /quiz      {"topic", "top_k", "filters", "docs"} -> the quiz plus "docs"
+  POST /ingest    {"path": str, "files": [str], "chunk_size": 900, "chunk_overlap": 120} -> {"chunks": n}
+                  (the path is read by the server, so it must be on its filesystem)
+
+Env:
+  ACADEMYRAG_SERVE_MAX_BATCH     default 64 queries per retrieval batch
+  ACADEMYRAG_SERVE_MAX_WAIT_MS   default 5; 0 batches only what is already waiting
+  ACADEMYRAG_SERVE_WORKERS       generation threads, default 16
+
+CLI:
+  python -m rag.server --host 127.0.0.1 --port 8000
+  python -m rag.client --bench --concurrency 32   # load test a running server
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+from . import trace
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            500: "Internal Server Error"}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _dumps(obj) -> bytes:
+    # Scores can be NumPy scalars.
+    return json.dumps(obj, default=lambda o: o.item() if hasattr(o, "item") else str(o)).encode("utf-8")
+
+class MicroBatcher:
+    """Coalesces concurrent retrieve() calls into retrieve_many() batches."""
+
+    def __init__(self, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batches = 0
+        self.queries = 0
+        self._last = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="academyrag-retrieve")
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        return asyncio.get_running_loop().create_task(self._run())
+
+    async def retrieve(self, queries: List[str], top_k: int, filters: Optional[Dict[str, Any]] = None,
+                       rerank: Optional[bool] = None) -> Tuple[List[List[Dict[str, Any]]], Dict[str, float]]:
+        fut = asyncio.get_running_loop().create_future()
+        key = (int(top_k), json.dumps(filters or None, sort_keys=True), rerank)
+        await self._queue.put((key, list(queries), fut))
+        return await fut
+
+    async def _collect(self) -> list:
+        first = await self._queue.get()
+        batch, n = [first], len(first[1])
+        # Only hold a batch open under load; a lone query on an idle server goes straight through.
+        deadline = time.monotonic() + (self.max_wait if self._last > 1 else 0.0)
+        while n < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), left)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            n += len(item[1])
+        self._last = n
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            groups: Dict[tuple, list] = defaultdict(list)
+            for item in batch:
+                groups[item[0]].append(item)
+            for (top_k, filters, rerank), items in groups.items():
+                queries = [q for _, qs, _ in items for q in qs]
+                self.batches += 1
+                self.queries += len(queries)
+                trace.count("serve_batches_total")
+                trace.count("serve_batched_queries_total", len(queries))
+                try:
+                    results, timings = await loop.run_in_executor(
+                        self._executor, _retrieve_batch, queries, top_k, json.loads(filters), rerank)
+                except Exception as e:
+                    for _, _, fut in items:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                pos = 0
+                for _, qs, fut in items:
+                    share = {k: v * len(qs) / len(queries) for k, v in timings.items()}
+                    if not fut.done():
+                        fut.set_result((results[pos:pos + len(qs)], share))
+                    pos += len(qs)
+
+def _retrieve_batch(queries: List[str], top_k: int, filters, rerank):
+    from .retrieve import retrieve_many
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    results = retrieve_many(queries, top_k=top_k, rerank=rerank, timings=timings, filters=filters)
+    timings["retrieve_ms"] = (time.perf_counter() - t0) * 1000.0
+    return results, timings
+
+class QueryService:
+    def __init__(self, max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None,
+                 workers: Optional[int] = None):
+        self.batcher = MicroBatcher(
+            max_batch if max_batch is not None else int(os.getenv("ACADEMYRAG_SERVE_MAX_BATCH", "64")),
+            max_wait_ms if max_wait_ms is not None else float(os.getenv("ACADEMYRAG_SERVE_MAX_WAIT_MS", "5")))
+        self._gen = ThreadPoolExecutor(max_workers=workers or int(os.getenv("ACADEMYRAG_SERVE_WORKERS", "16")),
+                                       thread_name_prefix="academyrag-generate")
+        self._ingest = ThreadPoolExecutor(max_workers=1, thread_name_prefix="academyrag-ingest")
+        self.started = time.time()
+        self.requests = 0
+
+    def warmup(self):
+        """Load everything a query touches, so the first request doesn't pay for it."""
+        from .retrieve import warmup
+        return warmup()
+
+    # ---- HTTP ---------------------------------------------------------------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "malformed request line"}, keep=False)
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+                keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if not await self._dispatch(method, target.split("?")[0], body, writer, keep):
+                    break
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status: int, obj, keep: bool = True,
+                    content_type: str = "application/json"):
+        body = obj if isinstance(obj, bytes) else _dumps(obj)
+        writer.write((f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                      f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, path: str, body: bytes, writer, keep: bool) -> bool:
+        """Answer one request; False if the connection can't be reused."""
+        self.requests += 1
+        routes = {
+            ("GET", "/health"): self.health, ("GET", "/catalog"): self.catalog,
+            ("POST", "/retrieve"): self.retrieve, ("POST", "/answer"): self.answer,
+            ("POST", "/summary"): self.summary, ("POST", "/quiz"): self.quiz,
+            ("POST", "/ingest"): self.ingest,
+        }
+        known = path == "/metrics" or any(p == path for _, p in routes)
+        trace.count("serve_requests_total", endpoint=path if known else "other")
+        try:
+            if (method, path) == ("GET", "/metrics"):
+                await self._send(writer, 200, trace.render_prometheus().encode("utf-8"), keep,
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                return True
+            fn = routes.get((method, path))
+            if fn is None:
+                raise HTTPError(405 if known else 404, f"{method} {path}")
+            req = json.loads(body or b"{}")
+            if not isinstance(req, dict):
+                raise HTTPError(400, "request body must be a JSON object")
+            res = await fn(req)
+            if hasattr(res, "__aiter__"):
+                await self._stream(writer, res)
+                return False
+            await self._send(writer, 200, res, keep)
+        except HTTPError as e:
+            await self._send(writer, e.status, {"error": str(e)}, keep)
+        except ValueError as e:
+            await self._send(writer, 400, {"error": f"bad request: {e}"}, keep)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            print(f"[WARN] {method} {path} failed: {e!r}")
+            await self._send(writer, 500, {"error": repr(e)}, keep)
+        return True
+
+    async def _stream(self, writer, lines):
+        # NDJSON over a close-delimited body, so no chunked framing is needed.
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        try:
+            async for obj in lines:
+                writer.write(_dumps(obj) + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            # The status line is already out; report the failure in-band.
+            print(f"[WARN] Stream failed: {e!r}")
+            writer.write(_dumps({"error": repr(e)}) + b"\n")
+            await writer.drain()
+
+    # ---- endpoints ----------------------------------------------------------
+
+    async def health(self, req):
+        from .store import get_store
+        b = self.batcher
+        return {"status": "ok", "chunks": get_store().count(), "uptime_s": time.time() - self.started,
+                "requests": self.requests, "batches": b.batches, "queries": b.queries,
+                "avg_batch": b.queries / b.batches if b.batches else 0.0}
+
+    async def catalog(self, req):
+        from .catalog import get_catalog
+        cat = get_catalog()
+        return {"titles": cat.titles(), "file_types": cat.file_types(), **cat.stats()}
+
+    async def retrieve(self, req):
+        if "queries" in req:
+            queries, single = req["queries"], False
+        elif "query" in req:
+            queries, single = [req["query"]], True
+        else:
+            raise HTTPError(400, "missing 'query' or 'queries'")
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            raise HTTPError(400, "'queries' must be a list of strings")
+        if not queries:
+            return {"results": [], "timings": {}}
+        results, timings = await self.batcher.retrieve(queries, int(req.get("top_k", 6)), req.get("filters"),
+                                                       req.get("rerank"))
+        return {"docs": results[0], "timings": timings} if single else {"results": results, "timings": timings}
+
+    async def _docs(self, req, field: str) -> Tuple[str, List[Dict[str, Any]]]:
+        text = req.get(field)
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, f"missing '{field}'")
+        docs = req.get("docs")
+        if docs is None:
+            results, _ = await self.batcher.retrieve([text], int(req.get("top_k", 6)), req.get("filters"),
+                                                     req.get("rerank"))
+            docs = results[0]
+        return text, docs
+
+    async def _generate(self, req, field: str, kind: str):
+        from . import generate
+        text, docs = await self._docs(req, field)
+        use_cache = bool(req.get("use_cache", True))
+        if not docs:
+            return {"text": "", "citations": [], "docs": []}
+        loop = asyncio.get_running_loop()
+        if req.get("stream"):
+            fn = generate.stream_answer if kind == "answer" else generate.stream_summary
+            res = await loop.run_in_executor(self._gen, fn, text, docs, use_cache)
+            return self._relay(res, docs)
+        fn = generate.generate_answer if kind == "answer" else generate.generate_summary
+        res = await loop.run_in_executor(self._gen, fn, text, docs, use_cache)
+        return {**res, "docs": docs}
+
+    async def _relay(self, res, docs):
+        # Tokens come from a sync generator; pull it on a generation thread.
+        yield {"citations": res["citations"], "docs": docs, "cached": res.get("cached", False)}
+        loop = asyncio.get_running_loop()
+        it, end = res["stream"], object()
+        try:
+            while True:
+                tok = await loop.run_in_executor(self._gen, next, it, end)
+                if tok is end:
+                    break
+                yield {"delta": tok}
+        finally:
+            if hasattr(it, "close"):  # a cached answer is a plain iterator
+                await loop.run_in_executor(self._gen, it.close)
+        yield {"done": True}
+
+    async def answer(self, req):
+        return await self._generate(req, "query", "answer")
+
+    async def summary(self, req):
+        return await self._generate(req, "topic", "summary")
+
+    async def quiz(self, req):
+        from .generate import generate_quiz
+        topic, docs = await self._docs(req, "topic")
+        if not docs:
+            return {"questions": [], "docs": []}
+        res = await asyncio.get_running_loop().run_in_executor(
+            self._gen, generate_quiz, topic, docs, bool(req.get("use_cache", True)))
+        return {**res, "docs": docs}
+
+    async def ingest(self, req):
+        from .ingest import ingest_path
+        path, files = req.get("path"), req.get("files")
+        if not isinstance(path, str) or not os.path.isdir(path):
+            raise HTTPError(400, f"not a directory on the server: {path!r}")
+        if files is not None and not (isinstance(files, list) and all(isinstance(f, str) for f in files)):
+            raise HTTPError(400, "'files' must be a list of paths")
+        n = await asyncio.get_running_loop().run_in_executor(
+            self._ingest, lambda: ingest_path(path, int(req.get("chunk_size", 900)),
+                                              int(req.get("chunk_overlap", 120)), files=files))
+        return {"chunks": n}
+
+async def serve(host: str = "127.0.0.1", port: int = 8000, service: Optional[QueryService] = None):
+    service = service or QueryService()
+    chunks = service.warmup()
+    batcher_task = service.batcher.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    b = service.batcher
+    print(f"[OK] Serving {chunks} chunks on http://{host}:{port} "
+          f"(max batch {b.max_batch}, max wait {b.max_wait * 1000:g} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher_task.cancel()
+
+def main(argv: Optional[List[str]] = None):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Serve retrieval and generation over HTTP.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--max_batch", type=int, default=None, help="Queries per retrieval batch (ACADEMYRAG_SERVE_MAX_BATCH)")
+    ap.add_argument("--max_wait_ms", type=float, default=None,
+                    help="How long a batch waits for more queries (ACADEMYRAG_SERVE_MAX_WAIT_MS)")
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, QueryService(args.max_batch, args.max_wait_ms)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Sharded vector store: one child store per course folder or hash partition.
+
+ACADEMYRAG_SHARD_BY picks the layout of a new index:
+
+- none    (default) a single store, as before
+- folder  one shard per top-level folder under ACADEMYRAG_SHARD_ROOT
+          (default ./data/raw), i.e. one per course; files directly under
+          the root, or outside it, go to shard "default"
+- hash    ACADEMYRAG_SHARDS (default 4) partitions by a hash of the file path
+
+Shards are Chroma collections "academyrag_<shard>" in ACADEMYRAG_DB_DIR, or
+flat stores under {ACADEMYRAG_DB_DIR}/shards/<shard> with
+ACADEMYRAG_STORE=flat. The layout is written to {ACADEMYRAG_DB_DIR}/shards.json
+when the index is created and wins over the env from then on, so chunks are
+always looked up where they were written; `--reshard` changes it.
+
+Chunks are routed by their source file, so all chunks of a file share a
+shard. Upserts are grouped by shard and written concurrently. A query goes
+only to the shards holding the files a filter selects (all shards when
+unfiltered), runs on them concurrently and merges their sorted top-k lists
+with a heap; distances are comparable across shards because every shard
+uses the same embedding space. A shard that fails a query is logged and
+skipped, so one broken course does not take search down for the others.
+
+`--rebuild` drops shards and re-ingests their files (the embedding cache
+makes this mostly a copy); the other shards stay searchable meanwhile, and
+the rebuilt shards are written in parallel.
+
+Env:
+  ACADEMYRAG_SHARD_BY            none | folder | hash, for a new index
+  ACADEMYRAG_SHARDS              hash shards, default 4
+  ACADEMYRAG_SHARD_ROOT          folder mode: the folder holding one subfolder per course
+  ACADEMYRAG_SHARD_MAX_CHUNKS    warn when a shard grows past this (default 0: no cap)
+  ACADEMYRAG_SHARD_WORKERS       threads for fan-out, default 8
+
+CLI:
+  python -m rag.shards --stats
+  python -m rag.shards --rebuild intro-econ stats-101   # drop and re-ingest these shards
+  python -m rag.shards --reshard --by hash --shards 8   # move every chunk to a new layout
+  python -m rag.shards --reshard --by hash              # enough shards to stay under the cap
+"""
+
+import os
+import re
+import json
+import zlib
+import heapq
+import argparse
+import itertools
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Iterable
+
+import numpy as np
+
+from . import trace
+from .store import VectorStore, DEFAULT_INCLUDE, open_backend, drop_backend
+
+_LAYOUT = "shards.json"
+_MODES = ("folder", "hash")
+
+def _safe_name(name: str) -> str:
+    """A folder name as a shard name (valid in Chroma collection names and paths)."""
+    safe = re.sub(r"[^A-Za-z0-9_-]+", "-", name).strip("-_")
+    if len(safe) > 40 or safe != name:
+        # Keep distinct folders apart when sanitizing merges or truncates them.
+        safe = f"{safe[:32]}-{zlib.crc32(name.encode('utf-8')):08x}".lstrip("-")
+    return safe
+
+class Layout:
+    """How chunks map to shards; persisted in shards.json."""
+
+    def __init__(self, by: str, shards: int = 0, root: str = "", names: Optional[List[str]] = None,
+                 rebuilding: Optional[Dict[str, Any]] = None):
+        if by not in _MODES:
+            raise ValueError(f"Unknown shard layout {by!r} (expected 'folder' or 'hash')")
+        if by == "hash" and shards < 1:
+            raise ValueError("A hash layout needs at least one shard")
+        self.by = by
+        self.shards = shards
+        self.root = root
+        if names is None:
+            names = [self._hash_name(i) for i in range(shards)] if by == "hash" else []
+        self.names = list(names)
+        # An interrupted --rebuild: {"shards": [...], "files": [...], "chunking": [...]}
+        self.rebuilding = rebuilding or {}
+
+    def _hash_name(self, i: int) -> str:
+        return f"hash{self.shards}-{i}"
+
+    def route(self, source_path: str) -> str:
+        """The shard holding a file's chunks."""
+        if self.by == "hash":
+            return self._hash_name(zlib.crc32(os.path.normpath(source_path).encode("utf-8")) % self.shards)
+        rel = os.path.relpath(os.path.abspath(source_path), os.path.abspath(self.root))
+        parts = rel.split(os.sep)
+        if parts[0] == os.pardir or len(parts) < 2:
+            return "default"
+        return _safe_name(parts[0])
+
+    def same_as(self, other: "Layout") -> bool:
+        return (self.by, self.shards, os.path.abspath(self.root)) == \
+               (other.by, other.shards, os.path.abspath(other.root))
+
+    def describe(self) -> str:
+        if self.by == "hash":
+            return f"hash, {self.shards} shards"
+        return f"folder, one shard per folder under {self.root}"
+
+    @classmethod
+    def load(cls, path: str) -> "Layout":
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["by"], d.get("shards", 0), d.get("root", ""), d.get("names"), d.get("rebuilding"))
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"by": self.by, "shards": self.shards, "root": self.root, "names": self.names,
+                       "rebuilding": self.rebuilding}, f, indent=2)
+        os.replace(tmp, path)
+
+def new_layout(by: str, shards: Optional[int] = None, root: Optional[str] = None) -> Layout:
+    """A layout from explicit settings, falling back to the env."""
+    if shards is None:
+        shards = int(os.getenv("ACADEMYRAG_SHARDS", "4"))
+    if root is None:
+        root = os.getenv("ACADEMYRAG_SHARD_ROOT", "./data/raw")
+    return Layout(by, shards if by == "hash" else 0, os.path.normpath(root) if by == "folder" else "")
+
+def load_layout(db_dir: str) -> Optional[Layout]:
+    """The index's shard layout, or None for an unsharded index."""
+    path = os.path.join(db_dir, _LAYOUT)
+    want = os.getenv("ACADEMYRAG_SHARD_BY")
+    if os.path.exists(path):
+        layout = Layout.load(path)
+        if want is not None and want != layout.by:
+            print(f"[WARN] The index is sharded by {layout.by} ({path}); ignoring ACADEMYRAG_SHARD_BY={want}. "
+                  f"`python -m rag.shards --reshard --by {want}` changes the layout.")
+        return layout
+    if want in (None, "", "none"):
+        return None
+    if want not in _MODES:
+        raise ValueError(f"Unknown ACADEMYRAG_SHARD_BY={want!r} (expected 'none', 'folder' or 'hash')")
+    if os.path.exists(os.path.join(db_dir, "manifest.json")):
+        print(f"[WARN] The existing index is not sharded; ignoring ACADEMYRAG_SHARD_BY={want}. "
+              f"`python -m rag.shards --reshard --by {want}` splits it.")
+        return None
+    layout = new_layout(want)
+    layout.save(path)
+    return layout
+
+class ShardedStore(VectorStore):
+    def __init__(self, db_dir: str, backend: str, layout: Layout, workers: Optional[int] = None,
+                 save: bool = True):
+        self.db_dir = db_dir
+        self.backend = backend
+        self.layout = layout
+        # save=False: a layout being built by --reshard is only recorded once it is complete.
+        self.path = os.path.join(db_dir, _LAYOUT) if save else None
+        self.max_chunks = int(os.getenv("ACADEMYRAG_SHARD_MAX_CHUNKS", "0"))
+        self.workers = workers or int(os.getenv("ACADEMYRAG_SHARD_WORKERS", "0")) or 8
+        self._children: Dict[str, VectorStore] = {}
+        self._over_cap: set = set()
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._mtime = os.stat(self.path).st_mtime_ns if self.path and os.path.exists(self.path) else None
+
+    # ---- shards -------------------------------------------------------------
+
+    def _refresh(self):
+        # Pick up course shards another process (an ingest next to the app) created.
+        if self.path is None or self.layout.by != "folder":
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self._mtime = mtime
+                for name in Layout.load(self.path).names:
+                    if name not in self.layout.names:
+                        self.layout.names.append(name)
+
+    def names(self) -> List[str]:
+        self._refresh()
+        return sorted(self.layout.names)
+
+    def shard(self, name: str) -> VectorStore:
+        with self._lock:
+            child = self._children.get(name)
+            if child is None:
+                child = self._children[name] = open_backend(self.db_dir, self.backend, name)
+                if name not in self.layout.names:
+                    self.layout.names.append(name)
+                    self._save()
+            return child
+
+    def _save(self):
+        if self.path is not None:
+            self.layout.save(self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def drop(self, name: str):
+        """Delete one shard's chunks (before rebuilding it)."""
+        with self._lock:
+            self._children.pop(name, None)
+            self._over_cap.discard(name)
+            drop_backend(self.db_dir, self.backend, name)
+
+    def _fan_out(self, fn: Callable[[str, VectorStore], Any], names: Iterable[str],
+                 tolerant: bool = False) -> Dict[str, Any]:
+        """
+        fn(name, shard) on every named shard, concurrently; {name: result}.
+        tolerant: a failing shard is reported and left out instead of raising.
+        """
+        names = list(names)
+
+        def call(name: str):
+            return fn(name, self.shard(name))
+
+        if len(names) <= 1:
+            calls = {name: None for name in names}
+        else:
+            if self._pool is None:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="academyrag-shards")
+            calls = {name: self._pool.submit(trace.bind(call), name) for name in names}
+        out = {}
+        for name, fut in calls.items():
+            try:
+                out[name] = call(name) if fut is None else fut.result()
+            except Exception as e:
+                if not tolerant:
+                    raise
+                trace.count("shard_errors_total", shard=name)
+                print(f"[WARN] Shard {name} failed, leaving it out: {e!r}")
+        return out
+
+    # ---- writes -------------------------------------------------------------
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for i, meta in enumerate(metadatas):
+            groups[self.layout.route((meta or {}).get("source_path", ""))].append(i)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        def write(name: str, shard: VectorStore):
+            rows = groups[name]
+            shard.upsert([ids[i] for i in rows], [documents[i] for i in rows], [metadatas[i] for i in rows],
+                         embeddings[rows])
+            if self.max_chunks and name not in self._over_cap and shard.count() > self.max_chunks:
+                self._over_cap.add(name)
+                print(f"[WARN] Shard {name} holds {shard.count()} chunks, over ACADEMYRAG_SHARD_MAX_CHUNKS="
+                      f"{self.max_chunks}; `python -m rag.shards --reshard --by hash` spreads the index out.")
+
+        self._fan_out(write, groups)
+
+    def delete(self, ids):
+        # Ids don't name their file's shard; each shard ignores ids it doesn't hold.
+        self._fan_out(lambda name, shard: shard.delete(ids), self.names())
+
+    # ---- reads --------------------------------------------------------------
+
+    def count(self) -> int:
+        return sum(self._fan_out(lambda name, shard: shard.count(), self.names(), tolerant=True).values())
+
+    def get(self, ids=None, include=DEFAULT_INCLUDE, limit=None, offset=None):
+        keys = ["ids"] + [k for k in include if k != "ids"]
+        out: Dict[str, List[Any]] = {k: [] for k in keys}
+        if ids is not None:
+            parts = self._fan_out(lambda name, shard: shard.get(ids=ids, include=include),
+                                  self.names(), tolerant=True)
+            found = {}
+            for res in parts.values():
+                for i, cid in enumerate(res["ids"]):
+                    found[cid] = (res, i)
+            for cid in dict.fromkeys(ids):
+                if cid in found:
+                    res, i = found[cid]
+                    for k in keys:
+                        out[k].append(res[k][i])
+            return out
+        # A page of everything: the shards in name order, one after another.
+        skip, left = offset or 0, limit
+        for name in self.names():
+            if left is not None and left <= 0:
+                break
+            shard = self.shard(name)
+            n = shard.count()
+            if skip >= n:
+                skip -= n
+                continue
+            res = shard.get(include=include, limit=left, offset=skip)
+            skip = 0
+            for k in keys:
+                out[k].extend(res[k])
+            if left is not None:
+                left -= len(res["ids"])
+        return out
+
+    def query(self, query_embeddings, n_results=10, include=DEFAULT_INCLUDE + ("distances",), selection=None):
+        names = self.names()
+        if selection is not None:
+            wanted = {self.layout.route(p) for p in selection.source_paths}
+            names = [name for name in names if name in wanted]
+        inner = tuple(include) if "distances" in include else tuple(include) + ("distances",)
+        trace.count("shard_queries_total", len(names))
+        parts = list(self._fan_out(
+            lambda name, shard: shard.query(query_embeddings, n_results=n_results, include=inner,
+                                            selection=selection),
+            names, tolerant=True).values())
+        keys = ["ids"] + [k for k in include if k != "ids"]
+        out: Dict[str, List[Any]] = {k: [] for k in keys}
+        for q in range(len(query_embeddings)):
+            # Each shard's hits are sorted by distance, so a heap merge of the runs yields the global top-k.
+            runs = [[(d, j, i) for i, d in enumerate(res["distances"][q])] for j, res in enumerate(parts)]
+            top = list(itertools.islice(heapq.merge(*runs), n_results))
+            for k in keys:
+                out[k].append([parts[j][k][q][i] for _, j, i in top])
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        """Chunks per shard."""
+        return self._fan_out(lambda name, shard: shard.count(), self.names())
+
+# ---- maintenance ------------------------------------------------------------
+
+def rebuild(store: ShardedStore, names: List[str], workers: Optional[int] = None) -> int:
+    """
+    Drop the named shards and re-ingest their files; returns the chunks
+    embedded. An interrupted rebuild resumes where it stopped.
+    """
+    from .ingest import ingest_path
+    from .manifest import load_manifest, load_checkpoint
+    layout = store.layout
+    manifest = load_manifest()
+    if layout.rebuilding:
+        names, files, chunking = (layout.rebuilding[k] for k in ("shards", "files", "chunking"))
+        print(f"[INFO] Resuming the interrupted rebuild of {', '.join(names)}.")
+    else:
+        unknown = [name for name in names if name not in layout.names]
+        if unknown:
+            raise SystemExit(f"[WARN] No such shard: {', '.join(unknown)} (have: {', '.join(store.names())})")
+        if load_checkpoint().batches:
+            raise SystemExit("[WARN] An interrupted ingest is pending; run the ingest again before rebuilding.")
+        files = sorted(p for p in manifest.files if layout.route(p) in names)
+        chunking = manifest.get(files[0])["chunking"] if files else None
+        layout.rebuilding = {"shards": list(names), "files": files, "chunking": chunking}
+        store._save()
+        for name in names:
+            store.drop(name)
+        # Files that still exist are ingested from scratch; vanished ones keep their
+        # manifest entry so the ingest purges them from the catalog and BM25 index.
+        for p in files:
+            if os.path.exists(p):
+                manifest.remove(p)
+        manifest.save()
+    n = 0
+    if files:
+        # Re-chunk the way the files were chunked, so chunk ids (and dedup aliases) carry over.
+        chunker, size, overlap = chunking
+        n = ingest_path(os.path.commonpath([os.path.abspath(p) for p in files]), size, overlap,
+                        workers=workers, chunker=chunker, files=files)
+    layout.rebuilding = {}
+    store._save()
+    return n
+
+def reshard(db_dir: str, backend: str, layout: Optional[Layout], page: int = 1000) -> int:
+    """
+    Copy every chunk into a new layout (None: unsharded), one thread per
+    source shard, then switch to it and delete the old one. Returns chunks moved.
+    """
+    from .store import get_store
+    src = get_store()
+    old: Optional[Layout] = getattr(src, "layout", None)  # None: the index isn't sharded
+    if (old is None and layout is None) or (old is not None and layout is not None and old.same_as(layout)):
+        print("[INFO] The index already has that layout.")
+        return 0
+    if old is not None and layout is not None and old.by == layout.by == "folder":
+        raise SystemExit("[WARN] Reshard to hash (or none) first: folder shards of two roots may share names.")
+    dst = ShardedStore(db_dir, backend, layout, save=False) if layout is not None else open_backend(db_dir, backend)
+    sources = [src.shard(name) for name in src.names()] if old is not None else [src]
+
+    def copy(store: VectorStore) -> int:
+        n = 0
+        while True:
+            res = store.get(include=["documents", "metadatas", "embeddings"], limit=page, offset=n)
+            if not len(res["ids"]):
+                return n
+            dst.upsert(res["ids"], res["documents"], res["metadatas"], res["embeddings"])
+            n += len(res["ids"])
+
+    with ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+        moved = sum(pool.map(copy, sources))
+    # Switch, then clean up: an interruption before the switch leaves the old layout in charge.
+    path = os.path.join(db_dir, _LAYOUT)
+    if layout is not None:
+        layout.save(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    if old is not None:
+        for name in old.names:
+            drop_backend(db_dir, backend, name)
+    else:
+        drop_backend(db_dir, backend)
+    return moved
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Inspect, rebuild and reshard a sharded index.")
+    ap.add_argument("--stats", action="store_true", help="Chunks and files per shard")
+    ap.add_argument("--rebuild", nargs="+", default=None, metavar="SHARD", help="Drop and re-ingest these shards")
+    ap.add_argument("--workers", type=int, default=None, help="Parse workers for --rebuild")
+    ap.add_argument("--reshard", action="store_true", help="Move every chunk to the layout given by --by")
+    ap.add_argument("--by", choices=["none", "folder", "hash"], default=None)
+    ap.add_argument("--shards", type=int, default=None, help="Hash shards (default: ACADEMYRAG_SHARDS, or "
+                                                             "enough to stay under ACADEMYRAG_SHARD_MAX_CHUNKS)")
+    ap.add_argument("--root", type=str, default=None, help="Folder layout root (ACADEMYRAG_SHARD_ROOT)")
+    args = ap.parse_args()
+
+    import time
+    from .store import get_store
+    from .manifest import load_manifest
+    db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
+    backend = os.getenv("ACADEMYRAG_STORE", "chroma")
+    if args.reshard:
+        if args.by is None:
+            ap.error("--reshard needs --by")
+        shards = args.shards
+        cap = int(os.getenv("ACADEMYRAG_SHARD_MAX_CHUNKS", "0"))
+        if args.by == "hash" and shards is None and cap:
+            # Twice the even split: files aren't equal in size, and courses keep growing.
+            shards = max(1, -(-2 * get_store().count() // cap))
+        t0 = time.perf_counter()
+        moved = reshard(db_dir, backend, new_layout(args.by, shards, args.root) if args.by != "none" else None)
+        print(f"[OK] Moved {moved} chunks in {time.perf_counter() - t0:0.1f}s.")
+    else:
+        store = get_store()
+        if getattr(store, "layout", None) is None:
+            raise SystemExit("[INFO] The index is not sharded (set ACADEMYRAG_SHARD_BY for a new index, "
+                             "or --reshard --by folder|hash).")
+        if args.rebuild:
+            t0 = time.perf_counter()
+            names = store.layout.rebuilding.get("shards") or args.rebuild  # resuming takes precedence
+            n = rebuild(store, args.rebuild, workers=args.workers)
+            print(f"[OK] Rebuilt {', '.join(names)}: {n} chunks embedded in {time.perf_counter() - t0:0.1f}s.")
+        if args.stats or not args.rebuild:
+            files = defaultdict(int)
+            for p in load_manifest().files:
+                files[store.layout.route(p)] += 1
+            print(f"[STATS] layout: {store.layout.describe()}")
+            for name, n in store.stats().items():
+                over = "  (over ACADEMYRAG_SHARD_MAX_CHUNKS)" if store.max_chunks and n > store.max_chunks else ""
+                print(f"[STATS] {name}: {n} chunks, {files[name]} files{over}")
@@ -1,16 +1,112 @@
+"""
+Vector store backends.
+
+The pipeline talks to a VectorStore: upsert/delete/get/query/count with
+Chroma's keyword arguments and result shapes, so callers don't care which
+backend is behind it. ACADEMYRAG_STORE selects it:
+
+- chroma  (default) chromadb.PersistentClient, collection "academyrag"
+- flat    memory-mapped NumPy matrix with exact search (rag/flat_store.py)
+
+Both live under ACADEMYRAG_DB_DIR. Either can be split into shards, one per
+course folder or hash partition, queried concurrently (rag/shards.py).
+"""
+
 import os
-import chromadb
-from chromadb.utils import embedding_functions
+from typing import List, Dict, Any, Optional, Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .catalog import Selection
+
+DEFAULT_INCLUDE = ("documents", "metadatas")
+
+class VectorStore:
+    """The subset of the Chroma collection API used by ingest and retrieval."""
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+               embeddings: Sequence[Sequence[float]]):
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = DEFAULT_INCLUDE,
+            limit: Optional[int] = None, offset: Optional[int] = None) -> Dict[str, Any]:
+        """{"ids": [...], "documents": [...], ...} for the given ids, or a page of all chunks."""
+        raise NotImplementedError
+
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 10,
+              include: Sequence[str] = DEFAULT_INCLUDE + ("distances",),
+              selection: Optional["Selection"] = None) -> Dict[str, Any]:
+        """
+        Nearest chunks per query vector; every field is a list of lists, one
+        per query. A catalog Selection limits the search to that slice.
+        """
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+class ChromaStore(VectorStore):
+    def __init__(self, db_dir: str, name: str = "academyrag"):
+        import chromadb
+        self._client = chromadb.PersistentClient(path=db_dir)
+        self._collection = self._client.get_or_create_collection(name)
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self._collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def delete(self, ids):
+        self._collection.delete(ids=ids)
+
+    def get(self, ids=None, include=DEFAULT_INCLUDE, limit=None, offset=None):
+        return self._collection.get(ids=ids, include=list(include), limit=limit, offset=offset)
+
+    def query(self, query_embeddings, n_results=10, include=DEFAULT_INCLUDE + ("distances",), selection=None):
+        return self._collection.query(query_embeddings=query_embeddings, n_results=n_results,
+                                      include=list(include),
+                                      where=selection.where() if selection is not None else None)
+
+    def count(self) -> int:
+        return self._collection.count()
+
+def open_backend(db_dir: str, backend: str, shard: Optional[str] = None) -> VectorStore:
+    """The unsharded store, or one shard of a sharded index."""
+    if backend == "flat":
+        from .flat_store import FlatStore
+        path = os.path.join(db_dir, "flat") if shard is None else os.path.join(db_dir, "shards", shard)
+        return FlatStore(path, dtype=os.getenv("ACADEMYRAG_FLAT_DTYPE", "float32"))
+    if backend == "chroma":
+        return ChromaStore(db_dir, "academyrag" if shard is None else f"academyrag_{shard}")
+    raise ValueError(f"Unknown ACADEMYRAG_STORE={backend!r} (expected 'chroma' or 'flat')")
+
+def drop_backend(db_dir: str, backend: str, shard: Optional[str] = None):
+    """Delete a store's data: a shard about to be rebuilt, or the old layout after a reshard."""
+    if backend == "flat":
+        import shutil
+        shutil.rmtree(os.path.join(db_dir, "flat") if shard is None else os.path.join(db_dir, "shards", shard),
+                      ignore_errors=True)
+    elif backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=db_dir)
+        name = "academyrag" if shard is None else f"academyrag_{shard}"
+        if name in [c if isinstance(c, str) else c.name for c in client.list_collections()]:
+            client.delete_collection(name)
+    else:
+        raise ValueError(f"Unknown ACADEMYRAG_STORE={backend!r} (expected 'chroma' or 'flat')")
 
-_client = None
-_collection = None
+_store = None
 
-def get_store():
-    global _client, _collection
-    if _client is None:
+def get_store() -> VectorStore:
+    global _store
+    if _store is None:
         db_dir = os.getenv("ACADEMYRAG_DB_DIR", "./data/index")
         os.makedirs(db_dir, exist_ok=True)
-        _client = chromadb.PersistentClient(path=db_dir)
-    if _collection is None:
-        _collection = _client.get_or_create_collection("academyrag")
-    return _collection
+        backend = os.getenv("ACADEMYRAG_STORE", "chroma")
+        from .shards import load_layout, ShardedStore
+        layout = load_layout(db_dir)
+        if layout is not None:
+            _store = ShardedStore(db_dir, backend, layout)
+        else:
+            _store = open_backend(db_dir, backend)
+    return _store
@@ -0,0 +1,332 @@
+"""
+Lightweight tracing and metrics.
+
+    with trace.span("retrieve", queries=4) as sp:
+        ...
+        trace.count("embed_cache_hits_total", 12)
+
+Spans nest per thread/task (contextvars). When the outermost span of a
+request ends, the whole trace is appended to the trace file as one JSON line:
+
+    {"trace": "retrieve", "start": 1718000000.0, "dur_ms": 41.2,
+     "spans": [{"id": 1, "parent": null, "name": "retrieve", "start_ms": 0.0, "dur_ms": 41.2, "attrs": {...}}, ...]}
+
+A trace keeps at most ACADEMYRAG_TRACE_MAX_SPANS spans of each name (an
+ingest run opens read/chunk/parse spans per file); later ones are folded
+into "aggregated": {"chunk": {"n": 950, "total_ms": ..., "max_ms": ...}},
+so a trace's size doesn't grow with the corpus.
+
+Span durations also feed a per-name histogram, and count() feeds counters;
+both are rendered in Prometheus text format by render_prometheus() and
+served on ACADEMYRAG_METRICS_PORT (GET /metrics) when that is set.
+
+Tracing is off unless enabled; span() then returns a shared no-op and
+count() returns immediately, so instrumented code pays one flag check.
+
+Env:
+  ACADEMYRAG_TRACE         1 enables tracing at import (the app enables it unless 0)
+  ACADEMYRAG_TRACE_FILE    default ./data/traces.jsonl ("" = don't write traces)
+  ACADEMYRAG_TRACE_MAX_SPANS  spans kept per name in one trace, default 50
+  ACADEMYRAG_METRICS_PORT  serve Prometheus metrics on this port once tracing is on
+  ACADEMYRAG_METRICS_HOST  interface for the metrics endpoint, default 127.0.0.1
+
+CLI:
+  python -m rag.trace --summary                # p50/p95/max per span name from the trace file
+  python -m rag.trace --summary --last 200
+"""
+
+import os
+import json
+import time
+import argparse
+import itertools
+import threading
+import contextvars
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Histogram buckets for span durations, in ms.
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_enabled = os.getenv("ACADEMYRAG_TRACE", "0") == "1"
+_max_spans = max(1, int(os.getenv("ACADEMYRAG_TRACE_MAX_SPANS", "50")))
+_current: contextvars.ContextVar = contextvars.ContextVar("academyrag_span", default=None)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+_hist: Dict[str, List[float]] = {}  # name -> [bucket counts..., +Inf count, sum]
+_server = None
+
+def enabled() -> bool:
+    return _enabled
+
+def enable():
+    global _enabled
+    _enabled = True
+    port = os.getenv("ACADEMYRAG_METRICS_PORT")
+    if port:
+        serve_metrics(int(port))
+
+def disable():
+    global _enabled
+    _enabled = False
+
+class Span:
+    __slots__ = ("id", "name", "attrs", "parent", "root", "start", "dur_ms", "spans", "kept", "aggregated",
+                 "_t0", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = next(_ids)
+        self.name = name
+        self.attrs = attrs
+        self.dur_ms = None
+        # Filled in on the root span only.
+        self.spans: List["Span"] = []
+        self.kept: Dict[str, int] = {}
+        self.aggregated: Dict[str, List[float]] = {}  # name -> [count, total ms, max ms]
+
+    def __enter__(self) -> "Span":
+        self.parent = _current.get()
+        self.root = self.parent.root if self.parent is not None else self
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        self.dur_ms = (time.perf_counter() - self._t0) * 1000.0
+        _current.reset(self._token)
+        if etype is not None:
+            self.attrs["error"] = etype.__name__
+        self._close()
+        return False
+
+    def _close(self):
+        root = self.root
+        _observe(self.name, self.dur_ms)
+        with _lock:  # children close on several threads (ingest stages)
+            n = root.kept.get(self.name, 0)
+            if n < _max_spans or root is self:
+                root.spans.append(self)
+                root.kept[self.name] = n + 1
+            else:
+                agg = root.aggregated.setdefault(self.name, [0, 0.0, 0.0])
+                agg[0] += 1
+                agg[1] += self.dur_ms
+                agg[2] = max(agg[2], self.dur_ms)
+        if root is self:
+            _write_trace(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """This trace's spans in start order, each with its nesting depth."""
+        by_id = {s.id: s for s in self.spans}
+        rows = []
+        for s in sorted(self.spans, key=lambda s: (s.start, s.id)):
+            depth, p = 0, s.parent
+            while p is not None and p.id in by_id:
+                depth += 1
+                p = p.parent
+            rows.append({"name": s.name, "depth": depth, "start_ms": (s.start - self.start) * 1000.0,
+                         "dur_ms": s.dur_ms, "attrs": s.attrs})
+        for name, (n, total, mx) in sorted(self.aggregated.items()):
+            rows.append({"name": name, "depth": 1, "start_ms": None, "dur_ms": total,
+                         "attrs": {"more_spans": int(n), "max_ms": round(mx, 1)}})
+        return rows
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        return []
+
+_NOOP = _NoopSpan()
+
+def span(name: str, **attrs):
+    """Context manager timing a block as a child of the current span."""
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+def record(name: str, start: float, dur_ms: float, **attrs):
+    """
+    Add an already-measured span (start = time.time() at its start) under
+    the current span; for generators, whose body can't hold a span open
+    across yields without leaking it into the consumer.
+    """
+    if not _enabled:
+        return
+    s = Span(name, attrs)
+    s.parent = _current.get()
+    s.root = s.parent.root if s.parent is not None else s
+    s.start = start
+    s.dur_ms = dur_ms
+    s._close()
+
+def bind(fn):
+    """fn wrapped to run under the current span, e.g. as a worker thread's target."""
+    if not _enabled:
+        return fn
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def count(name: str, value: float = 1, **labels):
+    if not _enabled:
+        return
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] += value
+
+def _observe(name: str, dur_ms: float):
+    with _lock:
+        h = _hist.get(name)
+        if h is None:
+            h = _hist[name] = [0.0] * (len(BUCKETS_MS) + 2)
+        for i, b in enumerate(BUCKETS_MS):
+            if dur_ms <= b:
+                h[i] += 1
+        h[-2] += 1
+        h[-1] += dur_ms
+
+def _write_trace(root: Span):
+    path = os.getenv("ACADEMYRAG_TRACE_FILE", "./data/traces.jsonl")
+    if not path:
+        return
+    line = json.dumps({
+        "trace": root.name, "start": root.start, "dur_ms": root.dur_ms,
+        "spans": [{"id": s.id, "parent": s.parent.id if s.parent is not None else None, "name": s.name,
+                   "start_ms": (s.start - root.start) * 1000.0, "dur_ms": s.dur_ms, "attrs": s.attrs}
+                  for s in root.spans],
+        **({"aggregated": {name: {"n": int(n), "total_ms": total, "max_ms": mx}
+                           for name, (n, total, mx) in root.aggregated.items()}} if root.aggregated else {}),
+    }, default=str)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # One write per trace; O_APPEND keeps lines whole across threads/processes.
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+# ---- Prometheus -------------------------------------------------------------
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        hist = {name: list(h) for name, h in _hist.items()}
+    seen = set()
+    for (name, labels), val in counters:
+        metric = f"academyrag_{name}"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels(labels)} {val:g}")
+    if hist:
+        lines.append("# TYPE academyrag_span_duration_ms histogram")
+    for name in sorted(hist):
+        h = hist[name]
+        for b, c in zip(BUCKETS_MS, h):
+            lines.append(f'academyrag_span_duration_ms_bucket{_labels([("span", name), ("le", str(b))])} {c:g}')
+        lines.append(f'academyrag_span_duration_ms_bucket{_labels([("span", name), ("le", "+Inf")])} {h[-2]:g}')
+        lines.append(f'academyrag_span_duration_ms_count{_labels([("span", name)])} {h[-2]:g}')
+        lines.append(f'academyrag_span_duration_ms_sum{_labels([("span", name)])} {h[-1]:g}')
+    return "\n".join(lines) + "\n"
+
+def serve_metrics(port: int, host: Optional[str] = None):
+    """
+    Serve render_prometheus() at http://host:port/metrics from a daemon thread
+    (once per process); host defaults to ACADEMYRAG_METRICS_HOST or loopback.
+    """
+    global _server
+    if _server is not None:
+        return _server
+    host = host or os.getenv("ACADEMYRAG_METRICS_HOST", "127.0.0.1")
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        _server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"[WARN] Metrics endpoint not started on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="academyrag-metrics", daemon=True).start()
+    print(f"[INFO] Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return _server
+
+def summarize(path: str, last: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    """
+    p50/p95/max and count per span name over the traces in a trace file.
+    Percentiles cover the spans a trace kept; n, max and total include the
+    aggregated ones.
+    """
+    durs: Dict[str, List[float]] = defaultdict(list)
+    extra: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    for line in lines[-last:] if last else lines:
+        try:
+            tr = json.loads(line)
+        except ValueError:
+            continue
+        for s in tr.get("spans", []):
+            durs[s["name"]].append(s["dur_ms"])
+        for name, agg in tr.get("aggregated", {}).items():
+            e = extra[name]
+            e[0] += agg["n"]
+            e[1] += agg["total_ms"]
+            e[2] = max(e[2], agg["max_ms"])
+    out = {}
+    for name, vals in durs.items():
+        v = np.asarray(vals)
+        n, total, mx = extra.get(name, (0, 0.0, 0.0))
+        out[name] = {"n": len(v) + n, "p50": float(np.percentile(v, 50)), "p95": float(np.percentile(v, 95)),
+                     "max": max(float(v.max()), mx), "total": float(v.sum()) + total}
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Summarize recorded traces.")
+    ap.add_argument("--file", default=os.getenv("ACADEMYRAG_TRACE_FILE", "./data/traces.jsonl"))
+    ap.add_argument("--summary", action="store_true", help="Latency per span name")
+    ap.add_argument("--last", type=int, default=None, help="Only the last N traces")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"[INFO] No trace file at {args.file} (set ACADEMYRAG_TRACE=1 to record).")
+    else:
+        stats = summarize(args.file, args.last)
+        name_w = max([len(n) for n in stats] + [4])
+        print(f"{'span'.ljust(name_w)}  {'n':>7}  {'p50 ms':>9}  {'p95 ms':>9}  {'max ms':>9}  {'total s':>9}")
+        for name, s in sorted(stats.items(), key=lambda kv: -kv[1]["total"]):
+            print(f"{name.ljust(name_w)}  {s['n']:>7}  {s['p50']:9.2f}  {s['p95']:9.2f}  {s['max']:9.2f}  "
+                  f"{s['total'] / 1000.0:9.2f}")
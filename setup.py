@@ -16,5 +16,9 @@ setup(
         'scikit-learn>=1.5.1',
         'pydantic>=2.8.2',
         'tqdm>=4.66.4',
+        'numpy>=1.26',
     ],
+    entry_points={
+        'console_scripts': ['academyrag=rag.cli:main'],
+    },
 )
\ No newline at end of file
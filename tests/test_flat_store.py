@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from rag.flat_store import FlatStore
+
+def _fill(path, n=300, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype(np.float32)
+    store = FlatStore(str(path))
+    ids = [f"c{i}" for i in range(n)]
+    store.upsert(ids, [f"text {i}" for i in ids], [{"source_path": f"{i}.md"} for i in ids], vecs)
+    return store, vecs
+
+def test_upsert_overwrite_delete_round_trip(tmp_path):
+    store, vecs = _fill(tmp_path / "flat", n=50)
+    raw = np.random.default_rng(0).normal(size=vecs.shape).astype(np.float32)
+    assert np.array_equal(vecs, raw)  # upsert normalizes a copy, not the caller's array
+    assert store.count() == 50
+
+    # Overwriting an id replaces its vector, text and metadata.
+    store.upsert(["c3"], ["new text"], [{"source_path": "new.md"}], vecs[7:8])
+    assert store.count() == 50
+    got = store.get(ids=["c3"], include=["documents", "metadatas"])
+    assert got["documents"] == ["new text"] and got["metadatas"] == [{"source_path": "new.md"}]
+    hit = store.query(vecs[7:8], n_results=2, include=("distances",))
+    assert set(hit["ids"][0]) == {"c3", "c7"}
+    np.testing.assert_allclose(hit["distances"][0], 0.0, atol=1e-5)
+
+    store.delete(["c7", "missing"])
+    assert store.count() == 49
+    assert store.get(ids=["c7"])["ids"] == []
+    assert store.query(vecs[7:8], n_results=1)["ids"] == [["c3"]]
+
+    # The same state comes back from disk.
+    reopened = FlatStore(str(tmp_path / "flat"))
+    assert reopened.count() == 49
+    assert reopened.query(vecs[7:8], n_results=1)["ids"] == [["c3"]]
+    assert reopened.query(vecs[20:21], n_results=1)["ids"] == [["c20"]]
+    assert reopened.get(ids=["c3"], include=["documents"])["documents"] == ["new text"]
+
+@pytest.mark.parametrize("kind", ["int8", "pq"])
+def test_compress_small_index_rescored_search_is_exact(tmp_path, kind):
+    store, vecs = _fill(tmp_path / "flat")  # far fewer rows than the 256 PQ codewords need
+    rng = np.random.default_rng(1)
+    q = vecs[:20] + rng.normal(scale=0.3, size=(20, vecs.shape[1])).astype(np.float32)
+    exact = store.query(q, n_results=5, include=("distances",))
+
+    store.compress(kind)
+    if kind == "pq":
+        books = store._quant.codebooks
+        assert np.abs(books).sum(axis=2).min() > 0  # no untrained all-zero codewords
+    comp = store.query(q, n_results=5, include=("distances",))
+    assert comp["ids"] == exact["ids"]
+    np.testing.assert_allclose(comp["distances"], exact["distances"], atol=1e-5)
+
+    # Rows added after compression are encoded on upsert; reopening maps the codes again.
+    store.upsert(["extra"], ["extra"], [{"source_path": "extra.md"}], vecs[:1] * 2)
+    reopened = FlatStore(str(tmp_path / "flat"))
+    assert reopened.stats()["compression"] == kind
+    assert set(reopened.query(vecs[:1], n_results=2)["ids"][0]) == {"c0", "extra"}
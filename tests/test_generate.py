@@ -0,0 +1,46 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rag import generate
+
+class _StandIn(BaseHTTPRequestHandler):
+    """OpenAI-compatible /v1/chat/completions that fails once with a 503, then streams."""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(body)
+        if len(self.requests) == 1:
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "overloaded"}}')
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for tok in ["Hello", ", ", "world"]:
+            event = {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+def test_stream_chat_retries_and_streams(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("ACADEMYRAG_LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv("ACADEMYRAG_LLM_PROVIDER", "openai")
+    monkeypatch.setattr(generate, "_client", None)  # built from the env on first request
+    try:
+        tokens = list(generate.stream_chat("system", "question"))
+    finally:
+        server.shutdown()
+    assert tokens == ["Hello", ", ", "world"]
+    assert len(_StandIn.requests) == 2
+    assert _StandIn.requests[1]["stream"] is True
+    assert _StandIn.requests[1]["messages"][1] == {"role": "user", "content": "question"}
@@ -0,0 +1,74 @@
+import os
+import sys
+import random
+import sqlite3
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _ingest(data, index, chunker="words", size=250):
+    env = {**os.environ, "PYTHONPATH": ROOT, "ACADEMYRAG_DB_DIR": str(index), "ACADEMYRAG_STORE": "flat",
+           "ACADEMYRAG_EMBED_PROVIDER": "stub", "ACADEMYRAG_EMBED_CACHE": "0", "ACADEMYRAG_TRACE_FILE": ""}
+    out = subprocess.run([sys.executable, "-m", "rag.ingest", "--path", str(data), "--workers", "1",
+                          "--chunker", chunker, "--chunk_size", str(size), "--chunk_overlap", "0"],
+                         env=env, cwd=str(data.parent), capture_output=True, text=True, check=True)
+    return out.stdout
+
+def test_reingest_after_edit_is_a_noop(tmp_path):
+    data, index = tmp_path / "data", tmp_path / "index"
+    data.mkdir()
+    rng = random.Random(1)
+    words = [f"w{rng.randint(0, 5000)}" for _ in range(600)]
+    (data / "a.txt").write_text(" ".join(words))
+    (data / "b.txt").write_text(" ".join(f"z{i}" for i in range(100)))
+    _ingest(data, index)
+
+    # One changed word: the edited chunk near-duplicates the chunk it replaces.
+    (data / "a.txt").write_text(" ".join(["changed"] + words[1:]))
+    assert "1 changed, 1 unchanged" in _ingest(data, index)
+
+    out = _ingest(data, index)
+    assert "0 changed, 2 unchanged" in out
+    assert "No documents to embed" in out
+    assert "near-duplicate" not in out
+    db = sqlite3.connect(str(index / "dedup.sqlite"))
+    assert db.execute("SELECT COUNT(*) FROM aliases a JOIN sigs s ON s.id = a.id").fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM aliases a LEFT JOIN sigs s ON s.id = a.canonical "
+                      "WHERE s.id IS NULL").fetchone()[0] == 0
+
+def _stored(index):
+    sys.path.insert(0, ROOT)
+    from rag.flat_store import FlatStore
+    res = FlatStore(str(index / "flat")).get(include=["documents", "metadatas", "embeddings"])
+    return {cid: (doc, meta, emb) for cid, doc, meta, emb in
+            zip(res["ids"], res["documents"], res["metadatas"], res["embeddings"])}
+
+def test_token_chunks_keep_ids_and_refresh_offsets_after_an_insert(tmp_path):
+    data, index = tmp_path / "data", tmp_path / "index"
+    data.mkdir()
+    # One sentence per paragraph and one paragraph per chunk: two never fit in 50 tokens (or words).
+    rng = random.Random(2)
+    vocab = ("cost scale volume plant market value chain learning capacity policy price demand supply "
+             "labor output input margin share brand channel design quality service timing location").split()
+    paras = [" ".join(rng.choice(vocab) for _ in range(30)).capitalize() + "." for _ in range(6)]
+    (data / "a.md").write_text("\n\n".join(paras))
+    _ingest(data, index, "tokens", 50)
+    before = _stored(index)
+    assert len(before) == 6
+
+    paras[0] = "An inserted opening clause, " + paras[0]
+    text = "\n\n".join(paras)
+    (data / "a.md").write_text(text)
+    out = _ingest(data, index, "tokens", 50)
+    assert "Ingested 1 chunks" in out
+    after = _stored(index)
+    assert len(after) == 6
+    kept = set(before) & set(after)
+    assert len(kept) == 5
+    for cid, (doc, meta, emb) in after.items():
+        assert text[meta["char_start"]:meta["char_end"]] == doc
+        if cid in kept:
+            assert meta["char_start"] == before[cid][1]["char_start"] + len("An inserted opening clause, ")
+            assert np.allclose(emb, before[cid][2])